@@ -0,0 +1,168 @@
+import time
+import asyncio
+import inspect
+from dataclasses import dataclass, field
+from typing import Optional
+
+from video_processor import (get_ffmpeg_path, get_media_info, build_ffmpeg_command, estimate_output_frames, plan_thread_budget,
+                             _process_group_kwargs, _kill_process_group, _parse_ssim_percent)
+from encoding_profiles import DEFAULT_PROFILE, profile_preset, get_default_stats
+from ffmpeg_progress import ProgressParser, LineRingBuffer
+from ffmpeg_capabilities import MissingCapabilityError
+from renditions import rendition_output_paths
+from media_probe import check_media_supported
+from run_manifest import finalize_part, discard_part
+
+# asyncio front end for services: the same FFmpeg command as _execute_ffmpeg_command, run with
+# asyncio.create_subprocess_exec so no thread is blocked per job.
+#
+#     result = await process_video_async(JobSpec("in.mp4", "out.mp4", {"horizontal_flip": True}))
+#     async for result in process_batch_async(specs, concurrency=4, on_progress=print):
+#         ...
+
+@dataclass
+class JobSpec:
+    """One clip to render. settings are build_ffmpeg_command keyword arguments (horizontal_flip, text_to_overlay,
+    rotation_degrees, encoding_profile, renditions, noise_audio_path, similarity...). timeout is in seconds."""
+    input_path: str
+    output_path: str
+    settings: dict = field(default_factory=dict)
+    timeout: Optional[float] = None
+
+@dataclass
+class JobResult:
+    spec: JobSpec
+    status: str # 'done', 'failed', 'skipped' (unsupported input or FFmpeg build) or 'timeout'
+    output_paths: list = field(default_factory=list)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    progress: dict = field(default_factory=dict) # Last progress report
+    similarity: Optional[float] = None # SSIM percentage, if settings has similarity='full' or 'fast'
+
+async def _call(callback, *args):
+    # Progress callbacks may be plain functions or coroutine functions
+    try:
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e: # A broken callback must not stop the pipe from being drained
+        print(f"Warning: progress callback failed: {e}")
+
+async def run_ffmpeg_async(command, timeout=None, on_progress=None, expected_seconds=None):
+    """
+    Async counterpart of _run_ffmpeg: returns (returncode, stdout, stderr), keeping the last lines of each stream.
+    Raises asyncio.TimeoutError after timeout seconds; on timeout or cancellation FFmpeg's process group is killed.
+    on_progress(progress_dict) gets each parsed -progress block.
+    """
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                   **_process_group_kwargs())
+    stdout_ring, stderr_ring = LineRingBuffer(), LineRingBuffer()
+    parser = ProgressParser(expected_seconds)
+
+    async def read_stdout():
+        async for raw_line in process.stdout:
+            line = raw_line.decode("utf-8", "replace")
+            stdout_ring.append(line)
+            progress = parser.feed(line)
+            if progress is not None and on_progress is not None:
+                await _call(on_progress, progress)
+
+    async def read_stderr():
+        async for raw_line in process.stderr:
+            stderr_ring.append(raw_line.decode("utf-8", "replace"))
+
+    try:
+        await asyncio.wait_for(asyncio.gather(read_stdout(), read_stderr(), process.wait()), timeout)
+    finally:
+        if process.returncode is None:
+            # Timed out or cancelled: FFmpeg runs in its own process group, so stop it here
+            _kill_process_group(process)
+            await process.wait()
+    return process.returncode, stdout_ring.text(), stderr_ring.text()
+
+async def process_video_async(spec, ffmpeg_executable=None, on_progress=None, threads=None):
+    """
+    Renders one JobSpec and returns a JobResult. Outputs are written to .part files and renamed on success.
+    on_progress(spec, progress_dict) is called about twice a second (plain function or coroutine function).
+    Cancelling the task kills FFmpeg, removes the partial outputs and re-raises CancelledError.
+    """
+    start_time = time.monotonic()
+    ffmpeg_executable = ffmpeg_executable or await asyncio.to_thread(get_ffmpeg_path)
+    settings = dict(spec.settings)
+    media_info = await asyncio.to_thread(get_media_info, ffmpeg_executable, spec.input_path)
+    unsupported_reason = check_media_supported(media_info)
+    if unsupported_reason:
+        return JobResult(spec, "skipped", error=unsupported_reason)
+
+    output_paths = [spec.output_path] + list(rendition_output_paths(spec.output_path, settings.get("renditions")).values())
+    try:
+        command = build_ffmpeg_command(ffmpeg_executable, spec.input_path, spec.output_path, write_parts=True, progress=True,
+                                       threads=threads, media_info=media_info, **settings)
+    except MissingCapabilityError as e:
+        return JobResult(spec, "skipped", error=str(e))
+    expected_frames = estimate_output_frames(media_info, settings.get("playback_speed", 1.0))
+    last_progress = {}
+
+    async def track_progress(progress):
+        last_progress.update(progress)
+        if on_progress is not None:
+            await _call(on_progress, spec, progress)
+
+    def discard_parts():
+        for path in output_paths:
+            discard_part(path)
+
+    try:
+        returncode, _, stderr = await run_ffmpeg_async(command, timeout=spec.timeout, on_progress=track_progress,
+                                                       expected_seconds=expected_frames / 30)
+    except asyncio.TimeoutError:
+        discard_parts()
+        return JobResult(spec, "timeout", error=f"timed out after {spec.timeout:g}s", elapsed=time.monotonic() - start_time,
+                         progress=last_progress)
+    except BaseException:
+        # Cancelled (or FFmpeg not found): never leave a partial file behind
+        discard_parts()
+        raise
+    elapsed = time.monotonic() - start_time
+    if returncode != 0:
+        discard_parts()
+        lines = stderr.strip().splitlines()
+        return JobResult(spec, "failed", error=lines[-1] if lines else f"FFmpeg exited with code {returncode}",
+                         elapsed=elapsed, progress=last_progress)
+    # The main output goes last, so its presence means the whole job finished
+    for path in reversed(output_paths):
+        finalize_part(path)
+    preset = profile_preset(settings.get("encoding_profile", DEFAULT_PROFILE), settings.get("preset"))
+    get_default_stats().record(preset, last_progress.get("frame") or expected_frames, elapsed)
+    return JobResult(spec, "done", output_paths=output_paths, elapsed=elapsed, progress=last_progress,
+                     similarity=_parse_ssim_percent(stderr) if settings.get("similarity") else None)
+
+async def process_batch_async(specs, concurrency=None, ffmpeg_executable=None, on_progress=None):
+    """
+    Renders JobSpecs with at most `concurrency` FFmpeg processes at once (default: from the core count, as in
+    process_videos) and yields JobResults as they finish. Leaving the loop early, or cancelling the consumer,
+    cancels the remaining jobs and kills their FFmpeg processes.
+    """
+    specs = list(specs)
+    if not specs:
+        return
+    ffmpeg_executable = ffmpeg_executable or await asyncio.to_thread(get_ffmpeg_path)
+    jobs, threads_per_job = plan_thread_budget(concurrency, file_count=len(specs))
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run(spec):
+        async with semaphore:
+            try:
+                return await process_video_async(spec, ffmpeg_executable, on_progress, threads=threads_per_job if jobs > 1 else None)
+            except (OSError, ValueError) as e:
+                return JobResult(spec, "failed", error=str(e))
+
+    tasks = [asyncio.ensure_future(run(spec)) for spec in specs]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled jobs to kill FFmpeg and clean up their .part files
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,108 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class BackgroundJobManager:
+    """
+    Runs processing jobs on a thread pool outside of the caller (e.g. a Streamlit script run).
+    Callers submit jobs, then poll snapshot() for their state and can cancel() them at any time.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bgjob")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._cancel_events = {}
+
+    def submit(self, label, fn, *args, **kwargs):
+        """
+        Queues fn(*args, report=..., cancel_event=..., **kwargs) and returns its job id.
+        fn can call report(**fields) to publish progress (e.g. progress=0.5, message="Encoding").
+        Its return value is stored as the job's result; an exception marks the job failed.
+        """
+        job_id = uuid.uuid4().hex
+        cancel_event = threading.Event()
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "label": label,
+                "status": QUEUED,
+                "progress": 0.0,
+                "message": "Waiting for a free worker",
+                "result": None,
+                "error": None,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._cancel_events[job_id] = cancel_event
+        self._executor.submit(self._run, job_id, fn, args, kwargs, cancel_event)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, fn, args, kwargs, cancel_event):
+        if cancel_event.is_set():
+            self._update(job_id, status=CANCELLED, message="Cancelled", finished_at=time.time())
+            return
+        self._update(job_id, status=RUNNING, message="Starting", started_at=time.time())
+
+        def report(**fields):
+            self._update(job_id, **fields)
+
+        try:
+            result = fn(*args, report=report, cancel_event=cancel_event, **kwargs)
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=str(e), message="Failed", finished_at=time.time())
+            return
+
+        if cancel_event.is_set():
+            self._update(job_id, status=CANCELLED, result=result, message="Cancelled", finished_at=time.time())
+        else:
+            ok = result.get("ok", True) if isinstance(result, dict) else bool(result)
+            self._update(job_id, status=DONE if ok else FAILED, result=result, progress=1.0,
+                         message="Finished" if ok else "Failed", finished_at=time.time())
+
+    def cancel(self, job_id):
+        """Requests cancellation. Queued jobs never start; running jobs are expected to watch their cancel_event."""
+        with self._lock:
+            cancel_event = self._cancel_events.get(job_id)
+            job = self._jobs.get(job_id)
+            if cancel_event is None or job is None or job["status"] in FINISHED_STATES:
+                return False
+            cancel_event.set()
+            job["message"] = "Cancelling..."
+        return True
+
+    def snapshot(self, job_id):
+        """Returns a copy of the job's state dict, or None if the id is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def is_active(self, job_ids):
+        """True while any of the given jobs is still queued or running."""
+        with self._lock:
+            return any(self._jobs[j]["status"] not in FINISHED_STATES for j in job_ids if j in self._jobs)
+
+    def forget(self, job_ids):
+        """Drops finished jobs from the registry."""
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job and job["status"] in FINISHED_STATES:
+                    del self._jobs[job_id]
+                    self._cancel_events.pop(job_id, None)
@@ -0,0 +1,179 @@
+import os
+import csv
+import json
+import time
+import threading
+
+from encoding_profiles import ENCODING_PROFILES
+from renditions import RENDITION_PRESETS
+from ken_burns import KEN_BURNS_ENGINES
+
+# Batch manifests: one row per input with its own settings, as CSV (a header row, then one row per input) or
+# JSON lines (one object per line). They are read one row at a time, so a manifest with tens of thousands of
+# rows is never held in memory. Each finished row gets a JSON line in a results file, written as it finishes.
+MANIFEST_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl"}
+
+# Text settings the GUI starts with, used for rows that give a text but not these
+TEXT_DEFAULTS = {"text_position": "Bottom Center", "font_size": 24, "text_color": "white", "text_bg_color": "black@0.5"}
+TEXT_POSITIONS = ("Top Center", "Middle Center", "Bottom Center")
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "y", "on"):
+        return True
+    if text in ("0", "false", "no", "n", "off"):
+        return False
+    raise ValueError(f"'{value}' is not true or false")
+
+def _choice(options):
+    def convert(value):
+        if value not in options:
+            raise ValueError(f"'{value}' is not one of: {', '.join(options)}")
+        return value
+    return convert
+
+def _renditions(value):
+    names = value if isinstance(value, list) else [n.strip() for n in str(value).split(",") if n.strip()]
+    unknown = [n for n in names if n not in RENDITION_PRESETS]
+    if unknown:
+        raise ValueError(f"unknown rendition(s) {', '.join(unknown)} (available: {', '.join(RENDITION_PRESETS)})")
+    return list(dict.fromkeys(names))
+
+# Columns a row may set, with the conversion of their (CSV: text) values. They are _execute_ffmpeg_command
+# settings, except noise_file (resolved once per distinct file; 'none' for no background noise).
+# similarity is checked against SIMILARITY_MODES by the caller.
+ROW_SETTINGS = {
+    "horizontal_flip": _boolean,
+    "text_to_overlay": str,
+    "text_position": _choice(TEXT_POSITIONS),
+    "font_size": float,
+    "text_color": str,
+    "text_bg_color": str,
+    "text_bold": _boolean,
+    "text_italic": _boolean,
+    "rotation_degrees": float,
+    "playback_speed": float,
+    "random_zoom_pan": _boolean,
+    "zoom_end_scale": float,
+    "encoding_profile": _choice(sorted(ENCODING_PROFILES)),
+    "renditions": _renditions,
+    "similarity": str,
+    "segments": int,
+    "ken_burns": _choice(sorted(KEN_BURNS_ENGINES)),
+    "keep_source_fps": _boolean,
+    "seed": str,
+    "noise_file": str,
+}
+# Short column names accepted for the longer setting names
+COLUMN_ALIASES = {"text": "text_to_overlay", "hflip": "horizontal_flip", "rotation": "rotation_degrees", "speed": "playback_speed",
+                  "zoom": "zoom_end_scale", "profile": "encoding_profile", "noise": "noise_file", "keep_fps": "keep_source_fps"}
+
+def manifest_format(path):
+    """'csv' or 'jsonl' from the manifest's extension; raises ValueError for anything else."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in MANIFEST_EXTENSIONS:
+        raise ValueError(f"Manifest '{path}' must be .csv or .jsonl")
+    return MANIFEST_EXTENSIONS[extension]
+
+def iter_manifest(path):
+    """
+    Yields (row_number, row) for each row of a CSV or JSON-lines manifest, reading it as it goes.
+    row_number counts data rows from 1. Blank lines and CSV cells are skipped. A line that is not valid JSON
+    is yielded as (row_number, ValueError) so the caller can record it and carry on.
+    """
+    kind = manifest_format(path)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if kind == "csv":
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                yield row_number, {k.strip(): v for k, v in row.items() if k and v is not None and v.strip() != ""}
+            return
+        row_number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("a row must be a JSON object")
+            except ValueError as e:
+                yield row_number, ValueError(f"invalid JSON ({e})")
+                continue
+            yield row_number, {k: v for k, v in row.items() if v is not None and v != ""}
+
+def parse_row(row, base_folder, output_folder, defaults=None):
+    """
+    (input_path, output_path, settings) of a manifest row. 'input' is required; relative paths are relative to
+    base_folder (the manifest's folder). 'output' defaults to output_folder/tt_<input name>. Settings start from
+    defaults (the command line's) and are overridden by the row's columns (see ROW_SETTINGS and COLUMN_ALIASES).
+    Raises ValueError for a missing input, an unknown column or a value that does not convert.
+    """
+    row = {COLUMN_ALIASES.get(key, key): value for key, value in row.items()}
+    input_path = row.pop("input", None)
+    if not input_path:
+        raise ValueError("no 'input' column")
+    input_path = os.path.join(base_folder, os.path.expanduser(str(input_path)))
+    output_path = row.pop("output", None)
+    output_path = (os.path.join(base_folder, os.path.expanduser(str(output_path))) if output_path
+                   else os.path.join(output_folder, f"tt_{os.path.basename(input_path)}"))
+    unknown = sorted(set(row) - set(ROW_SETTINGS))
+    if unknown:
+        raise ValueError(f"unknown column(s) {', '.join(unknown)}")
+    settings = dict(defaults or {})
+    for key, value in row.items():
+        try:
+            settings[key] = ROW_SETTINGS[key](value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{key}: {e}")
+    if settings.get("text_to_overlay"):
+        for key, value in TEXT_DEFAULTS.items():
+            settings.setdefault(key, value)
+    return input_path, output_path, settings
+
+def default_results_path(manifest_path):
+    """Results file next to the manifest: 'batch.csv' -> 'batch.results.jsonl'."""
+    return os.path.splitext(manifest_path)[0] + ".results.jsonl"
+
+def finished_rows(results_path):
+    """Row numbers the results file records as done whose output still exists (read line by line)."""
+    rows = set()
+    if not os.path.isfile(results_path):
+        return rows
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # Last line of a run that was killed mid-write
+            if record.get("status") == "done" and record.get("output_path") and os.path.isfile(record["output_path"]):
+                rows.add(record["row"])
+    return rows
+
+class ResultWriter:
+    """Appends one JSON line per finished row to a results file, flushed right away so it can be followed
+    (tail -f) and survives a crash. Safe to share between worker threads."""
+
+    def __init__(self, path, append=False):
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        record = dict(record, recorded_at=round(time.time(), 3))
+        with self._lock:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+
+# x264 presets from fastest to slowest
+PRESET_ORDER = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+# Typical x264 encode speed of each preset relative to 'medium'. Only used to extrapolate
+# presets that have not been measured on this machine yet.
+RELATIVE_PRESET_SPEED = {
+    "ultrafast": 6.0,
+    "superfast": 4.5,
+    "veryfast": 3.3,
+    "faster": 2.3,
+    "fast": 1.7,
+    "medium": 1.0,
+    "slow": 0.6,
+    "slower": 0.3,
+    "veryslow": 0.12,
+}
+
+# Named encoding profiles. None means "leave the x264/FFmpeg default". Encoder threads come from the
+# per-job thread budget of the batch, not the profile.
+ENCODING_PROFILES = {
+    "draft": {
+        "description": "Fast turnaround, bigger files",
+        "preset": "veryfast",
+        "tune": None,
+        "rc_lookahead": 10,
+        "refs": 1,
+    },
+    "standard": {
+        "description": "Default libx264 settings (previous behaviour)",
+        "preset": "medium",
+        "tune": None,
+        "rc_lookahead": None,
+        "refs": None,
+    },
+    "archive": {
+        "description": "Smallest files, slow",
+        "preset": "slow",
+        "tune": "film",
+        "rc_lookahead": 60,
+        "refs": 5,
+    },
+}
+DEFAULT_PROFILE = "standard"
+
+# Measured encode fps per preset, shared by all runs on this machine
+DEFAULT_STATS_PATH = os.path.join(".cache", "encode_stats.json")
+# Weight of a new measurement in the running average
+STATS_SMOOTHING = 0.3
+
+def get_profile(name):
+    """Returns the profile dict for name, falling back to the default profile (with a warning) for unknown names."""
+    if name in ENCODING_PROFILES:
+        return ENCODING_PROFILES[name]
+    if name:
+        print(f"Warning: unknown encoding profile '{name}'. Using '{DEFAULT_PROFILE}'.")
+    return ENCODING_PROFILES[DEFAULT_PROFILE]
+
+def video_encoder_args(profile_name, crf=None, threads=None, preset=None):
+    """
+    FFmpeg output arguments for the video encoder of one job.
+    preset overrides the profile's preset (used by deadline mode); profile-specific lookahead and
+    reference-frame settings are then left to that preset's defaults.
+    """
+    profile = get_profile(profile_name)
+    args = ["-c:v", "libx264", "-preset", preset or profile["preset"]]
+    if profile["tune"]:
+        args.extend(["-tune", profile["tune"]])
+    if not preset or preset == profile["preset"]:
+        if profile["rc_lookahead"] is not None:
+            args.extend(["-rc-lookahead", str(profile["rc_lookahead"])])
+        if profile["refs"] is not None:
+            args.extend(["-refs", str(profile["refs"])])
+    if crf is not None:
+        args.extend(["-crf", str(crf)])
+    if threads:
+        args.extend(["-threads", str(threads)]) # Encoder (x264) threads
+    return args
+
+def profile_preset(profile_name, preset=None):
+    """The x264 preset a job with this profile (and optional deadline-mode override) actually uses."""
+    return preset or get_profile(profile_name)["preset"]
+
+class EncodeStats:
+    """Running average of measured output fps per x264 preset, persisted as JSON."""
+
+    def __init__(self, path=DEFAULT_STATS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, preset, frames, elapsed_seconds):
+        """Adds one finished job (frames produced in elapsed_seconds of wall time) to the average for preset."""
+        if not frames or elapsed_seconds <= 0:
+            return
+        fps = frames / elapsed_seconds
+        with self._lock:
+            stats = self.load()
+            entry = stats.get(preset)
+            if entry:
+                entry["fps"] = (1 - STATS_SMOOTHING) * entry["fps"] + STATS_SMOOTHING * fps
+                entry["samples"] += 1
+            else:
+                stats[preset] = {"fps": fps, "samples": 1}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def estimated_fps(self, preset):
+        """Measured fps for preset, or an extrapolation from the closest measured preset. None if nothing was measured."""
+        stats = self.load()
+        if preset in stats:
+            return stats[preset]["fps"]
+        measured = [p for p in PRESET_ORDER if p in stats]
+        if not measured:
+            return None
+        # Extrapolate from the measured preset nearest to the one asked for
+        nearest = min(measured, key=lambda p: abs(PRESET_ORDER.index(p) - PRESET_ORDER.index(preset)))
+        return stats[nearest]["fps"] * RELATIVE_PRESET_SPEED[preset] / RELATIVE_PRESET_SPEED[nearest]
+
+_default_stats = EncodeStats()
+
+def get_default_stats():
+    return _default_stats
+
+def choose_preset_for_deadline(total_frames, deadline_seconds, jobs=1, stats=None, fallback=None):
+    """
+    Deadline mode: returns the slowest preset whose predicted batch wall time (total_frames spread over
+    jobs parallel jobs, at the measured per-job fps) fits in deadline_seconds.
+    Returns 'ultrafast' if even that is predicted to miss the deadline, and fallback if nothing was measured yet.
+    """
+    stats = stats or _default_stats
+    for preset in reversed(PRESET_ORDER):
+        fps = stats.estimated_fps(preset)
+        if fps is None:
+            return fallback
+        if total_frames / (fps * max(1, jobs)) <= deadline_seconds:
+            return preset
+    return PRESET_ORDER[0]
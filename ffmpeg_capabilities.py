@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+import subprocess
+
+# What each FFmpeg binary can do, probed once and keyed by its real path + size + mtime
+DEFAULT_REGISTRY_PATH = os.path.join(".cache", "ffmpeg_capabilities.json")
+
+class MissingCapabilityError(Exception):
+    """Raised when a job needs a filter or encoder the FFmpeg build does not have."""
+
+def _run(binary, *args):
+    result = subprocess.run([binary, "-hide_banner", *args], capture_output=True, text=True, errors="replace", timeout=30)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, [binary, *args])
+    return result.stdout
+
+def _parse_filters(text):
+    """' TSC zoompan   V->V   Apply Zoom & Pan effect.' -> {'zoompan': {'timeline': True, 'slice_threads': True}}"""
+    filters = {}
+    for line in text.splitlines():
+        match = re.match(r"^\s*([T.])([S.])([C.])\s+(\S+)\s+\S+->\S+", line)
+        if match:
+            filters[match.group(4)] = {"timeline": match.group(1) == "T", "slice_threads": match.group(2) == "S"}
+    return filters
+
+def _parse_encoders(text):
+    """' V....D libx264   libx264 H.264 ...' -> {'libx264': {'type': 'video', 'frame_threads': False, ...}}"""
+    encoders = {}
+    types = {"V": "video", "A": "audio", "S": "subtitle"}
+    for line in text.splitlines():
+        match = re.match(r"^\s*([VAS])([F.])([S.])([X.])([B.])([D.])\s+(\S+)", line)
+        if match and match.group(7) != "=":
+            encoders[match.group(7)] = {
+                "type": types[match.group(1)],
+                "frame_threads": match.group(2) == "F",
+                "slice_threads": match.group(3) == "S",
+            }
+    return encoders
+
+def probe_capabilities(binary):
+    """Runs the binary once for its version, filters, encoders and build configuration. None if it does not run."""
+    try:
+        version_text = _run(binary, "-version")
+        filters = _parse_filters(_run(binary, "-filters"))
+        encoders = _parse_encoders(_run(binary, "-encoders"))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    first_line = version_text.splitlines()[0] if version_text else ""
+    version = re.search(r"version\s+(\S+)", first_line)
+    return {
+        "version": version.group(1) if version else first_line,
+        "filters": filters,
+        "encoders": encoders,
+        # Builds without a threading library run every filter and encoder single-threaded
+        "threads": "--disable-pthreads" not in version_text and "--disable-w32threads" not in version_text,
+        "probed_at": time.time(),
+    }
+
+class CapabilityRegistry:
+    """JSON-backed cache of probe_capabilities() results, safe to share between threads."""
+
+    def __init__(self, path=DEFAULT_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        # Caller holds the lock
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        # Caller holds the lock
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, binary):
+        """
+        Capabilities of binary (a path or a name on PATH), or None if it cannot be found or run.
+        Only the first call for a given binary (or after it was replaced) starts FFmpeg.
+        """
+        resolved = shutil.which(binary)
+        if not resolved:
+            return None
+        real_path = os.path.realpath(resolved)
+        try:
+            stat = os.stat(real_path)
+        except OSError:
+            return None
+        key = f"{real_path}|{stat.st_size}|{stat.st_mtime_ns}"
+        with self._lock:
+            cached = self._load().get(key)
+        if cached is not None:
+            return cached
+        capabilities = probe_capabilities(resolved)
+        if capabilities is None:
+            return None
+        with self._lock:
+            entries = self._load()
+            # Drop entries of older builds at the same path
+            for old_key in [k for k in entries if k.split("|")[0] == real_path]:
+                del entries[old_key]
+            entries[key] = capabilities
+            self._save()
+        return capabilities
+
+_default_registry = CapabilityRegistry()
+
+def get_capabilities(binary):
+    return _default_registry.get(binary)
+
+def missing_filters(capabilities, names):
+    """Names the build does not have (nothing is reported missing if the capabilities are unknown)."""
+    if not capabilities:
+        return []
+    return sorted(name for name in set(names) if name not in capabilities["filters"])
+
+def has_encoder(capabilities, name):
+    return bool(capabilities) and name in capabilities["encoders"]
+
+def require(capabilities, filters=(), encoders=()):
+    """Raises MissingCapabilityError if any of the filters or encoders is missing from a known build."""
+    if not capabilities:
+        return
+    missing = missing_filters(capabilities, filters)
+    missing += sorted(f"encoder {name}" for name in set(encoders) if not has_encoder(capabilities, name))
+    if missing:
+        raise MissingCapabilityError(f"FFmpeg {capabilities['version']} lacks {', '.join(missing)}")
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+# Lines of FFmpeg stderr kept per job for error reports
+STDERR_RING_LINES = 200
+
+# Global options that make FFmpeg write machine-readable progress blocks to stdout instead of the stats line
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class ProgressParser:
+    """
+    Turns the key=value lines of FFmpeg's -progress output into progress dicts.
+    FFmpeg ends every block with progress=continue (or progress=end for the last one); feed() returns the
+    parsed block at that point and None for every other line.
+    If expected_seconds (output duration) is known, percent and eta_seconds are filled in too.
+    """
+
+    def __init__(self, expected_seconds=None):
+        self.expected_seconds = expected_seconds
+        self._block = {}
+        self.last = None
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        self._block[key] = value.strip()
+        if key != "progress":
+            return None
+        block, self._block = self._block, {}
+        self.last = self._parse_block(block)
+        return self.last
+
+    def _parse_block(self, block):
+        speed = _to_float((block.get("speed") or "").rstrip("x"))
+        out_time_us = _to_int(block.get("out_time_us") or block.get("out_time_ms")) # out_time_ms is in µs too
+        out_seconds = max(0.0, out_time_us / 1e6) if out_time_us is not None else None
+        progress = {
+            "frame": _to_int(block.get("frame")),
+            "fps": _to_float(block.get("fps")),
+            "speed": speed,
+            "total_size": _to_int(block.get("total_size")),
+            "out_seconds": out_seconds,
+            "percent": None,
+            "eta_seconds": None,
+            "finished": block.get("progress") == "end",
+        }
+        if self.expected_seconds and out_seconds is not None:
+            progress["percent"] = 1.0 if progress["finished"] else min(1.0, out_seconds / self.expected_seconds)
+            if speed:
+                progress["eta_seconds"] = max(0.0, self.expected_seconds - out_seconds) / speed
+        return progress
+
+def format_progress(progress):
+    """One-line summary of a progress dict, e.g. '45% frame=390 fps=31.2 speed=1.04x size=2.1MB ETA 14s'."""
+    parts = []
+    if progress.get("percent") is not None:
+        parts.append(f"{progress['percent'] * 100:.0f}%")
+    if progress.get("frame") is not None:
+        parts.append(f"frame={progress['frame']}")
+    if progress.get("fps") is not None:
+        parts.append(f"fps={progress['fps']:.1f}")
+    if progress.get("speed") is not None:
+        parts.append(f"speed={progress['speed']:.2f}x")
+    if progress.get("total_size") is not None:
+        parts.append(f"size={progress['total_size'] / 1e6:.1f}MB")
+    if progress.get("eta_seconds") is not None:
+        parts.append(f"ETA {progress['eta_seconds']:.0f}s")
+    return " ".join(parts)
+
+class LineRingBuffer:
+    """Keeps only the last max_lines lines of a stream, so long jobs do not pile their whole log up in memory."""
+
+    def __init__(self, max_lines=STDERR_RING_LINES):
+        self._lines = deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def append(self, line):
+        if len(self._lines) == self._lines.maxlen:
+            self.dropped += 1
+        self._lines.append(line.rstrip("\n"))
+
+    def text(self):
+        header = [f"[... {self.dropped} earlier lines dropped ...]"] if self.dropped else []
+        return "\n".join(header + list(self._lines))
+
+# ----------------------------
+# Finished-job metrics
+# ----------------------------
+class JsonlMetricsSink:
+    """Appends one JSON object per finished job to a JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, metrics):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(metrics) + "\n")
+
+class PrometheusTextfileSink:
+    """
+    Keeps running totals of finished jobs and rewrites them as a Prometheus textfile
+    (for node_exporter's textfile collector) after every job. Totals start at zero in each process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._frames = 0
+        self._encode_seconds = 0.0
+        self._output_bytes = 0
+        self._last_fps = 0.0
+
+    def record(self, metrics):
+        with self._lock:
+            status = metrics.get("status", "unknown")
+            self._jobs[status] = self._jobs.get(status, 0) + 1
+            if status == "done":
+                self._frames += metrics.get("frames") or 0
+                self._encode_seconds += metrics.get("elapsed_seconds") or 0.0
+                self._output_bytes += metrics.get("output_bytes") or 0
+                self._last_fps = metrics.get("fps") or 0.0
+            lines = [
+                "# HELP reach_jobs_total Finished processing jobs by status.",
+                "# TYPE reach_jobs_total counter",
+            ]
+            lines += [f'reach_jobs_total{{status="{s}"}} {n}' for s, n in sorted(self._jobs.items())]
+            lines += [
+                "# HELP reach_frames_total Frames encoded by successful jobs.",
+                "# TYPE reach_frames_total counter",
+                f"reach_frames_total {self._frames}",
+                "# HELP reach_encode_seconds_total Wall time spent in successful jobs.",
+                "# TYPE reach_encode_seconds_total counter",
+                f"reach_encode_seconds_total {self._encode_seconds:.3f}",
+                "# HELP reach_output_bytes_total Bytes written by successful jobs.",
+                "# TYPE reach_output_bytes_total counter",
+                f"reach_output_bytes_total {self._output_bytes}",
+                "# HELP reach_last_job_fps Average encode fps of the last successful job.",
+                "# TYPE reach_last_job_fps gauge",
+                f"reach_last_job_fps {self._last_fps:.3f}",
+                "# HELP reach_last_job_timestamp_seconds When the last job finished.",
+                "# TYPE reach_last_job_timestamp_seconds gauge",
+                f"reach_last_job_timestamp_seconds {time.time():.0f}",
+            ]
+            # Write next to the target and rename, so the collector never reads a half-written file
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.path)
+
+def open_metrics_sink(path):
+    """Metrics sink for path: a Prometheus textfile for *.prom, JSON lines otherwise. None if path is empty."""
+    if not path:
+        return None
+    if path.endswith(".prom"):
+        return PrometheusTextfileSink(path)
+    return JsonlMetricsSink(path)
@@ -0,0 +1,294 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+# Rough relative cost of each filter per megapixel of frame (1.0 ≈ one pass of a simple per-pixel LUT).
+# Used only to rank stages and estimate where the time goes; real numbers come from the benchmark suite.
+FILTER_COSTS = {
+    "scale": 4.0,
+    "pad": 0.5,
+    "format": 0.5,
+    "zoompan": 12.0,
+    "crop": 0.1,
+    "rotate": 6.0,
+    "drawbox": 0.05,
+    "drawtext": 2.0,
+    "overlay": 1.5,
+    "hflip": 0.5,
+    "vflip": 0.5,
+    "setsar": 0.0,
+    "setpts": 0.0,
+    "fps": 0.1,
+    "eq": 1.0,
+    "hue": 1.5,
+    "noise": 2.5,
+    "lenscorrection": 5.0,
+    "split": 0.0,
+    "trim": 0.0,
+    "sendcmd": 0.0,
+    "null": 0.0,
+}
+DEFAULT_FILTER_COST = 2.0
+
+# Stage kinds
+GEOMETRY = "geometry" # Resamples or moves pixels (scale, zoompan, rotate, lenscorrection...)
+PERMUTATION = "permutation" # Moves pixels without resampling (hflip, vflip)
+COLOUR = "colour" # Per-pixel colour maths (eq, hue)
+TEXTURE = "texture" # Adds content that depends on position or time (noise, drawbox, drawtext, overlay)
+TIMING = "timing" # Only touches timestamps (setpts)
+METADATA = "metadata" # Only touches frame properties (setsar, format passthrough)
+
+@dataclass
+class FilterStage:
+    """One filter of a linear video chain, e.g. eq with [('brightness', '0.005'), ('contrast', '1.005')].
+    Option values are stored exactly as FFmpeg should see them (expressions keep their own quoting)."""
+    name: str
+    options: List[Tuple[str, str]] = field(default_factory=list)
+    kind: str = TEXTURE
+    note: str = "" # Why the stage is there; shown in cost reports
+    sources: List[str] = field(default_factory=list) # Source filters (e.g. movie=...) feeding the stage's extra inputs
+
+    def to_string(self):
+        if not self.options:
+            return self.name
+        # An empty key is a positional value (e.g. setsar=1)
+        return self.name + "=" + ":".join(f"{k}={v}" if k else v for k, v in self.options)
+
+    def get(self, key, default=None):
+        for k, v in self.options:
+            if k == key:
+                return v
+        return default
+
+    def get_float(self, key, default=None):
+        """Numeric value of an option, or default if it is missing or an expression."""
+        try:
+            return float(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def with_options(self, **updates):
+        """Copy of the stage with some options replaced (new keys are appended)."""
+        options = [(k, updates.pop(k) if k in updates else v) for k, v in self.options]
+        options.extend(updates.items())
+        return FilterStage(self.name, options, self.kind, self.note, list(self.sources))
+
+    @property
+    def filter_name(self):
+        """FFmpeg filter name without the instance name, e.g. 'crop' for 'crop@kenburns'."""
+        return self.name.split("@")[0]
+
+    @property
+    def cost(self):
+        return FILTER_COSTS.get(self.filter_name, DEFAULT_FILTER_COST)
+
+    def planes(self):
+        """Set of YUV planes a COLOUR stage reads and writes, or None if unknown (treated as all planes)."""
+        if self.name == "eq":
+            luma_only = {"brightness", "contrast", "gamma", "gamma_weight"}
+            return {"y"} if all(k in luma_only for k, _ in self.options) else None
+        if self.name == "hue":
+            return {"u", "v"} if self.get_float("b", 0.0) == 0.0 and self.get("H") is None else None
+        return None
+
+    def is_noop(self):
+        """True for stages that provably leave frames unchanged."""
+        if self.name == "eq":
+            defaults = {"brightness": 0.0, "contrast": 1.0, "saturation": 1.0, "gamma": 1.0}
+            return all(k in defaults and self.get_float(k) == defaults[k] for k, _ in self.options)
+        if self.name == "hue":
+            h = _degrees_from_hue(self.get("h", "0"))
+            return h == 0.0 and self.get_float("s", 1.0) == 1.0 and self.get_float("b", 0.0) == 0.0 and self.get("H") is None
+        if self.name == "rotate":
+            return self.get_float("a", _first_positional_float(self)) == 0.0
+        if self.name == "noise":
+            return self.get_float("alls", 0.0) == 0.0 and not any(k.endswith("s") and k != "alls" for k, _ in self.options)
+        if self.name == "lenscorrection":
+            return self.get_float("k1", 0.0) == 0.0 and self.get_float("k2", 0.0) == 0.0
+        if self.name == "setpts":
+            return self.get("expr", _first_positional(self)) in ("PTS", "1*PTS")
+        return False
+
+def _first_positional(stage):
+    """Filters like rotate=0.1 or setpts=PTS/2 keep their value under the key ''."""
+    return stage.get("", None)
+
+def _first_positional_float(stage):
+    try:
+        return float(_first_positional(stage))
+    except (TypeError, ValueError):
+        return None
+
+def _degrees_from_hue(expr):
+    """hue h values are written as '<deg>*PI/180'. Returns the degrees, or None for other expressions."""
+    text = (expr or "").strip("'")
+    if text.endswith("*PI/180"):
+        text = text[:-len("*PI/180")]
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _can_swap(a, b):
+    """True if running a then b gives the same frames as b then a."""
+    if a.kind == METADATA or b.kind == METADATA:
+        other = b if a.kind == METADATA else a
+        return other.kind in (COLOUR, PERMUTATION, METADATA, TIMING)
+    if a.kind == TIMING or b.kind == TIMING:
+        other = b if a.kind == TIMING else a
+        return other.kind in (COLOUR, PERMUTATION, METADATA)
+    if a.kind == COLOUR and b.kind == COLOUR:
+        planes_a, planes_b = a.planes(), b.planes()
+        return planes_a is not None and planes_b is not None and not (planes_a & planes_b)
+    if {a.kind, b.kind} == {COLOUR, PERMUTATION}:
+        return True # Per-pixel maths does not care where a pixel sits
+    if a.kind == PERMUTATION and b.kind == PERMUTATION:
+        return True
+    return False
+
+def _merge(a, b):
+    """Single stage equivalent to a followed by b, or None if they cannot be fused."""
+    if a.name != b.name:
+        return None
+    if a.name == "eq" and a.planes() == {"y"} and b.planes() == {"y"} and a.get("gamma") is None and b.get("gamma") is None:
+        # eq maps v -> (v - 0.5) * contrast + 0.5 + brightness, so two passes compose into one
+        c1, b1 = a.get_float("contrast", 1.0), a.get_float("brightness", 0.0)
+        c2, b2 = b.get_float("contrast", 1.0), b.get_float("brightness", 0.0)
+        if None in (c1, b1, c2, b2):
+            return None
+        return FilterStage("eq", [("brightness", f"{b1 * c2 + b2:.6g}"), ("contrast", f"{c1 * c2:.6g}")], COLOUR,
+                           "fused " + " + ".join(n for n in (a.note, b.note) if n))
+    if a.name == "hue" and a.planes() == {"u", "v"} and b.planes() == {"u", "v"}:
+        # Hue rotation and saturation are both linear on U/V and commute, so angles add and saturations multiply
+        h1, h2 = _degrees_from_hue(a.get("h", "0")), _degrees_from_hue(b.get("h", "0"))
+        s1, s2 = a.get_float("s", 1.0), b.get_float("s", 1.0)
+        if None in (h1, h2, s1, s2):
+            return None
+        return FilterStage("hue", [("h", f"{h1 + h2:.2f}*PI/180"), ("s", f"{s1 * s2:.6g}")], COLOUR,
+                           "fused " + " + ".join(n for n in (a.note, b.note) if n))
+    if a.name == "setsar" and b.name == "setsar":
+        return b
+    return None
+
+class FilterGraph:
+    """
+    Ordered list of FilterStage objects for the video chain of one job.
+    Builders add stages as data; to_string() produces the FFmpeg -vf string and optimize()
+    returns an equivalent chain (no-ops dropped, double flips cancelled, optionally the pixel format pinned).
+    """
+
+    def __init__(self, stages=None):
+        self.stages = list(stages or [])
+
+    def add(self, name, options=None, kind=TEXTURE, note="", sources=None):
+        """Appends a stage. options is a list of (key, value) pairs or a dict.
+        sources are source filters for the stage's second, third... input (e.g. the image of an overlay)."""
+        if isinstance(options, dict):
+            options = list(options.items())
+        self.stages.append(FilterStage(name, list(options or []), kind, note, list(sources or [])))
+        return self
+
+    def copy(self):
+        return FilterGraph([FilterStage(s.name, list(s.options), s.kind, s.note, list(s.sources)) for s in self.stages])
+
+    def find(self, name):
+        """Index of the first stage with this filter name, or None."""
+        for i, stage in enumerate(self.stages):
+            if stage.name == name:
+                return i
+        return None
+
+    def to_string(self, input_label=None):
+        """
+        The FFmpeg filter string. A plain chain is returned as is (prefixed with [input_label] if given).
+        Stages with sources need labelled links, so the chain is then split into several ';'-separated
+        chains, with the main input labelled input_label (default 'in', as -vf expects). The last chain
+        always carries the output, so more filters can be appended to the string with ','.
+        """
+        if not any(stage.sources for stage in self.stages):
+            return (f"[{input_label}]" if input_label else "") + ",".join(stage.to_string() for stage in self.stages)
+        chains = []
+        chain = f"[{input_label or 'in'}]"
+        for i, stage in enumerate(self.stages):
+            if stage.sources:
+                labels = [f"vsrc{i}_{j}" for j in range(len(stage.sources))]
+                chains.extend(f"{source}[{label}]" for source, label in zip(stage.sources, labels))
+                if i > 0:
+                    # The chain so far becomes the stage's first input
+                    chains.append(f"{chain}[vchain{i}]")
+                    chain = f"[vchain{i}]"
+                chain += "".join(f"[{label}]" for label in labels) + stage.to_string()
+            else:
+                chain += ("," if i > 0 else "") + stage.to_string()
+        chains.append(chain)
+        return ";".join(chains)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __len__(self):
+        return len(self.stages)
+
+    def optimize(self, pix_fmt=None):
+        """
+        Returns an equivalent graph:
+        - stages that leave frames unchanged are dropped, and hflip/vflip pairs cancel out;
+        - stages of the same kind that commute with everything in between are moved together and fused
+          (e.g. two eq passes become one). The job graphs of video_processor add each effect once, so
+          nothing is fused there; this only matters for graphs that repeat a stage;
+        - if pix_fmt is set, the format is pinned right after the leading frame rate and scale/pad stages.
+          Pass the source's own format only (see video_processor.chain_pix_fmt): any other format would
+          change the output's chroma subsampling or bit depth.
+        """
+        stages = [FilterStage(s.name, list(s.options), s.kind, s.note, list(s.sources)) for s in self.stages if not s.is_noop()]
+
+        changed = True
+        while changed:
+            changed = False
+            for i, j in ((i, j) for i in range(len(stages)) for j in range(i + 1, len(stages))):
+                # Stage j may only be pulled back next to stage i if it commutes with everything in between
+                if not all(_can_swap(stages[k], stages[j]) for k in range(i + 1, j)):
+                    continue
+                if stages[i].name in ("hflip", "vflip") and stages[j].name == stages[i].name:
+                    del stages[j]
+                    del stages[i]
+                    changed = True
+                    break
+                merged = _merge(stages[i], stages[j])
+                if merged is not None:
+                    stages[i] = merged
+                    del stages[j]
+                    changed = True
+                    break
+
+        stages = [s for s in stages if not s.is_noop()]
+
+        if pix_fmt and not any(s.name == "format" for s in stages):
+            insert_at = 0
+            while insert_at < len(stages) and (stages[insert_at].name in ("scale", "pad") or stages[insert_at].kind == TIMING):
+                insert_at += 1
+            stages.insert(insert_at, FilterStage("format", [("pix_fmts", pix_fmt)], METADATA, "pin pixel format"))
+
+        return FilterGraph(stages)
+
+    def cost_report(self, width=1080, height=1920):
+        """Estimated cost of each stage for one frame of width x height.
+        Returns a list of dicts with filter, note, cost (relative units) and share (0–1 of the chain)."""
+        megapixels = width * height / 1e6
+        costs = [stage.cost * megapixels for stage in self.stages]
+        total = sum(costs) or 1.0
+        return [
+            {"filter": stage.name, "note": stage.note, "cost": cost, "share": cost / total}
+            for stage, cost in zip(self.stages, costs)
+        ]
+
+    def estimated_cost(self, width=1080, height=1920):
+        """Total estimated cost per frame (same units as cost_report)."""
+        return sum(entry["cost"] for entry in self.cost_report(width, height))
+
+def format_cost_report(graph, width=1080, height=1920):
+    """Human-readable per-stage cost table for a graph."""
+    lines = [f"{'filter':<16}{'est. cost':>10}{'share':>8}  note"]
+    for entry in graph.cost_report(width, height):
+        lines.append(f"{entry['filter']:<16}{entry['cost']:>10.2f}{entry['share'] * 100:>7.1f}%  {entry['note']}")
+    lines.append(f"{'total':<16}{graph.estimated_cost(width, height):>10.2f}")
+    return "\n".join(lines)
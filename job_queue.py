@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+from video_processor import get_ffmpeg_path, _execute_ffmpeg_command, plan_thread_budget
+from encoding_profiles import ENCODING_PROFILES, DEFAULT_PROFILE
+from ffmpeg_progress import open_metrics_sink
+from renditions import RENDITION_PRESETS, parse_renditions
+from noise_beds import resolve_noise_source
+from media_probe import get_ffprobe_path, get_default_index
+from render_cache import open_render_cache
+from stage_cache import open_stage_cache
+
+# Job queue shared by render workers on one or several hosts. Put the database on the shared mount
+# (e.g. --queue /mnt/render/queue.sqlite); inputs and outputs must have the same paths on every host.
+# SQLite relies on POSIX file locks, so NFS needs working locking (NFSv4, or lockd for NFSv3).
+DEFAULT_QUEUE_PATH = os.path.join(".cache", "job_queue.sqlite")
+
+# Workers refresh their jobs' heartbeat this often; a running job without a heartbeat for STALE_AFTER
+# seconds is assumed to belong to a dead worker and is put back (host clocks must roughly agree).
+HEARTBEAT_INTERVAL = 15.0
+STALE_AFTER = 120.0
+MAX_ATTEMPTS = 3 # Claims per job before a job that keeps losing its worker is marked failed
+POLL_INTERVAL = 5.0 # Seconds an idle worker waits before looking for new jobs
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# _execute_ffmpeg_command settings a job may carry; noise_file is resolved by each worker
+JOB_SETTINGS = ("horizontal_flip", "text_to_overlay", "text_position", "font_size", "text_color", "text_bg_color",
+                "text_bold", "text_italic", "rotation_degrees", "playback_speed", "random_zoom_pan", "zoom_end_scale",
+                "encoding_profile", "renditions", "noise_file")
+
+class JobQueue:
+    """SQLite-backed queue of render jobs. Every call uses its own short-lived connection, so one
+    JobQueue can be shared by threads, and any number of processes and hosts can use the same file."""
+
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH):
+        self.db_path = db_path
+        self._init_lock = threading.Lock()
+        self._initialised = False
+
+    def _connect(self):
+        # isolation_level=None: transactions are started explicitly, so claims can take the write lock up front
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialised:
+            with self._init_lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT, input_path TEXT, output_path TEXT, settings TEXT,"
+                    " state TEXT, attempts INTEGER DEFAULT 0, worker TEXT, heartbeat_at REAL,"
+                    " created_at REAL, started_at REAL, finished_at REAL, error TEXT)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+                self._initialised = True
+        return conn
+
+    def enqueue(self, input_path, output_path, settings=None):
+        """Adds a job rendering input_path to output_path with settings (see JOB_SETTINGS). Returns its id."""
+        unknown = set(settings or {}) - set(JOB_SETTINGS)
+        if unknown:
+            raise ValueError(f"unknown job setting(s): {', '.join(sorted(unknown))}")
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (input_path, output_path, settings, state, created_at) VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(input_path), os.path.abspath(output_path), json.dumps(settings or {}), PENDING, time.time()),
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def _requeue_stale(self, conn, now):
+        # Caller holds the write lock. Jobs of dead workers go back to pending, or fail after MAX_ATTEMPTS claims
+        conn.execute("UPDATE jobs SET state = ?, finished_at = ?, error = 'worker lost too often', worker = NULL"
+                     " WHERE state = ? AND heartbeat_at < ? AND attempts >= ?",
+                     (FAILED, now, RUNNING, now - STALE_AFTER, MAX_ATTEMPTS))
+        conn.execute("UPDATE jobs SET state = ?, worker = NULL, error = 'worker lost'"
+                     " WHERE state = ? AND heartbeat_at < ?", (PENDING, RUNNING, now - STALE_AFTER))
+
+    def claim(self, worker_id):
+        """Atomically takes the oldest pending job for worker_id. Returns the job as a dict, or None if there is none."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Write lock: no other worker can claim in between
+            try:
+                self._requeue_stale(conn, now)
+                row = conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT 1", (PENDING,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET state = ?, worker = ?, heartbeat_at = ?, started_at = ?,"
+                                 " attempts = attempts + 1, error = NULL WHERE id = ?",
+                                 (RUNNING, worker_id, now, now, row["id"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row, state=RUNNING, worker=worker_id, heartbeat_at=now, started_at=now, attempts=row["attempts"] + 1, error=None)
+        job["settings"] = json.loads(job["settings"] or "{}")
+        return job
+
+    def _update_own(self, job_id, worker_id, sql, params):
+        """Runs an UPDATE on a job only while worker_id still owns it. Returns True if it did."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql + " WHERE id = ? AND worker = ? AND state = ?", (*params, job_id, worker_id, RUNNING))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id, worker_id):
+        """Marks the job as alive. False means it was given to another worker (this one was presumed dead)."""
+        return self._update_own(job_id, worker_id, "UPDATE jobs SET heartbeat_at = ?", (time.time(),))
+
+    def finish(self, job_id, worker_id, ok, error=None):
+        return self._update_own(job_id, worker_id, "UPDATE jobs SET state = ?, finished_at = ?, error = ?",
+                                (DONE if ok else FAILED, time.time(), error))
+
+    def release(self, job_id, worker_id):
+        """Puts a job back without counting the attempt (e.g. the worker is shutting down)."""
+        return self._update_own(job_id, worker_id, "UPDATE jobs SET state = ?, worker = NULL, attempts = attempts - 1",
+                                (PENDING,))
+
+    def retry_failed(self):
+        """Puts every failed job back in the queue. Returns how many."""
+        conn = self._connect()
+        try:
+            return conn.execute("UPDATE jobs SET state = ?, attempts = 0, error = NULL WHERE state = ?",
+                                (PENDING, FAILED)).rowcount
+        finally:
+            conn.close()
+
+    def counts(self):
+        conn = self._connect()
+        try:
+            return {row["state"]: row["n"] for row in conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
+        finally:
+            conn.close()
+
+    def jobs(self, state=None):
+        conn = self._connect()
+        try:
+            if state:
+                rows = conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+def enqueue_path(queue, path, output_folder, settings=None):
+    """Enqueues one .mp4 file, or every .mp4 file in a folder. Returns the new job ids."""
+    if os.path.isdir(path):
+        inputs = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(".mp4")]
+    else:
+        inputs = [path]
+    return [queue.enqueue(input_path, os.path.join(output_folder, f"tt_{os.path.basename(input_path)}"), settings)
+            for input_path in inputs]
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _run_job(queue, job, worker_id, ffmpeg_executable, threads, noise_sources, metrics_sink, stop_event, render_cache=None,
+             stage_cache=None):
+    """Renders one claimed job while a heartbeat thread keeps it alive.
+    Returns True if it succeeded, False if it failed, None if it was handed back to the queue."""
+    settings = dict(job["settings"])
+    noise_file = settings.pop("noise_file", None)
+    if noise_file not in noise_sources:
+        noise_sources[noise_file] = resolve_noise_source(ffmpeg_executable, noise_file)
+    cancel_event = threading.Event()
+    done = threading.Event()
+
+    def keep_alive():
+        next_beat = time.monotonic() + HEARTBEAT_INTERVAL
+        while not done.wait(0.5):
+            if stop_event.is_set():
+                cancel_event.set()
+                return
+            if time.monotonic() >= next_beat:
+                next_beat += HEARTBEAT_INTERVAL
+                if not queue.heartbeat(job["id"], worker_id):
+                    print(f"[{worker_id}] Job {job['id']} was given to another worker; stopping it here.")
+                    cancel_event.set()
+                    return
+
+    heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+    heartbeat_thread.start()
+    input_path = job["input_path"]
+    try:
+        os.makedirs(os.path.dirname(job["output_path"]), exist_ok=True)
+        media_info = get_default_index().probe(get_ffprobe_path(ffmpeg_executable), input_path)
+        ok = _execute_ffmpeg_command(ffmpeg_executable, input_path, job["output_path"], os.path.basename(input_path),
+                                     noise_audio_path=noise_sources[noise_file], threads=threads, media_info=media_info,
+                                     cancel_event=cancel_event, metrics_sink=metrics_sink, render_cache=render_cache,
+                                     stage_cache=stage_cache, **settings)
+    except FileNotFoundError:
+        queue.release(job["id"], worker_id)
+        raise
+    finally:
+        done.set()
+        heartbeat_thread.join()
+    if cancel_event.is_set():
+        # Shutting down (or the job was taken over): leave it for the next worker
+        queue.release(job["id"], worker_id)
+        return None
+    queue.finish(job["id"], worker_id, ok, None if ok else "FFmpeg returned an error")
+    return ok
+
+def run_worker(queue, ffmpeg_executable, jobs=1, worker_id=None, exit_when_empty=False, metrics_sink=None, render_cache=None,
+               stage_cache=None):
+    """
+    Claims and renders jobs until interrupted, running up to `jobs` FFmpeg processes at once.
+    With a render_cache (see render_cache.py), jobs rendered before on this host are served from it.
+    With a stage_cache (see stage_cache.py), jobs start from this host's intermediates of their fit and zoom/pan stages.
+    With exit_when_empty, returns once the queue has no pending jobs. Returns (done_count, failed_count).
+    """
+    worker_id = worker_id or default_worker_id()
+    jobs, threads_per_job = plan_thread_budget(jobs)
+    stop_event = threading.Event()
+    noise_sources = {}
+    counts = {"done": 0, "failed": 0}
+    counts_lock = threading.Lock()
+    print(f"Worker {worker_id}: {jobs} job slot(s), {threads_per_job} thread(s) each, queue {queue.db_path}")
+
+    def slot():
+        while not stop_event.is_set():
+            job = queue.claim(worker_id)
+            if job is None:
+                if exit_when_empty:
+                    return
+                stop_event.wait(POLL_INTERVAL)
+                continue
+            print(f"[{worker_id}] Job {job['id']}: {job['input_path']} (attempt {job['attempts']})")
+            try:
+                ok = _run_job(queue, job, worker_id, ffmpeg_executable, threads_per_job if jobs > 1 else None,
+                              noise_sources, metrics_sink, stop_event, render_cache, stage_cache)
+            except FileNotFoundError:
+                print(f"Error: FFmpeg executable not found at '{ffmpeg_executable}'. Stopping worker.")
+                stop_event.set()
+                return
+            except Exception as e:
+                print(f"[{worker_id}] Job {job['id']} failed unexpectedly: {e}")
+                queue.finish(job["id"], worker_id, False, str(e))
+                ok = False
+            if ok is not None:
+                with counts_lock:
+                    counts["done" if ok else "failed"] += 1
+
+    threads = [threading.Thread(target=slot, daemon=True) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    try:
+        # Sleep rather than join with a timeout: a Ctrl-C inside join() can leave the thread looking finished
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print(f"Worker {worker_id} interrupted. Running jobs go back to the queue.")
+        stop_event.set() # Heartbeat threads cancel their FFmpeg process, and jobs are released
+        for thread in threads:
+            thread.join()
+        raise
+    return counts["done"], counts["failed"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared render queue: enqueue videos on any host, run workers on every render box.")
+    parser.add_argument("--queue", type=str, default=DEFAULT_QUEUE_PATH, help="Queue database, on a mount shared by all hosts (default: %(default)s).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Add an .mp4 file, or every .mp4 file in a folder, to the queue.")
+    enqueue_parser.add_argument("path", type=str)
+    enqueue_parser.add_argument("-o", "--output", type=str, default="treated", help="Output folder (default: %(default)s).")
+    enqueue_parser.add_argument("--noise_file", "--noise-file", dest="noise_file", type=str, help="Background noise file (default: sounds/background_noise.mp3 if present, else generated white noise).")
+    enqueue_parser.add_argument("--hflip", action="store_true", help="Horizontally flip the video.")
+    enqueue_parser.add_argument("--profile", choices=sorted(ENCODING_PROFILES), default=DEFAULT_PROFILE, help="Encoding speed profile (default: %(default)s).")
+    enqueue_parser.add_argument("--renditions", type=str, help=f"Extra outputs per clip, comma-separated: {', '.join(RENDITION_PRESETS)}.")
+    enqueue_parser.add_argument("--settings", type=str, help=f"Other job settings as JSON, e.g. '{{\"rotation_degrees\": 1.5}}' (keys: {', '.join(JOB_SETTINGS)}).")
+
+    worker_parser = commands.add_parser("worker", help="Claim and render jobs until interrupted.")
+    worker_parser.add_argument("-j", "--jobs", type=int, default=0, help="FFmpeg processes to run at once on this host (default: auto, based on CPU cores).")
+    worker_parser.add_argument("--exit-when-empty", action="store_true", help="Stop once there are no pending jobs.")
+    worker_parser.add_argument("--cache", action="store_true", help="Reuse renders of the same input with the same settings from this host's render cache. Random effects of jobs without a seed are then seeded from the clip and its settings (no new variation per re-run).")
+    worker_parser.add_argument("--cache-budget", type=float, default=20.0, help="Disk budget of the render cache in GB (default: %(default)s).")
+    worker_parser.add_argument("--stage-cache", action="store_true", help="Start jobs that only change later stages (text, flip, speed...) from this host's cached fitted and zoomed frames. Random effects of jobs without a seed are then seeded from the clip (no new variation per re-run).")
+    worker_parser.add_argument("--stage-cache-budget", type=float, default=10.0, help="Disk budget of the stage cache in GB (default: %(default)s).")
+    worker_parser.add_argument("--metrics", type=str, help="Append per-job metrics to this JSON-lines file, or write a Prometheus textfile if it ends in .prom.")
+
+    commands.add_parser("status", help="Show job counts and unfinished jobs.")
+    commands.add_parser("retry", help="Put failed jobs back in the queue.")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.queue)), exist_ok=True)
+    queue = JobQueue(args.queue)
+
+    if args.command == "enqueue":
+        if not os.path.exists(args.path):
+            print(f"Error: '{args.path}' not found.")
+            exit(1)
+        try:
+            settings = json.loads(args.settings) if args.settings else {}
+        except ValueError as e:
+            print(f"Error: --settings is not valid JSON ({e}).")
+            exit(1)
+        settings.update(horizontal_flip=args.hflip, encoding_profile=args.profile,
+                        renditions=parse_renditions(args.renditions))
+        if args.noise_file:
+            # Workers open it by this path, so it must be on the shared mount too
+            settings["noise_file"] = os.path.abspath(args.noise_file)
+        try:
+            job_ids = enqueue_path(queue, args.path, args.output, settings)
+        except ValueError as e:
+            print(f"Error: {e}.")
+            exit(1)
+        print(f"Enqueued {len(job_ids)} job(s) in {args.queue}.")
+    elif args.command == "worker":
+        try:
+            done_count, failed_count = run_worker(queue, get_ffmpeg_path(), jobs=args.jobs, exit_when_empty=args.exit_when_empty,
+                                                  metrics_sink=open_metrics_sink(args.metrics),
+                                                  render_cache=open_render_cache(budget_bytes=int(args.cache_budget * 1024 ** 3)) if args.cache else None,
+                                                  stage_cache=open_stage_cache(budget_bytes=int(args.stage_cache_budget * 1024 ** 3)) if args.stage_cache else None)
+        except KeyboardInterrupt:
+            exit(130)
+        print(f"Worker finished: {done_count} done, {failed_count} failed.")
+    elif args.command == "status":
+        counts = queue.counts()
+        print(", ".join(f"{state}: {counts.get(state, 0)}" for state in (PENDING, RUNNING, DONE, FAILED)))
+        now = time.time()
+        for job in queue.jobs(RUNNING):
+            print(f"  running #{job['id']} {os.path.basename(job['input_path'])} on {job['worker']} (heartbeat {now - job['heartbeat_at']:.0f}s ago)")
+        for job in queue.jobs(FAILED):
+            print(f"  failed  #{job['id']} {os.path.basename(job['input_path'])}: {job['error']}")
+    elif args.command == "retry":
+        print(f"Requeued {queue.retry_failed()} failed job(s).")
@@ -0,0 +1,183 @@
+import os
+import hashlib
+import threading
+
+from filter_graph import GEOMETRY
+from text_overlays import filter_path
+
+# Ken Burns (slow zoom and pan) engines. zoompan evaluates its expressions and sets up a new scaler for
+# every frame. The crop engine works out the crop window of every frame once, as a sendcmd table, and
+# feeds the cropped area to a single scale filter, which only sets up a new scaler when the window size
+# changes (every few frames for a slow zoom; pans alone are free). Setting up a scaler costs more than
+# zoompan's per-frame work, so for fast zooms, where the window size changes on most frames, zoompan is faster;
+# "auto" picks the faster engine per job.
+KEN_BURNS_ENGINES = {
+    "auto": {"description": "crop for slow zooms, zoompan for fast ones (whichever is faster)"},
+    "crop": {"description": "precomputed crop window per frame + one scale filter"},
+    "zoompan": {"description": "FFmpeg's zoompan filter, without the 30 fps conversion (previous engine)"},
+}
+DEFAULT_KEN_BURNS_ENGINE = "auto"
+
+# "auto" uses the crop engine while the window size changes on at most this share of frames. Fit + zoom/pan of
+# a 10 s 1080x1920 30 fps clip, single-threaded, best of 5 (seconds, crop vs zoompan): zoom 1.1 (changes on
+# 10% of frames) 1.79 vs 1.90, 1.15 (14%) 1.92 vs 2.05, 1.2 (18%) 2.05 vs 1.79, 2.0 (55%) 1.93 vs 1.68
+# (see scripts/ken_burns_benchmark.py).
+CROP_MAX_SIZE_CHANGE_RATE = 0.15
+
+# The zoom trajectory is defined per output frame at this rate (zoompan's fps=30)
+TRAJECTORY_FPS = 30
+KEN_BURNS_CACHE_DIR = os.path.join(".cache", "ken_burns")
+# Least recently used tables are removed beyond this (random zoom/pan writes one per job, a few tens of KB each)
+MAX_CACHED_TABLES = 500
+
+# The crop the table drives is named, so other crop filters in a graph never receive its commands. sendcmd
+# addresses it by the instance name alone: FFmpeg names "crop@kenburns" "kenburns", and a command sent to
+# "crop@kenburns" matches no filter and is dropped (each frame would keep the first window).
+CROP_FILTER = "crop@kenburns"
+CROP_TARGET = CROP_FILTER.split("@")[1]
+
+_lock = threading.Lock()
+
+def zoom_at(frame, zoom_increment, zoom_end):
+    """Zoom factor at trajectory frame number frame: min(1 + increment * (frame + 1), end)."""
+    return min(1 + zoom_increment * (frame + 1), zoom_end)
+
+def zoompan_expression(zoom_increment, zoom_end, frame_offset=0):
+    """zoompan z expression for zoom_at, evaluated from frame n + frame_offset.
+    It is computed from the output frame number: with d=1 zoompan resets 'zoom' for every input frame,
+    so the usual min(max(1,zoom)+increment,end) never grows past the first step."""
+    return f"min(1+{zoom_increment:.6f}*(on+1+{frame_offset:.6g}),{zoom_end})"
+
+def crop_window(frame_size, zoom, pan_x=0.0, pan_y=0.0):
+    """(w, h, x, y) of the area shown at this zoom, placed as zoompan places it: centred, then moved by
+    pan_x/pan_y times the free space around the window. The shorter side follows the longer one, so both
+    change on the same frames and the scaler is rebuilt once per step."""
+    width, height = frame_size
+    if height >= width:
+        h = max(2, int(height / zoom) // 2 * 2) # Even sizes for 4:2:0
+        w = max(2, min(width, int(round(h * width / height / 2)) * 2))
+    else:
+        w = max(2, int(width / zoom) // 2 * 2)
+        h = max(2, min(height, int(round(w * height / width / 2)) * 2))
+    # Offsets from the unrounded window size, as zoompan computes them, made even as crop does for 4:2:0
+    free_x, free_y = width - width / zoom, height - height / zoom
+    x = min(max(0, int(free_x / 2 + pan_x * free_x)), width - w) // 2 * 2
+    y = min(max(0, int(free_y / 2 + pan_y * free_y)), height - h) // 2 * 2
+    return w, h, x, y
+
+def size_change_rate(frame_size, zoom_increment, zoom_end, max_frames=29 * TRAJECTORY_FPS):
+    """Share of the first max_frames trajectory frames whose crop window has a new size, i.e. how often the
+    crop engine sets up a new scaler."""
+    changes = 0
+    last_size = None
+    for n in range(max_frames):
+        zoom = zoom_at(n, zoom_increment, zoom_end)
+        size = crop_window(frame_size, zoom)[:2]
+        if size != last_size:
+            changes += 1
+            last_size = size
+        if zoom >= zoom_end or zoom_increment <= 0:
+            break
+    return changes / max_frames
+
+def pick_engine(engine, frame_size, zoom_increment, zoom_end, fps=TRAJECTORY_FPS, single_frame=False):
+    """
+    The engine ("crop" or "zoompan") an "auto" job uses; other engines are returned as they are. zoompan is
+    picked only for frames arriving at the trajectory rate (it stamps its output at that rate) and when the
+    crop window would change size on more than CROP_MAX_SIZE_CHANGE_RATE of the frames. A still needs a single
+    window, so it always uses the crop engine.
+    """
+    if engine != "auto":
+        return engine
+    if single_frame or abs(fps - TRAJECTORY_FPS) > 1e-3:
+        return "crop"
+    # From the start of the trajectory, so every segment and still of a job agrees on the engine
+    rate = size_change_rate(frame_size, zoom_increment, round(zoom_end, 2))
+    return "zoompan" if rate > CROP_MAX_SIZE_CHANGE_RATE else "crop"
+
+def crop_table(frame_size, zoom_increment, zoom_end, pan_x=0.0, pan_y=0.0, frame_offset=0, rate=TRAJECTORY_FPS,
+               cache_dir=KEN_BURNS_CACHE_DIR):
+    """
+    Path of a sendcmd file moving CROP_TARGET along the trajectory for frames arriving at `rate` fps,
+    starting at trajectory frame frame_offset. Only changes are written, and the table ends once the zoom
+    reaches zoom_end. Written once per set of arguments and reused by later jobs with the same ones (the
+    centred default trajectory; random zoom/pan gives most jobs a table of their own). Only the
+    MAX_CACHED_TABLES most recently used tables are kept.
+    """
+    key = hashlib.sha1(repr((CROP_TARGET, tuple(frame_size), round(zoom_increment, 9), round(zoom_end, 6), round(pan_x, 6), round(pan_y, 6),
+                             round(frame_offset, 6), round(rate, 6))).encode("utf-8")).hexdigest()[:20]
+    path = os.path.join(cache_dir, f"{key}.cmd")
+    with _lock:
+        if os.path.isfile(path):
+            try:
+                os.utime(path) # Most recently used: pruned last
+                return path
+            except OSError:
+                pass # Pruned by another process just now: write it again
+        lines = []
+        last_window = None
+        n = 0
+        while True:
+            zoom = zoom_at(frame_offset + n * TRAJECTORY_FPS / rate, zoom_increment, zoom_end)
+            window = crop_window(frame_size, zoom, pan_x, pan_y)
+            if window != last_window:
+                # Half a frame early, so a frame whose timestamp is slightly off still gets its window
+                start = max(0.0, (n - 0.5) / rate)
+                lines.append(f"{start:.6f} " + ", ".join(f"{CROP_TARGET} {name} {value}" for name, value in zip("whxy", window)) + ";")
+                last_window = window
+            if zoom >= zoom_end or zoom_increment <= 0:
+                break
+            n += 1
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        _prune_tables(cache_dir)
+    return path
+
+def _prune_tables(cache_dir):
+    tables = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".cmd")]
+    if len(tables) <= MAX_CACHED_TABLES:
+        return
+    mtimes = {}
+    for path in tables:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            pass # Removed by another process
+    for path in sorted(mtimes, key=mtimes.get)[:len(mtimes) - MAX_CACHED_TABLES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def add_ken_burns(graph, engine, frame_size, zoom_increment, zoom_end, pan_x=0.0, pan_y=0.0, frame_offset=0, fps=TRAJECTORY_FPS,
+                  single_frame=False):
+    """
+    Appends the zoom/pan stages to a FilterGraph whose frames have frame_size. frame_offset is the trajectory
+    frame the input starts at; fps is the rate frames arrive at (zoompan also stamps its output with it).
+    With single_frame (a still), the crop engine only needs the window at frame_offset, so no table is written.
+    "auto" is resolved with pick_engine.
+    """
+    width, height = frame_size
+    engine = pick_engine(engine, frame_size, zoom_increment, zoom_end, fps, single_frame)
+    if engine == "zoompan":
+        x_expr = f"(iw/2-(iw/zoom/2))+{pan_x:.4f}*(iw - iw/zoom)" if pan_x else "iw/2-(iw/zoom/2)"
+        y_expr = f"(ih/2-(ih/zoom/2))+{pan_y:.4f}*(ih - ih/zoom)" if pan_y else "ih/2-(ih/zoom/2)"
+        zoom_expr = zoompan_expression(zoom_increment, f"{round(zoom_end, 2):g}", frame_offset)
+        graph.add("zoompan", [("z", f"'{zoom_expr}'"), ("x", f"'{x_expr}'"), ("y", f"'{y_expr}'"),
+                              ("s", f"{width}x{height}"), ("d", "1"), ("fps", f"{fps:.6g}")], GEOMETRY, "Ken Burns zoom/pan")
+        return graph
+    if engine != "crop":
+        raise ValueError(f"Unknown Ken Burns engine '{engine}'. Choose from: {', '.join(KEN_BURNS_ENGINES)}")
+    w, h, x, y = crop_window(frame_size, zoom_at(frame_offset, zoom_increment, round(zoom_end, 2)), pan_x, pan_y)
+    if not single_frame:
+        table = crop_table(frame_size, zoom_increment, round(zoom_end, 2), pan_x, pan_y, frame_offset, fps)
+        graph.add("sendcmd", [("f", filter_path(table))], GEOMETRY, "Ken Burns crop table")
+    graph.add(CROP_FILTER, [("w", str(w)), ("h", str(h)), ("x", str(x)), ("y", str(y))], GEOMETRY, "Ken Burns window")
+    # crop resizes its output link in place when a command changes w/h, so a scale right after it never notices
+    # the new size (and FFmpeg 7 then fails at the end of the stream). Behind a passthrough it sees each change.
+    graph.add("null", [], GEOMETRY, "Ken Burns size change barrier")
+    graph.add("scale", [("w", str(width)), ("h", str(height))], GEOMETRY, "Ken Burns resample")
+    return graph
@@ -0,0 +1,184 @@
+import os
+import json
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Local cache of ffprobe results, keyed by path + size + mtime so edited files are re-probed
+DEFAULT_INDEX_PATH = os.path.join(".cache", "media_index.sqlite")
+
+def get_ffprobe_path(ffmpeg_executable):
+    """Returns the ffprobe binary that ships next to the given ffmpeg binary (or 'ffprobe' from PATH)."""
+    directory, name = os.path.split(ffmpeg_executable)
+    probe_name = name.replace("ffmpeg", "ffprobe") if "ffmpeg" in name else "ffprobe"
+    return os.path.join(directory, probe_name) if directory else probe_name
+
+def _parse_rate(rate):
+    """'30000/1001' -> 29.97. Returns None for missing or 0/0 rates."""
+    try:
+        num, _, den = (rate or "").partition("/")
+        num, den = float(num), float(den or 1)
+        return num / den if num > 0 and den > 0 else None
+    except ValueError:
+        return None
+
+def _parse_sar(sar):
+    """'1:1' -> 1.0. ffprobe reports '0:1' or nothing when the SAR is unknown, which players treat as square."""
+    try:
+        num, _, den = (sar or "").partition(":")
+        num, den = int(num), int(den)
+        return num / den if num > 0 and den > 0 else 1.0
+    except ValueError:
+        return 1.0
+
+def probe_media(ffprobe_executable, path):
+    """
+    Returns a media-info dict for path: duration, width, height, fps, sar, video_codec,
+    audio_codec, audio_sample_rate, has_video, has_audio (plus 'error' if ffprobe could not read it).
+    Returns None if ffprobe itself is not available.
+    """
+    cmd = [
+        ffprobe_executable,
+        "-v", "error",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        path,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except (FileNotFoundError, PermissionError):
+        return None
+    except subprocess.TimeoutExpired:
+        return {"error": "ffprobe timed out", "has_video": False, "has_audio": False}
+
+    if result.returncode != 0:
+        return {"error": result.stderr.strip() or f"ffprobe exited with code {result.returncode}",
+                "has_video": False, "has_audio": False}
+    try:
+        data = json.loads(result.stdout or "{}")
+    except ValueError:
+        return {"error": "ffprobe returned invalid JSON", "has_video": False, "has_audio": False}
+
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    duration = data.get("format", {}).get("duration") or (video or {}).get("duration")
+    try:
+        duration = float(duration) if duration is not None else None
+    except ValueError:
+        duration = None
+
+    return {
+        "duration": duration,
+        "width": (video or {}).get("width"),
+        "height": (video or {}).get("height"),
+        "fps": _parse_rate((video or {}).get("avg_frame_rate")) or _parse_rate((video or {}).get("r_frame_rate")),
+        "sar": _parse_sar((video or {}).get("sample_aspect_ratio")),
+        "video_codec": (video or {}).get("codec_name"),
+        "pix_fmt": (video or {}).get("pix_fmt"),
+        "audio_codec": (audio or {}).get("codec_name"),
+        "audio_sample_rate": int((audio or {}).get("sample_rate") or 0) or None,
+        "has_video": video is not None,
+        "has_audio": audio is not None,
+    }
+
+def check_media_supported(media_info):
+    """Returns None if the probed input can be processed, else a short reason why not."""
+    if media_info is None:
+        return None # Nothing known; let FFmpeg decide
+    if media_info.get("error"):
+        return f"unreadable input ({media_info['error']})"
+    if not media_info.get("has_video"):
+        return "no video stream"
+    if not media_info.get("width") or not media_info.get("height"):
+        return "video stream has no resolution"
+    if media_info.get("duration") is not None and media_info["duration"] <= 0:
+        return "zero-length input"
+    return None
+
+class MediaIndex:
+    """SQLite-backed cache of probe_media() results, safe to share between threads."""
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        self._init_lock = threading.Lock()
+        self._initialised = False
+
+    def _connect(self):
+        # One short-lived connection per call keeps the index usable from worker threads
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialised:
+            with self._init_lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS media_info ("
+                    " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, info TEXT)"
+                )
+                conn.commit()
+                self._initialised = True
+        return conn
+
+    @staticmethod
+    def _key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, path):
+        """Returns the cached info for path, or None if it was never probed or the file changed since."""
+        try:
+            abs_path, size, mtime_ns = self._key(path)
+        except OSError:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT size, mtime_ns, info FROM media_info WHERE path = ?", (abs_path,)).fetchone()
+        finally:
+            conn.close()
+        if row and row[0] == size and row[1] == mtime_ns:
+            return json.loads(row[2])
+        return None
+
+    def put(self, path, media_info):
+        abs_path, size, mtime_ns = self._key(path)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_info (path, size, mtime_ns, info) VALUES (?, ?, ?, ?)",
+                (abs_path, size, mtime_ns, json.dumps(media_info)),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def probe(self, ffprobe_executable, path):
+        """Returns the info for path from the index, probing (and caching) it on a miss. Failed probes are not
+        cached: a timeout or error on a busy or network-mounted file is probed again next time."""
+        cached = self.get(path)
+        if cached is not None:
+            return cached
+        media_info = probe_media(ffprobe_executable, path)
+        if media_info is not None and not media_info.get("error") and os.path.exists(path):
+            self.put(path, media_info)
+        return media_info
+
+    def probe_many(self, ffprobe_executable, paths, jobs=8):
+        """Probes several files in parallel. Returns {path: info}."""
+        paths = list(paths)
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(paths)))) as executor:
+            return dict(zip(paths, executor.map(lambda p: self.probe(ffprobe_executable, p), paths)))
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_default_index():
+    """Returns the shared MediaIndex stored under DEFAULT_INDEX_PATH (creating its folder on first use)."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            os.makedirs(os.path.dirname(DEFAULT_INDEX_PATH), exist_ok=True)
+            _default_index = MediaIndex(DEFAULT_INDEX_PATH)
+        return _default_index
@@ -0,0 +1,84 @@
+import os
+import hashlib
+import subprocess
+import threading
+from dataclasses import dataclass
+
+# The pipeline mixes audio at 48 kHz, so noise beds are produced at that rate and need no resampling per job
+NOISE_SAMPLE_RATE = 48000
+
+# Decoded noise files, keyed by source file + parameters
+DEFAULT_NOISE_CACHE_DIR = os.path.join(".cache", "noise")
+
+@dataclass(frozen=True)
+class GeneratedNoise:
+    """
+    Noise synthesised inside each job's filter graph with anoisesrc, so no file is written or decoded.
+    The source is endless unless given a duration.
+    """
+    color: str = "white"
+    amplitude: float = 0.05
+    sample_rate: int = NOISE_SAMPLE_RATE
+
+    def lavfi_source(self, seconds=None):
+        source = f"anoisesrc=color={self.color}:amplitude={self.amplitude:g}:sample_rate={self.sample_rate}"
+        return source + (f":duration={seconds:.3f}" if seconds else "")
+
+    def __str__(self):
+        return f"generated {self.color} noise (amplitude {self.amplitude:g})"
+
+def noise_input_args(noise, seconds=None):
+    """
+    FFmpeg input arguments for a noise bed: a GeneratedNoise becomes a lavfi input, a file path is
+    looped. With seconds, the input ends after that long; otherwise it is endless.
+    """
+    if isinstance(noise, GeneratedNoise):
+        return ["-f", "lavfi", "-i", noise.lavfi_source(seconds)]
+    return ["-stream_loop", "-1"] + (["-t", f"{seconds:.3f}"] if seconds else []) + ["-i", noise]
+
+_cache_lock = threading.Lock()
+
+def cached_noise_bed(ffmpeg_executable, source_path, cache_dir=DEFAULT_NOISE_CACHE_DIR, sample_rate=NOISE_SAMPLE_RATE):
+    """
+    Returns a 16-bit PCM WAV copy of source_path at sample_rate, decoding it only the first time.
+    Jobs then read raw PCM instead of each decoding and resampling the (usually mp3) source again.
+    Falls back to source_path if it cannot be decoded.
+    """
+    stat = os.stat(source_path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{sample_rate}".encode("utf-8")
+    ).hexdigest()[:16]
+    bed_path = os.path.join(cache_dir, f"{key}.wav")
+    with _cache_lock:
+        if os.path.isfile(bed_path):
+            return bed_path
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{bed_path}.{os.getpid()}.tmp"
+        cmd = [
+            ffmpeg_executable,
+            "-i", source_path,
+            "-vn",
+            "-ar", str(sample_rate),
+            "-c:a", "pcm_s16le",
+            "-f", "wav",
+            "-y", tmp_path,
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            os.replace(tmp_path, bed_path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Warning: could not pre-decode noise file '{source_path}' ({e}). Using it as is.")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return source_path
+    return bed_path
+
+def resolve_noise_source(ffmpeg_executable, noise_file=None, default_noise_file=os.path.join("sounds", "background_noise.mp3")):
+    """
+    Picks the noise bed for a run: noise_file (or the default file if it exists) as a cached PCM bed,
+    otherwise noise generated in the filter graph.
+    """
+    source = noise_file or (default_noise_file if os.path.isfile(default_noise_file) else None)
+    if source:
+        return cached_noise_bed(ffmpeg_executable, source)
+    return GeneratedNoise()
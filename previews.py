@@ -0,0 +1,107 @@
+import os
+import json
+import random
+import hashlib
+
+from ffmpeg_capabilities import MissingCapabilityError
+from video_processor import build_ffmpeg_command, _run_ffmpeg, get_media_info
+
+# Proxy previews: the same filter graph as the real render, on a small frame, for the first few seconds,
+# encoded with x264 ultrafast. Good enough to judge zoom, rotation, text position and speed.
+PREVIEW_DIR = os.path.join(".cache", "previews")
+PREVIEW_FRAME_SIZE = (360, 640)
+PREVIEW_SECONDS = 3
+PREVIEW_TIMEOUT = 120
+MAX_CACHED_PREVIEWS = 200 # Oldest previews are removed beyond this
+# Copies of GUI uploads the previews are rendered from (full size), least recently used removed beyond this
+PREVIEW_SOURCES_DIR = os.path.join(PREVIEW_DIR, "sources")
+MAX_PREVIEW_SOURCE_BYTES = 5 * 1024 ** 3
+
+def file_digest(path, chunk_size=1 << 20):
+    """Content hash of a source file; previews stay valid when an upload is renamed or re-uploaded."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def preview_key(source_digest, settings):
+    """Cache key of a preview: the source content plus every setting that changes the picture or timing."""
+    payload = json.dumps({"source": source_digest, "settings": settings, "size": PREVIEW_FRAME_SIZE,
+                          "seconds": PREVIEW_SECONDS}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:20]
+
+def _prune_cache(cache_dir):
+    previews = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".mp4")]
+    if len(previews) <= MAX_CACHED_PREVIEWS:
+        return
+    previews.sort(key=os.path.getmtime)
+    for path in previews[:len(previews) - MAX_CACHED_PREVIEWS]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def prune_sources(sources_dir=PREVIEW_SOURCES_DIR, keep=None, max_bytes=MAX_PREVIEW_SOURCE_BYTES):
+    """Removes the least recently used source copies until the folder holds at most max_bytes (never keep)."""
+    sources = []
+    for name in os.listdir(sources_dir):
+        path = os.path.join(sources_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        sources.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in sources)
+    for _, size, path in sorted(sources):
+        if total <= max_bytes:
+            break
+        if path == keep or path.endswith(".part"):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def render_preview(ffmpeg_executable, input_path, settings, source_digest=None, cache_dir=PREVIEW_DIR):
+    """
+    Returns (preview_path, error) for input_path rendered with settings (the _execute_ffmpeg_command
+    keyword arguments). Previews are memoized per (source content, settings), so returning to earlier
+    settings is instant. Random effect strengths are seeded from the key, so a preview does not flicker
+    between reruns; the final render still draws its own.
+    """
+    source_digest = source_digest or file_digest(input_path)
+    key = preview_key(source_digest, settings)
+    preview_path = os.path.join(cache_dir, f"{key}.mp4")
+    if os.path.isfile(preview_path):
+        os.utime(preview_path) # Keep recently used previews when pruning
+        return preview_path, None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = preview_path + ".part"
+    try:
+        command = build_ffmpeg_command(
+            ffmpeg_executable, input_path, preview_path,
+            media_info=get_media_info(ffmpeg_executable, input_path),
+            rng=random.Random(key),
+            preset="ultrafast",
+            frame_size=PREVIEW_FRAME_SIZE,
+            max_seconds=PREVIEW_SECONDS,
+            write_parts=True,
+            **settings,
+        )
+    except MissingCapabilityError as e:
+        return None, str(e)
+    try:
+        returncode, _, stderr = _run_ffmpeg(command, timeout=PREVIEW_TIMEOUT)
+    except Exception as e:
+        return None, str(e)
+    if returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        lines = (stderr or "").strip().splitlines()
+        return None, lines[-1] if lines else f"FFmpeg exited with code {returncode}"
+    os.replace(tmp_path, preview_path)
+    _prune_cache(cache_dir)
+    return preview_path, None
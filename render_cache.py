@@ -0,0 +1,194 @@
+import os
+import mmap
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+
+# Finished renders, keyed by input content + every parameter that shapes the output (including the random
+# seed) + the FFmpeg version. A re-run, or a second upload of the same clip with the same settings, is
+# then a hardlink instead of an encode.
+DEFAULT_CACHE_DIR = os.path.join(".cache", "renders")
+DEFAULT_BUDGET_BYTES = 20 * 1024 ** 3 # Least recently used renders are evicted beyond this
+HASH_CHUNK_BYTES = 64 * 1024 * 1024
+
+def content_digest(path):
+    """SHA-256 of a file, hashed from an mmap in large slices (hashlib releases the GIL on big updates)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, HASH_CHUNK_BYTES):
+                        digest.update(view[offset:offset + HASH_CHUNK_BYTES])
+                finally:
+                    view.release()
+        except (OSError, ValueError): # Files that cannot be mapped (e.g. some network filesystems)
+            f.seek(0)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def derive_seed(input_digest, settings):
+    """Seed for a job's random effect strengths, fixed by the input content and settings so re-runs can hit the cache."""
+    payload = json.dumps({"input": input_digest, "settings": settings}, sort_keys=True, default=str)
+    return int(hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16], 16)
+
+class RenderCache:
+    """
+    Directory of cached outputs plus a SQLite index (sizes, last use, input digests), safe to share between threads.
+    Each entry is a folder holding a job's outputs (main clip and renditions) under their role names.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.db_path = os.path.join(cache_dir, "index.sqlite")
+        self._init_lock = threading.Lock()
+        self._initialised = False
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+
+    def _connect(self):
+        # One short-lived connection per call, as in media_probe.MediaIndex
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialised:
+            with self._init_lock:
+                conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+                conn.commit()
+                self._initialised = True
+        return conn
+
+    def input_digest(self, path):
+        """content_digest(path), remembered per (path, size, mtime) so unchanged inputs are only read once."""
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT size, mtime_ns, digest FROM digests WHERE path = ?", (abs_path,)).fetchone()
+        finally:
+            conn.close()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = content_digest(abs_path)
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                         (abs_path, stat.st_size, stat.st_mtime_ns, digest))
+            conn.commit()
+        finally:
+            conn.close()
+        return digest
+
+    @staticmethod
+    def key(input_digest, settings, seed, ffmpeg_version):
+        payload = json.dumps({"input": input_digest, "settings": settings, "seed": seed, "ffmpeg": ffmpeg_version},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lock_for(self, key):
+        """Lock held while a key is looked up and rendered, so identical jobs running at once encode only once."""
+        with self._key_locks_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, outputs):
+        """
+        outputs maps role names ('main', '720p', 'poster'...) to destination paths. If the cache has every one,
+        they are hardlinked (or copied across filesystems) into place and True is returned. An entry evicted
+        (by another process) while it is being restored counts as a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        sources = {role: os.path.join(entry_dir, role + os.path.splitext(path)[1]) for role, path in outputs.items()}
+        if not all(os.path.isfile(source) for source in sources.values()):
+            return False
+        # The main output goes last, so its presence means the whole job finished (as for fresh renders)
+        for role in sorted(outputs, key=lambda role: role == "main"):
+            tmp_path = f"{outputs[role]}.{os.getpid()}.tmp"
+            try:
+                try:
+                    os.link(sources[role], tmp_path)
+                except OSError:
+                    shutil.copyfile(sources[role], tmp_path)
+                os.replace(tmp_path, outputs[role])
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return False
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+
+    def store(self, key, outputs):
+        """Adds a job's finished outputs ({role: path}) to the cache, then evicts down to the budget."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        size = 0
+        try:
+            for role, path in outputs.items():
+                target = os.path.join(tmp_dir, role + os.path.splitext(path)[1])
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copyfile(path, target)
+                size += os.path.getsize(target)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            print(f"Warning: could not add render to the cache ({e}).")
+            return
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)", (key, size, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+        self.evict()
+
+    def evict(self, budget_bytes=None):
+        """Removes least recently used entries until the cache fits budget_bytes. Returns the bytes freed."""
+        budget_bytes = self.budget_bytes if budget_bytes is None else budget_bytes
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall()
+            total = sum(size for _, size in rows)
+            freed = 0
+            for key, size in rows:
+                if total - freed <= budget_bytes:
+                    break
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                freed += size
+            conn.commit()
+        finally:
+            conn.close()
+        return freed
+
+    def usage(self):
+        """(entry_count, total_bytes)"""
+        conn = self._connect()
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        finally:
+            conn.close()
+        return count, total
+
+def open_render_cache(cache_dir=DEFAULT_CACHE_DIR, budget_bytes=DEFAULT_BUDGET_BYTES):
+    """RenderCache in cache_dir, creating the folder."""
+    os.makedirs(cache_dir, exist_ok=True)
+    return RenderCache(cache_dir, budget_bytes)
@@ -0,0 +1,54 @@
+import os
+
+# Extra outputs a job can write next to its main 1080x1920 output, all from the same decode and filter
+# chain. Video renditions are scaled copies with their own quality settings; a poster is one JPEG frame.
+RENDITION_PRESETS = {
+    "720p": {
+        "description": "720x1280 lower-bitrate copy",
+        "width": 720,
+        "height": 1280,
+        "crf": 26,
+        "maxrate": "2500k",
+        "audio_bitrate": "128k",
+        "suffix": "_720p",
+    },
+    "480p": {
+        "description": "480x854 preview copy",
+        "width": 480,
+        "height": 854,
+        "crf": 28,
+        "maxrate": "1200k",
+        "audio_bitrate": "96k",
+        "suffix": "_480p",
+    },
+    "poster": {
+        "description": "JPEG poster frame",
+        "poster": True,
+        "at_seconds": 1.0, # Taken from the processed clip, so it shows the final look
+        "suffix": "_poster.jpg",
+    },
+}
+
+def parse_renditions(spec):
+    """'720p,poster' -> ['720p', 'poster']. Unknown names are reported and ignored."""
+    names = []
+    for name in (spec or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in RENDITION_PRESETS:
+            print(f"Warning: unknown rendition '{name}'. Available: {', '.join(RENDITION_PRESETS)}.")
+            continue
+        if name not in names:
+            names.append(name)
+    return names
+
+def rendition_output_path(output_path, name):
+    """tt_clip.mp4 + '720p' -> tt_clip_720p.mp4; a suffix with its own extension (poster) replaces the extension."""
+    base, ext = os.path.splitext(output_path)
+    suffix = RENDITION_PRESETS[name]["suffix"]
+    return base + suffix if os.path.splitext(suffix)[1] else base + suffix + ext
+
+def rendition_output_paths(output_path, names):
+    """{name: path} for every rendition of a job."""
+    return {name: rendition_output_path(output_path, name) for name in names or []}
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+# Per-input states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MANIFEST_FILENAME = ".manifest.json"
+PART_SUFFIX = ".part"
+
+def part_path_for(output_path):
+    """Path FFmpeg writes to while a job runs; it is renamed to output_path only once the encode succeeded."""
+    return output_path + PART_SUFFIX
+
+def finalize_part(output_path):
+    """Atomically moves the finished .part file into place."""
+    os.replace(part_path_for(output_path), output_path)
+
+def discard_part(output_path):
+    """Removes a half-written .part file, if any."""
+    try:
+        os.remove(part_path_for(output_path))
+    except FileNotFoundError:
+        pass
+
+def remove_stale_parts(folder):
+    """Deletes .part files (and .part folders of segmented jobs) left behind by a crashed or interrupted run.
+    Returns how many were removed."""
+    removed = 0
+    if not os.path.isdir(folder):
+        return removed
+    for name in os.listdir(folder):
+        if name.endswith(PART_SUFFIX):
+            path = os.path.join(folder, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def _input_fingerprint(input_path):
+    try:
+        stat = os.stat(input_path)
+        return {"input_size": stat.st_size, "input_mtime_ns": stat.st_mtime_ns}
+    except OSError:
+        return {"input_size": None, "input_mtime_ns": None}
+
+class RunManifest:
+    """
+    JSON record of every input's state in a batch run (pending/running/done/failed).
+    The file is rewritten atomically after each change, so it stays valid if the run crashes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not read run manifest '{path}' ({e}). Starting a new one.")
+                self.entries = {}
+
+    @classmethod
+    def for_output_folder(cls, output_folder):
+        return cls(os.path.join(output_folder, MANIFEST_FILENAME))
+
+    def _save(self):
+        # Caller holds the lock
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": time.time(), "entries": self.entries}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def mark(self, name, state, input_path=None, output_path=None, error=None):
+        """Records the new state of one input and persists the manifest."""
+        with self._lock:
+            entry = self.entries.setdefault(name, {})
+            entry["state"] = state
+            entry["error"] = error
+            entry["updated_at"] = time.time()
+            if input_path is not None:
+                entry["input_path"] = input_path
+                entry.update(_input_fingerprint(input_path))
+            if output_path is not None:
+                entry["output_path"] = output_path
+            self._save()
+
+    def state(self, name):
+        with self._lock:
+            return self.entries.get(name, {}).get("state")
+
+    def is_done(self, name, input_path, output_path):
+        """True if name finished in an earlier run, its output still exists and the input has not changed since."""
+        with self._lock:
+            entry = dict(self.entries.get(name, {}))
+        if entry.get("state") != DONE or not os.path.isfile(output_path):
+            return False
+        fingerprint = _input_fingerprint(input_path)
+        return (entry.get("input_size"), entry.get("input_mtime_ns")) == (fingerprint["input_size"], fingerprint["input_mtime_ns"])
+
+    def reset_interrupted(self):
+        """Entries left 'running' by a crashed run go back to 'pending'. Returns how many were reset."""
+        with self._lock:
+            interrupted = [name for name, entry in self.entries.items() if entry.get("state") == RUNNING]
+            for name in interrupted:
+                self.entries[name]["state"] = PENDING
+            if interrupted:
+                self._save()
+            return len(interrupted)
+
+    def prune_missing_inputs(self):
+        """
+        Forgets finished (done or failed) entries whose input file is gone, so a long-running watch keeps as
+        many entries as there are files in its folder. Returns how many were removed.
+        """
+        with self._lock:
+            gone = [name for name, entry in self.entries.items()
+                    if entry.get("state") in (DONE, FAILED) and entry.get("input_path") and not os.path.exists(entry["input_path"])]
+            for name in gone:
+                del self.entries[name]
+            if gone:
+                self._save()
+            return len(gone)
+
+    def counts(self):
+        """Returns {state: number of inputs in that state}."""
+        with self._lock:
+            counts = {}
+            for entry in self.entries.values():
+                counts[entry.get("state")] = counts.get(entry.get("state"), 0) + 1
+            return counts
@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import pathlib
+import subprocess
+import tempfile
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from video_processor import get_ffmpeg_path, build_ffmpeg_command, _run_ffmpeg
+from noise_beds import GeneratedNoise
+from ffmpeg_capabilities import MissingCapabilityError
+
+# python3 scripts/benchmark.py [--suite full] [--save-baseline]
+
+BENCH_DIR = os.path.join(".cache", "benchmark")
+INPUTS_DIR = os.path.join(BENCH_DIR, "inputs")
+DEFAULT_RESULTS_PATH = os.path.join(BENCH_DIR, "results.json")
+DEFAULT_BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# Synthetic inputs: (name, width, height, fps, seconds). testsrc2/sine are deterministic, so every
+# machine benchmarks the same pixels.
+INPUT_SUITES = {
+    "quick": [
+        ("360p30_5s", 640, 360, 30, 5),
+        ("vertical1080p30_5s", 1080, 1920, 30, 5),
+    ],
+    "full": [
+        ("360p30_10s", 640, 360, 30, 10),
+        ("720p25_10s", 1280, 720, 25, 10),
+        ("1080p30_10s", 1920, 1080, 30, 10),
+        ("1080p60_5s", 1920, 1080, 60, 5),
+        ("vertical1080p30_10s", 1080, 1920, 30, 10),
+        ("2160p30_5s", 3840, 2160, 30, 5),
+    ],
+}
+
+# Pipeline configurations: keyword arguments for build_ffmpeg_command. "noise" mixes in the generated noise bed
+# the CLI uses when there is no noise file.
+CONFIGS = {
+    "default": {},
+    "zoom": {"zoom_end_scale": 1.5},
+    "zoompan": {"ken_burns": "zoompan"}, # The previous Ken Burns engine, for comparison with "default"
+    "rotation": {"rotation_degrees": 2.0},
+    "text": {"text_to_overlay": "Benchmark overlay", "text_position": "Bottom Center", "font_size": 64,
+             "text_color": "white", "text_bg_color": "black@0.5"},
+    "speed": {"playback_speed": 1.1},
+    "noise": {"noise": True},
+    "fdk_aac": {"noise": True, "aac_encoder": "libfdk_aac"}, # Opt-in audio encoder, for comparison with "noise"
+}
+
+# Random choices of the pipeline (CRF, hue, grain...) are drawn from this seed so runs are comparable
+SEED = 1234
+# A metric counts as a regression when it is this much worse than the baseline
+DEFAULT_TOLERANCE = 0.10
+
+
+def generate_input(ffmpeg_bin, name, width, height, fps, seconds):
+    """Renders one synthetic test clip (testsrc2 video + sine audio) once and reuses it afterwards."""
+    path = os.path.join(INPUTS_DIR, f"{name}.mp4")
+    if os.path.isfile(path):
+        return path
+    os.makedirs(INPUTS_DIR, exist_ok=True)
+    cmd = [
+        ffmpeg_bin,
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-shortest",
+        "-y", path + ".part.mp4",
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    os.replace(path + ".part.mp4", path)
+    return path
+
+
+def ffmpeg_version(ffmpeg_bin):
+    try:
+        out = subprocess.run([ffmpeg_bin, "-version"], capture_output=True, text=True).stdout
+        return out.splitlines()[0] if out else None
+    except OSError:
+        return None
+
+
+def parse_bench_output(stderr):
+    """Pulls frame count, CPU times and peak RSS out of FFmpeg's -benchmark / stats output."""
+    frames = re.findall(r"frame=\s*(\d+)", stderr)
+    rtime = re.search(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s", stderr)
+    maxrss = re.search(r"bench: maxrss=(\d+)", stderr)
+    return {
+        "frames": int(frames[-1]) if frames else None,
+        "user_seconds": float(rtime.group(1)) if rtime else None,
+        "system_seconds": float(rtime.group(2)) if rtime else None,
+        "maxrss_kb": int(maxrss.group(1)) if maxrss else None,
+    }
+
+
+def run_case(ffmpeg_bin, input_path, media_info, config_name, noise_path, out_dir, threads=None, repeat=1):
+    """Runs one input/config pair repeat times and keeps the fastest run."""
+    kwargs = dict(CONFIGS[config_name])
+    use_noise = kwargs.pop("noise", False)
+    output_path = os.path.join(out_dir, f"{config_name}_{os.path.basename(input_path)}")
+    best = None
+    for _ in range(repeat):
+        try:
+            cmd = build_ffmpeg_command(ffmpeg_bin, input_path, output_path,
+                                       noise_audio_path=noise_path if use_noise else None,
+                                       threads=threads, media_info=media_info, rng=random.Random(SEED), **kwargs)
+        except MissingCapabilityError as e:
+            return {"ok": False, "error": str(e)}
+        cmd.insert(1, "-benchmark")
+        start = time.monotonic()
+        returncode, _, stderr = _run_ffmpeg(cmd)
+        wall = time.monotonic() - start
+        if returncode != 0:
+            lines = [line for line in (stderr or "").strip().splitlines() if not line.startswith("bench:")]
+            return {"ok": False, "error": lines[-1] if lines else f"exit code {returncode}"}
+        run = {"ok": True, "error": None, "wall_seconds": wall, **parse_bench_output(stderr)}
+        run["encode_fps"] = run["frames"] / wall if run["frames"] and wall > 0 else None
+        run["output_bytes"] = os.path.getsize(output_path)
+        if best is None or run["wall_seconds"] < best["wall_seconds"]:
+            best = run
+    return best
+
+
+def run_suite(suite, configs, threads=None, repeat=1):
+    ffmpeg_bin = get_ffmpeg_path()
+    noise_path = GeneratedNoise()
+    report = {
+        "created_at": time.time(),
+        "suite": suite,
+        "ffmpeg": ffmpeg_version(ffmpeg_bin),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": threads,
+        "repeat": repeat,
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="10xreach_bench_") as out_dir:
+        for name, width, height, fps, seconds in INPUT_SUITES[suite]:
+            print(f"Generating input {name}...")
+            input_path = generate_input(ffmpeg_bin, name, width, height, fps, seconds)
+            # The inputs are known exactly, so no ffprobe is needed
+            media_info = {"duration": float(seconds), "width": width, "height": height, "fps": float(fps), "sar": 1.0,
+                          "video_codec": "h264", "audio_codec": "aac", "audio_sample_rate": 48000,
+                          "has_video": True, "has_audio": True}
+            for config_name in configs:
+                result = run_case(ffmpeg_bin, input_path, media_info, config_name, noise_path, out_dir, threads, repeat)
+                result.update(input=name, config=config_name)
+                report["results"].append(result)
+                if result["ok"]:
+                    rss = f"{result['maxrss_kb'] / 1024:.0f} MiB" if result["maxrss_kb"] else "n/a"
+                    fps_text = f"{result['encode_fps']:.1f}" if result["encode_fps"] else "n/a"
+                    print(f"  {config_name:<10} {result['wall_seconds']:>7.2f}s  {fps_text:>7} fps  {rss:>9}  {result['output_bytes'] / 1e6:.2f} MB")
+                else:
+                    print(f"  {config_name:<10} FAILED: {result['error']}")
+    return report
+
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns a list of regression messages (empty if none)."""
+    if baseline.get("ffmpeg") != report.get("ffmpeg") or baseline.get("platform") != report.get("platform"):
+        print("Warning: the baseline was recorded with a different FFmpeg build or platform; timings may not be comparable.")
+    base = {(r["input"], r["config"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        key = (result["input"], result["config"])
+        old = base.get(key)
+        if not old:
+            continue
+        label = f"{key[0]}/{key[1]}"
+        if old.get("ok") and not result["ok"]:
+            regressions.append(f"{label}: now fails ({result['error']})")
+            continue
+        if not (old.get("ok") and result["ok"]):
+            continue
+        for metric in ("wall_seconds", "maxrss_kb"):
+            if old.get(metric) and result.get(metric) and result[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{label}: {metric} {old[metric]:.2f} -> {result[metric]:.2f} "
+                                   f"(+{(result[metric] / old[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the processing pipeline on synthetic clips.")
+    parser.add_argument("--suite", choices=sorted(INPUT_SUITES), default="quick", help="Set of test inputs (default: %(default)s).")
+    parser.add_argument("--config", action="append", choices=sorted(CONFIGS), help="Only run this configuration (repeatable). Default: all.")
+    parser.add_argument("--threads", type=int, help="Threads per FFmpeg job (default: FFmpeg's choice).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest is kept (default: %(default)s).")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_PATH, help="Results JSON file (default: %(default)s).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Baseline JSON to compare against (default: %(default)s).")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown before flagging a regression (default: %(default)s = 10%%).")
+    args = parser.parse_args()
+
+    configs = args.config or list(CONFIGS)
+    report = run_suite(args.suite, configs, threads=args.threads, repeat=max(1, args.repeat))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            exit(1)
+        print("No regressions against the baseline.")
+    else:
+        print("No baseline found. Run with --save-baseline to record one.")
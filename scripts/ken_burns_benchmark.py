@@ -0,0 +1,121 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+
+from video_processor import get_ffmpeg_path, _run_ffmpeg, _is_normalised_frame, OUTPUT_FRAME_SIZE
+from filter_graph import FilterGraph, GEOMETRY, TIMING
+from ken_burns import KEN_BURNS_ENGINES, TRAJECTORY_FPS, add_ken_burns
+from benchmark import BENCH_DIR, generate_input, ffmpeg_version, parse_bench_output
+
+# python3 scripts/ken_burns_benchmark.py [--zoom-end 1.1 1.5] [--repeat 3]
+#
+# Times the Ken Burns stage alone (fit to 1080x1920, then zoom/pan) for each engine on synthetic clips,
+# and checks that the engines follow the same trajectory (SSIM between their outputs, frame by frame).
+# The crop engine's cost grows with the zoom speed (one new scaler per window size), so several zoom
+# ends are measured: 1.1 is the default trajectory, random zooms go up to 2.0.
+
+DEFAULT_RESULTS_PATH = os.path.join(BENCH_DIR, "ken_burns.json")
+
+# (name, width, height, fps, seconds), as in benchmark.py
+INPUTS = [
+    ("vertical1080p30_10s", 1080, 1920, 30, 10),
+    ("1080p60_5s", 1920, 1080, 60, 5),
+    ("720p24_10s", 1280, 720, 24, 10),
+]
+
+def ken_burns_chain(engine, media_info, zoom_end, pan_x, pan_y, keep_source_fps=False, frame_size=OUTPUT_FRAME_SIZE):
+    """Filter string of the fit + zoom/pan part of the pipeline, built as build_video_filter_graph builds it."""
+    width, height = frame_size
+    fps = media_info["fps"]
+    graph = FilterGraph()
+    if engine != "zoompan" and not keep_source_fps:
+        graph.add("fps", [("", str(TRAJECTORY_FPS))], TIMING)
+    if not _is_normalised_frame(media_info, frame_size):
+        graph.add("scale", [("w", str(width)), ("h", str(height)), ("force_original_aspect_ratio", "decrease")], GEOMETRY)
+        graph.add("pad", [("w", str(width)), ("h", str(height)), ("x", "(ow-iw)/2"), ("y", "(oh-ih)/2")], GEOMETRY)
+    add_ken_burns(graph, engine, frame_size, (zoom_end - 1.0) / (29 * 30), zoom_end, pan_x, pan_y,
+                  fps=fps if keep_source_fps else TRAJECTORY_FPS)
+    return graph.to_string()
+
+def time_chain(ffmpeg_bin, input_path, chain, threads, repeat):
+    """(best wall seconds, frames) of decoding input_path through chain into the null muxer."""
+    best = None
+    for _ in range(repeat):
+        cmd = [ffmpeg_bin, "-benchmark", "-filter_threads", str(threads), "-i", input_path, "-vf", chain, "-f", "null", "-"]
+        start = time.monotonic()
+        returncode, _, stderr = _run_ffmpeg(cmd)
+        wall = time.monotonic() - start
+        if returncode != 0:
+            raise RuntimeError(stderr.strip().splitlines()[-1] if stderr.strip() else f"exit code {returncode}")
+        if best is None or wall < best[0]:
+            best = (wall, parse_bench_output(stderr)["frames"])
+    return best
+
+def trajectory_ssim(ffmpeg_bin, input_path, chain_a, chain_b):
+    """Average SSIM (0-1) between two chains' outputs of the same input."""
+    cmd = [ffmpeg_bin, "-i", input_path, "-filter_complex",
+           f"[0:v]split[a][b];[a]{chain_a}[x];[b]{chain_b}[y];[x][y]ssim", "-f", "null", "-"]
+    returncode, _, stderr = _run_ffmpeg(cmd)
+    match = re.search(r"SSIM.*?All:\s*([0-9.]+)", stderr or "")
+    return float(match.group(1)) if returncode == 0 and match else None
+
+def run(zoom_ends, pan_x, pan_y, threads, repeat):
+    ffmpeg_bin = get_ffmpeg_path()
+    report = {"created_at": time.time(), "ffmpeg": ffmpeg_version(ffmpeg_bin), "cpu_count": os.cpu_count(), "threads": threads,
+              "zoom_ends": zoom_ends, "pan": [pan_x, pan_y], "results": []}
+    for name, width, height, fps, seconds in INPUTS:
+        print(f"Generating input {name}...")
+        input_path = generate_input(ffmpeg_bin, name, width, height, fps, seconds)
+        media_info = {"width": width, "height": height, "fps": fps, "sar": 1.0}
+        decode_seconds, _ = time_chain(ffmpeg_bin, input_path, "null", threads, repeat)
+        print(f"  {'decode only':<30} {decode_seconds:>6.2f}s")
+        cases = [(engine, False, zoom_end) for zoom_end in zoom_ends for engine in KEN_BURNS_ENGINES]
+        if fps != TRAJECTORY_FPS:
+            # zoompan cannot keep the source rate without retiming the clip
+            cases += [("crop", True, zoom_end) for zoom_end in zoom_ends]
+        for engine, keep_source_fps, zoom_end in cases:
+            label = f"{engine}{' (source fps)' if keep_source_fps else ''} zoom {zoom_end:g}"
+            chain = ken_burns_chain(engine, media_info, zoom_end, pan_x, pan_y, keep_source_fps)
+            try:
+                wall, frames = time_chain(ffmpeg_bin, input_path, chain, threads, repeat)
+            except RuntimeError as e:
+                print(f"  {label:<30} FAILED: {e}")
+                report["results"].append({"input": name, "engine": engine, "keep_source_fps": keep_source_fps,
+                                          "zoom_end": zoom_end, "ok": False, "error": str(e)})
+                continue
+            # Time spent in the filters, without decoding. Engines are compared on input frames per second, as
+            # they do not output the same number of frames for a 60 fps source (the crop engine drops half first).
+            filter_seconds = max(wall - decode_seconds, 1e-6)
+            result = {"input": name, "engine": engine, "keep_source_fps": keep_source_fps, "zoom_end": zoom_end, "ok": True,
+                      "frames": frames, "wall_seconds": wall, "filter_seconds": filter_seconds,
+                      "input_fps": fps * seconds / filter_seconds}
+            if fps == TRAJECTORY_FPS and engine == "crop":
+                # zoompan retimes other rates to 30 fps frame by frame, so only 30 fps inputs line up
+                result["ssim_vs_zoompan"] = trajectory_ssim(ffmpeg_bin, input_path,
+                                                            ken_burns_chain("zoompan", media_info, zoom_end, pan_x, pan_y), chain)
+            report["results"].append(result)
+            match = f"  SSIM vs zoompan {result['ssim_vs_zoompan'] * 100:.2f}%" if result.get("ssim_vs_zoompan") else ""
+            print(f"  {label:<30} {wall:>6.2f}s  {frames:>5} frames out  filters {filter_seconds:>6.2f}s = "
+                  f"{result['input_fps']:>7.1f} input fps{match}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the Ken Burns engines on synthetic clips.")
+    parser.add_argument("--zoom-end", type=float, nargs="+", default=[1.1, 1.5], help="Final zoom factors (default: %(default)s).")
+    parser.add_argument("--pan", type=float, nargs=2, default=[0.2, -0.1], metavar=("X", "Y"), help="Pan offsets (default: %(default)s).")
+    parser.add_argument("--threads", type=int, default=1, help="Filter threads (default: %(default)s, as zoompan is single-threaded).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is kept (default: %(default)s).")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_PATH, help="Results JSON file (default: %(default)s).")
+    args = parser.parse_args()
+
+    report = run(args.zoom_end, args.pan[0], args.pan[1], max(1, args.threads), max(1, args.repeat))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -7,12 +7,13 @@ import pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
 
 from video_processor import get_ffmpeg_path
+from encoding_profiles import ENCODING_PROFILES, video_encoder_args
 
 VIDEOS_DIR = "videos"
 OUTPUT_DIR = "treated"
 
 
-def build_ffmpeg_cmd(ffmpeg_bin: str, input_path: str, output_path: str, speed: float):
+def build_ffmpeg_cmd(ffmpeg_bin: str, input_path: str, output_path: str, speed: float, profile: str = "draft"):
     """Return FFmpeg command list that changes playback speed without initial grey frame."""
     # Video: adjust PTS; use STARTPTS trick to avoid grey frame
     v_filter = f"setpts=(PTS-STARTPTS)/{speed}"
@@ -38,8 +39,7 @@ def build_ffmpeg_cmd(ffmpeg_bin: str, input_path: str, output_path: str, speed:
         "-vf", v_filter,
         "-af", a_filter,
         "-map_metadata", "-1",
-        "-c:v", "libx264",
-        "-preset", "veryfast",
+        *video_encoder_args(profile),
         "-c:a", "aac",
         "-y",
         output_path,
@@ -47,7 +47,7 @@ def build_ffmpeg_cmd(ffmpeg_bin: str, input_path: str, output_path: str, speed:
     return cmd
 
 
-def process_files(speed: float, specific_file: str = None):
+def process_files(speed: float, specific_file: str = None, profile: str = "draft"):
     ffmpeg_path = get_ffmpeg_path()
 
     if not os.path.isdir(OUTPUT_DIR):
@@ -68,7 +68,7 @@ def process_files(speed: float, specific_file: str = None):
         base, ext = os.path.splitext(name)
         out_name = f"spd_{speed:.2f}x_{base}{ext}"
         out_path = os.path.join(OUTPUT_DIR, out_name)
-        cmd = build_ffmpeg_cmd(ffmpeg_path, in_path, out_path, speed)
+        cmd = build_ffmpeg_cmd(ffmpeg_path, in_path, out_path, speed, profile)
         print("Running:", " ".join(cmd))
         try:
             subprocess.run(cmd, check=True)
@@ -81,10 +81,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Apply slight playback-speed change to videos, fixing grey-screen issue.")
     parser.add_argument("--speed", type=float, default=1.03, help="Playback speed multiplier (e.g. 1.03 for 3% faster).")
     parser.add_argument("--file", type=str, help="Single filename in videos/ to process.")
+    parser.add_argument("--profile", choices=sorted(ENCODING_PROFILES), default="draft", help="Encoding speed profile (default: %(default)s).")
     args = parser.parse_args()
 
     if args.speed <= 0:
         print("Speed must be positive.")
         exit(1)
 
-    process_files(args.speed, args.file) 
\ No newline at end of file
+    process_files(args.speed, args.file, args.profile) 
\ No newline at end of file
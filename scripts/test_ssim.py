@@ -22,7 +22,7 @@ out2 = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4').name
 
 base_filters = (
     "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2,"
-    "zoompan=z='min(max(1,zoom)+0.000115,1.1)':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s=1080x1920:d=1:fps=30," \
+    "zoompan=z='min(1+0.000115*(on+1),1.1)':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s=1080x1920:d=1:fps=30," \
     "drawbox=x=2:y=2:w=2:h=2:color=white@0.9:t=fill,setsar=1,eq=brightness=0.005:contrast=1.005"
 )
 
@@ -0,0 +1,58 @@
+import os
+
+from filter_graph import FilterGraph, GEOMETRY, TIMING, METADATA
+from render_cache import RenderCache
+
+# Intermediates of the expensive early stages of a job (frame rate conversion, fit to 1080x1920, Ken Burns
+# zoom/pan, rotation), keyed by input content + the exact filter string of those stages + the FFmpeg version.
+# A job that only changes later stages (text, flip, colour, grain, speed, audio...) decodes the intermediate
+# instead of decoding the source and redoing them. Entries are RenderCache entries with a single file.
+DEFAULT_STAGE_CACHE_DIR = os.path.join(".cache", "stages")
+DEFAULT_STAGE_BUDGET_BYTES = 10 * 1024 ** 3 # Least recently used intermediates are evicted beyond this
+STAGE_ROLE = "mezzanine"
+STAGE_FILENAME = "mezzanine.nut" # NUT keeps the filtered timestamps exactly
+# Lossless, so a job started from an intermediate gives the same frames as one started from the source.
+# ultrafast x264 (no CABAC, no B-frames) decodes about as fast as a typical phone clip.
+STAGE_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-qp", "0"]
+# The source audio decoded, as the job decodes it. Copied AAC would keep its encoder delay, and the muxer
+# would move the video back by it (a frame duplicated at the start of every job started from the intermediate).
+STAGE_AUDIO_ARGS = ["-c:a", "pcm_f32le"]
+STAGE_FORMAT = 1 # Part of the key; bump when the intermediate's encoding changes
+
+# The upstream part is the leading run of these stages (TIMING there is the fps conversion)
+_UPSTREAM_KINDS = (GEOMETRY, TIMING, METADATA)
+
+def split_upstream(graph):
+    """
+    (upstream, downstream) FilterGraphs of an optimised job graph: the leading stages up to the last geometry
+    stage before anything that adds content (the 2x2 dot, noise, text...), and the rest. upstream is empty
+    if there is nothing worth caching or nothing would be left downstream.
+    """
+    end = 0
+    for i, stage in enumerate(graph.stages):
+        if stage.kind not in _UPSTREAM_KINDS or stage.sources:
+            break
+        if stage.kind == GEOMETRY:
+            end = i + 1
+    if end >= len(graph.stages):
+        end = 0
+    return FilterGraph(graph.stages[:end]), FilterGraph(graph.stages[end:])
+
+def stage_window_seconds(media_info, playback_speed=1.0, max_seconds=29):
+    """
+    Source seconds an intermediate holds: None (the whole clip) if the job uses all of it, else the window
+    the output is cut from. Clips no longer than the window then share one intermediate across speeds.
+    """
+    window = max_seconds * playback_speed
+    duration = (media_info or {}).get("duration")
+    return None if duration and duration <= window else round(window, 3)
+
+def stage_key(cache, input_digest, upstream, seconds, ffmpeg_version):
+    """Key of the intermediate of input_digest through the upstream FilterGraph, cut to seconds (None = whole clip)."""
+    return cache.key(input_digest, {"upstream": upstream.to_string(), "seconds": seconds, "format": STAGE_FORMAT},
+                     None, ffmpeg_version)
+
+def open_stage_cache(cache_dir=DEFAULT_STAGE_CACHE_DIR, budget_bytes=DEFAULT_STAGE_BUDGET_BYTES):
+    """RenderCache of intermediates in cache_dir, creating the folder."""
+    os.makedirs(cache_dir, exist_ok=True)
+    return RenderCache(cache_dir, budget_bytes)
@@ -0,0 +1,131 @@
+import json
+import random
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+from video_processor import build_video_filter_graph, get_media_info, chain_pix_fmt
+
+# Memory caps of the two caches (PNG source frames, JPEG stills)
+DEFAULT_FRAME_CACHE_BYTES = 256 * 1024 * 1024 # Decoded source frames
+DEFAULT_STILL_CACHE_BYTES = 64 * 1024 * 1024 # Rendered stills
+STILL_TIMEOUT = 30
+
+# _execute_ffmpeg_command settings that change the picture (everything else is ignored for stills)
+_GRAPH_SETTINGS = ("horizontal_flip", "text_to_overlay", "text_position", "font_size", "text_color", "text_bg_color",
+                   "text_bold", "text_italic", "rotation_degrees", "playback_speed", "random_zoom_pan", "zoom_end_scale",
+                   "ken_burns")
+
+class ByteLRUCache:
+    """Thread-safe LRU cache of bytes values, evicting least recently used entries beyond max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return # Would evict everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+class StillRenderer:
+    """
+    Renders single frames of a clip at output time T through the same filter graph as the full render.
+    The decoded source frame near T is cached separately from the rendered still, so changing a
+    setting (text size, rotation...) only re-runs the filters, not the seek and decode.
+    """
+
+    def __init__(self, ffmpeg_executable, frame_cache_bytes=DEFAULT_FRAME_CACHE_BYTES, still_cache_bytes=DEFAULT_STILL_CACHE_BYTES):
+        self.ffmpeg_executable = ffmpeg_executable
+        self.frames = ByteLRUCache(frame_cache_bytes)
+        self.stills = ByteLRUCache(still_cache_bytes)
+
+    def _run(self, command, stdin_bytes=None):
+        result = subprocess.run(command, input=stdin_bytes, capture_output=True, timeout=STILL_TIMEOUT)
+        if result.returncode != 0 or not result.stdout:
+            lines = result.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"FFmpeg exited with code {result.returncode}")
+        return result.stdout
+
+    def source_frame(self, input_path, source_seconds, source_digest=None):
+        """PNG bytes of the source frame at source_seconds (decoded once, then served from the cache)."""
+        key = (source_digest or input_path, round(source_seconds, 3))
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self._run([
+                self.ffmpeg_executable, "-v", "error",
+                "-ss", f"{source_seconds:.3f}", "-i", input_path,
+                "-frames:v", "1", "-f", "image2pipe", "-c:v", "png", "pipe:1",
+            ])
+            self.frames.put(key, frame)
+        return frame
+
+    def render(self, input_path, seconds, settings, source_digest=None, media_info=None, seed=None):
+        """
+        Returns (jpeg_bytes, error) for the processed frame shown at `seconds` into the output clip.
+        settings are _execute_ffmpeg_command keyword arguments. seed is the job's seed, if known (e.g.
+        video_processor.stage_seed); the still then shows the render's own random effects (hue, grain, lens,
+        zoom/pan). Without it they are seeded from the settings, so the still is only illustrative of them.
+        """
+        graph_settings = {k: settings[k] for k in _GRAPH_SETTINGS if k in settings}
+        settings_key = json.dumps(graph_settings, sort_keys=True, default=str)
+        key = (source_digest or input_path, round(seconds, 3), settings_key, seed)
+        still = self.stills.get(key)
+        if still is not None:
+            return still, None
+
+        playback_speed = graph_settings.get("playback_speed") or 1.0
+        if seed is not None:
+            rng = random.Random(seed)
+            rng.randint(21, 25) # CRF, drawn first in build_ffmpeg_command
+        else:
+            rng = random.Random(hashlib.sha1(f"{source_digest or input_path}|{settings_key}".encode("utf-8")).hexdigest())
+        try:
+            # Output time T shows the source at T * speed, which is where the zoom trajectory (30 steps per second) is
+            frame = self.source_frame(input_path, seconds * playback_speed, source_digest)
+            if media_info is None:
+                media_info = get_media_info(self.ffmpeg_executable, input_path)
+            # Pinned like the real render, so the still has its chroma resolution too (the decoded frame is RGB)
+            graph = build_video_filter_graph(
+                media_info=media_info,
+                rng=rng,
+                frame_offset=seconds * playback_speed * 30,
+                single_frame=True,
+                **graph_settings,
+            ).optimize(chain_pix_fmt(media_info))
+            still = self._run([
+                self.ffmpeg_executable, "-v", "error",
+                "-f", "image2pipe", "-c:v", "png", "-i", "pipe:0",
+                "-vf", graph.to_string(),
+                # JPEG encodes several times faster than PNG at 1080x1920 and keeps the cache small
+                "-frames:v", "1", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "2", "pipe:1",
+            ], stdin_bytes=frame)
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            return None, str(e)
+        self.stills.put(key, still)
+        return still, None
@@ -0,0 +1,86 @@
+import os
+import hashlib
+import platform
+import threading
+
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+except ImportError: # Pillow comes with Streamlit; without it text falls back to per-frame drawtext
+    Image = None
+
+# Static text overlays are rendered once to a transparent PNG and composited with overlay, instead of
+# drawtext shaping and drawing the glyphs again on every frame. Rasters are shared by every clip (and
+# later run) with the same text, font, size, colours and box.
+OVERLAY_CACHE_DIR = os.path.join(".cache", "overlays")
+
+_lock = threading.Lock()
+_rasters = {} # key -> (path, width, height)
+
+def _parse_color(spec):
+    """FFmpeg colour syntax ('white', '#FF0000', '0xFF0000', 'black@0.5') -> RGBA tuple, or None if unknown."""
+    name, _, alpha = str(spec).strip().partition("@")
+    if name.lower().startswith("0x"):
+        name = "#" + name[2:]
+    try:
+        rgba = ImageColor.getcolor(name, "RGBA")
+        if alpha:
+            rgba = rgba[:3] + (max(0, min(255, round(float(alpha) * 255))),)
+    except ValueError:
+        return None
+    return rgba
+
+def rasterize_text(text, font_file, font_px, text_color, box_color=None, box_border=0, cache_dir=OVERLAY_CACHE_DIR):
+    """
+    Returns (png_path, width, height) of text drawn like drawtext would (optionally on a box with
+    box_border pixels of padding), or None if it cannot be rasterized here (no Pillow, no font file,
+    or a colour Pillow does not understand); the caller then uses drawtext.
+    """
+    if Image is None or not font_file or not os.path.isfile(font_file):
+        return None
+    fill = _parse_color(text_color)
+    box_fill = _parse_color(box_color) if box_color else None
+    if fill is None or (box_color and box_fill is None):
+        return None
+    stat = os.stat(font_file)
+    key = hashlib.sha1(
+        repr((text, os.path.abspath(font_file), stat.st_size, stat.st_mtime_ns, font_px, fill, box_fill, box_border)).encode("utf-8")
+    ).hexdigest()[:20]
+
+    with _lock:
+        cached = _rasters.get(key)
+        if cached and os.path.isfile(cached[0]):
+            return cached
+        path = os.path.join(cache_dir, f"{key}.png")
+        try:
+            if os.path.isfile(path):
+                with Image.open(path) as image:
+                    cached = (path, image.width, image.height)
+            else:
+                font = ImageFont.truetype(font_file, font_px)
+                left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).multiline_textbbox((0, 0), text, font=font)
+                border = box_border if box_fill else 0
+                width, height = right - left + 2 * border, bottom - top + 2 * border
+                image = Image.new("RGBA", (max(1, width), max(1, height)), box_fill or (0, 0, 0, 0))
+                ImageDraw.Draw(image).multiline_text((border - left, border - top), text, font=font, fill=fill)
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                image.save(tmp_path, format="PNG")
+                os.replace(tmp_path, path)
+                cached = (path, image.width, image.height)
+        except OSError as e:
+            print(f"Warning: could not pre-render text overlay ({e}). Using drawtext.")
+            return None
+        _rasters[key] = cached
+    return cached
+
+def filter_path(path):
+    """path as a quoted filter option value (movie=, sendcmd=...), escaped for use inside a filter graph."""
+    path = os.path.abspath(path).replace("'", "'\\''")
+    if platform.system() == "Windows":
+        # Same escaping as drawtext's fontfile: forward slashes, and the drive colon escaped
+        path = path.replace("\\", "/").replace(":", "\\:")
+    return f"'{path}'"
+
+def movie_source(path):
+    """movie source filter reading the image at path, escaped for use inside a filter graph."""
+    return f"movie=filename={filter_path(path)}"
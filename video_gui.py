@@ -1,11 +1,25 @@
 import os
 import tempfile
 import shutil
+import time
+import uuid
+import hashlib
 import streamlit as st
 import zipfile
-import io # Import io for BytesIO
-
-from video_processor import get_ffmpeg_path, _execute_ffmpeg_command, compute_ssim_percent
+from urllib.parse import quote
+
+from video_processor import get_ffmpeg_path, _execute_ffmpeg_command, compute_ssim_percent, plan_thread_budget, estimate_output_frames, stage_seed, SIMILARITY_MODES
+from encoding_profiles import ENCODING_PROFILES, DEFAULT_PROFILE, choose_preset_for_deadline
+from media_probe import get_ffprobe_path, get_default_index
+from ffmpeg_progress import format_progress
+from noise_beds import cached_noise_bed
+from renditions import RENDITION_PRESETS, rendition_output_paths
+from render_cache import open_render_cache
+from stage_cache import open_stage_cache
+from previews import render_preview, prune_sources, PREVIEW_SOURCES_DIR, PREVIEW_FRAME_SIZE, PREVIEW_SECONDS
+from still_frames import StillRenderer
+from background_jobs import BackgroundJobManager, FINISHED_STATES, DONE, FAILED, CANCELLED
+import run_manifest
 
 # python3 -m streamlit run video_gui.py
 
@@ -148,70 +162,400 @@ if use_universal:
 
 
 
+# ----------------------------
+# Resources kept across reruns
+# ----------------------------
+@st.cache_resource
+def get_ffmpeg():
+    """FFmpeg path, detected once per server process rather than on every rerun that needs it."""
+    return get_ffmpeg_path()
+
+
+@st.cache_data(show_spinner=False)
+def probe_source(path):
+    """ffprobe info of a preview source, kept in memory across reruns. Sources are named by their content hash,
+    so the path is enough of a key."""
+    return get_default_index().probe(get_ffprobe_path(get_ffmpeg()), path)
+
+
+# ----------------------------
+# Background processing
+# ----------------------------
+@st.cache_resource
+def get_job_manager():
+    """One shared executor per server process, so jobs survive reruns and widget interactions."""
+    max_workers, _ = plan_thread_budget()
+    return BackgroundJobManager(max_workers=max_workers)
+
+
+def collect_video_settings(idx):
+    """Returns the _execute_ffmpeg_command keyword arguments for upload number idx (0-based)."""
+    if use_universal:
+        add_text = st.session_state.get("u_add_text", False)
+        return dict(
+            text_to_overlay=st.session_state.get("u_text") if add_text else None,
+            text_position=st.session_state.get("u_pos") if add_text else None,
+            font_size=st.session_state.get("u_size") if add_text else None,
+            text_color=st.session_state.get("u_color") if add_text else None,
+            text_bg_color=st.session_state.get("u_bg") if add_text else None,
+            text_bold=st.session_state.get("u_bold", False) if add_text else False,
+            text_italic=st.session_state.get("u_italic", False) if add_text else False,
+            rotation_degrees=st.session_state.get("u_rotation", 0.0),
+            horizontal_flip=st.session_state.get("u_hflip", False),
+            playback_speed=st.session_state.get("u_speed", DEFAULT_SPEED),
+            random_zoom_pan=False,
+            zoom_end_scale=st.session_state.get("u_zoom_scale", 1.10),
+        )
+    add_text = st.session_state.get(f"add_text_{idx}", False)
+    return dict(
+        text_to_overlay=st.session_state.get(f"text_{idx}") if add_text else None,
+        text_position=st.session_state.get(f"pos_{idx}") if add_text else None,
+        font_size=st.session_state.get(f"size_{idx}") if add_text else None,
+        text_color=st.session_state.get(f"color_{idx}") if add_text else None,
+        text_bg_color=st.session_state.get(f"bg_{idx}") if add_text else None,
+        text_bold=st.session_state.get(f"bold_{idx}", False) if add_text else False,
+        text_italic=st.session_state.get(f"italic_{idx}", False) if add_text else False,
+        rotation_degrees=st.session_state.get(f"rotation_{idx}", 0.0),
+        horizontal_flip=st.session_state.get(f"hflip_{idx}", False),
+        playback_speed=st.session_state.get(f"speed_{idx}", DEFAULT_SPEED),
+        random_zoom_pan=False,
+        zoom_end_scale=st.session_state.get(f"zoom_scale_{idx}", 1.10),
+    )
+
+
+def process_upload_job(ffmpeg_path, input_path, output_path, filename, settings, noise_path=None, threads=None, manifest=None,
+                       report=None, cancel_event=None):
+    """Background job: encode one upload, measuring its SSIM score in the same FFmpeg pass."""
+    report(progress=0.0, message="Encoding")
+    similarity = settings.get("similarity") or "full"
+    inline_ssim = []
+
+    def encode_progress(progress):
+        # Encoding takes up the first 95% of the bar, the final rename (or a standalone SSIM pass) the rest
+        if progress["percent"] is not None:
+            report(progress=0.95 * progress["percent"], message=f"Encoding: {format_progress(progress)}")
+
+    if manifest:
+        manifest.mark(filename, run_manifest.RUNNING, input_path=input_path, output_path=output_path)
+    processed_ok = _execute_ffmpeg_command(
+        ffmpeg_path,
+        input_path,
+        output_path,
+        filename,
+        noise_audio_path=noise_path,
+        threads=threads,
+        cancel_event=cancel_event,
+        on_progress=encode_progress,
+        on_similarity=inline_ssim.append,
+        **dict(settings, similarity=similarity),
+    )
+    if manifest:
+        manifest.mark(filename, run_manifest.DONE if processed_ok else
+                      (run_manifest.PENDING if cancel_event.is_set() else run_manifest.FAILED))
+    if not processed_ok or cancel_event.is_set():
+        return {"ok": False, "output_path": output_path, "ssim": None}
+    report(outputs_ready=[output_path] + list(rendition_output_paths(output_path, settings.get("renditions")).values()))
+
+    ssim_percent = inline_ssim[0] if inline_ssim else None
+    if ssim_percent is None:
+        # Served from the render cache (no encode ran), so measure it separately, sampled
+        report(progress=0.95, message="Computing SSIM")
+        ssim_percent = compute_ssim_percent(ffmpeg_path, input_path, output_path, cancel_event=cancel_event, mode="fast")
+    print(f"DEBUG SSIM for {filename}: {ssim_percent}") # Debug print for console
+    return {"ok": True, "output_path": output_path, "ssim": ssim_percent}
+
+
+SSIM_HELP = (
+    "SSIM (Structural Similarity Index) measures visual similarity between the original "
+    "and processed video on a scale of 0–100. We scale both videos to 1080×1920 and "
+    "compute frame-by-frame SSIM, then average the values. Higher scores mean the output "
+    "looks almost identical to the source; lower scores indicate larger visual changes. "
+    "Seeing different scores for clips processed with the same FFmpeg settings is normal "
+    "because each source clip starts with different resolution, quality, and content. "
+    "The metric helps gauge how much the video has been altered—useful to ensure the "
+    "repurposed video is sufficiently different to avoid TikTok duplicate-content flags."
+)
+
+# ----------------------------
+# Quick previews
+# ----------------------------
+
+
+def preview_source(file):
+    """Writes an upload to the preview cache once (named by its content hash), again if it has been pruned since
+    (see previews.prune_sources). Returns (path, digest)."""
+    cache_key = f"preview_src_{file.file_id}" if getattr(file, "file_id", None) else f"preview_src_{file.name}_{file.size}"
+    if cache_key not in st.session_state:
+        digest = hashlib.sha1(file.getbuffer()).hexdigest()
+        st.session_state[cache_key] = (os.path.join(PREVIEW_SOURCES_DIR, digest + os.path.splitext(file.name)[1]), digest)
+    path, digest = st.session_state[cache_key]
+    try:
+        os.utime(path) # Recently used: pruned last
+    except OSError:
+        os.makedirs(PREVIEW_SOURCES_DIR, exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(file.getbuffer())
+        os.replace(path + ".part", path)
+        prune_sources(keep=path)
+    return path, digest
+
+
+@st.cache_resource
+def get_render_cache():
+    """Shared by all sessions, so the same clip uploaded twice (even in different tabs) is encoded once."""
+    return open_render_cache()
+
+
+@st.cache_resource
+def get_stage_cache():
+    """Shared by all sessions, like the render cache."""
+    return open_stage_cache()
+
+
+@st.cache_resource
+def get_still_renderer():
+    """Shared by all sessions, so its frame and still caches survive reruns."""
+    return StillRenderer(get_ffmpeg())
+
+
+PREVIEW_CAPTION = (f"Renders the first {PREVIEW_SECONDS} s of a clip with its current settings at "
+                   f"{PREVIEW_FRAME_SIZE[0]}x{PREVIEW_FRAME_SIZE[1]}. Previews are cached, so going back to earlier settings is instant.")
+
+
+def preview_row(idx, file):
+    """Preview button, preview clip and live still frame of upload number idx."""
+    preview_cols = st.columns([3, 1])
+    with preview_cols[0]:
+        st.write(file.name)
+    with preview_cols[1]:
+        if st.button("Preview", key=f"preview_btn_{idx}"):
+            source_path, digest = preview_source(file)
+            with st.spinner("Rendering preview..."):
+                preview_path, error = render_preview(get_ffmpeg(), source_path, collect_video_settings(idx),
+                                                     source_digest=digest)
+            st.session_state[f"preview_{idx}"] = (preview_path, error)
+    preview_path, error = st.session_state.get(f"preview_{idx}", (None, None))
+    if error:
+        st.error(f"Preview failed: {error}")
+    elif preview_path and os.path.isfile(preview_path):
+        st.video(preview_path)
+
+    # Full-resolution still through the exact filter chain; re-rendered live as settings change
+    if st.checkbox("Show still frame", key=f"still_on_{idx}"):
+        still_time = st.slider("Still frame at (seconds)", 0.0, 28.9, 1.0, 0.1, key=f"still_t_{idx}")
+        source_path, digest = preview_source(file)
+        settings = collect_video_settings(idx)
+        # Only a stage-cache render's seed is known up front; otherwise each render draws new random effects
+        seed = stage_seed(get_stage_cache().input_digest(source_path), **settings) if st.session_state.get("use_stage_cache") else None
+        still, error = get_still_renderer().render(source_path, still_time, settings, source_digest=digest,
+                                                   media_info=probe_source(source_path), seed=seed)
+        if error:
+            st.error(f"Still frame failed: {error}")
+        else:
+            caption = f"{file.name} at {still_time:.1f}s"
+            if seed is None:
+                caption += " (illustrative: hue, grain, lens and zoom/pan vary per render)"
+            st.image(still, caption=caption, width=270)
+
+
+# Each upload's panel is a fragment: changing one of its widgets reruns only that panel, not the whole
+# script with every other upload's panel, so interaction stays as fast with 10 uploads as with one.
+@st.fragment
+def preview_panel(idx, file):
+    """Preview row of one upload (universal settings mode)."""
+    preview_row(idx, file)
+
+
+@st.fragment
+def video_settings_panel(idx, file):
+    """Settings of one upload with its preview row, so its still frame follows its own settings."""
+    with st.expander(f"Text settings for: {file.name}", expanded=True):
+        st.checkbox("Add text overlay", key=f"add_text_{idx}")
+        if st.session_state.get(f"add_text_{idx}"):
+            st.text_input("Text to display", key=f"text_{idx}", value="Your Text Here")
+            st.selectbox(
+                "Text position",
+                ("Top Center", "Middle Center", "Bottom Center"),
+                index=2,
+                key=f"pos_{idx}"
+            )
+            st.number_input("Font size", min_value=10, max_value=200, value=24, key=f"size_{idx}")
+            st.text_input("Text color (e.g., white, #FF0000)", value="white", key=f"color_{idx}")
+            st.text_input("Background color (e.g., black@0.5, none)", value="black@0.5", key=f"bg_{idx}")
+            # Font style options
+            col1, col2 = st.columns(2)
+            with col1:
+                st.checkbox("Bold", key=f"bold_{idx}")
+            with col2:
+                st.checkbox("Italic", key=f"italic_{idx}")
+        st.number_input(
+            "Rotation (degrees)",
+            min_value=-45.0, # Allow significant rotation
+            max_value=45.0,
+            value=0.0, # Default to 0 (no rotation)
+            step=0.5, # Allow fine-tuning
+            key=f"rotation_{idx}",
+            help="Rotates the video by the specified degrees. "
+                 "Positive values rotate clockwise, negative counter-clockwise. "
+                 "Even a small rotation (e.g., 0.5 to 2 degrees) can significantly "
+                 "alter the video's pixel structure, helping to lower SSIM scores and "
+                 "reduce detection as duplicate content. Rotated areas are filled with black."
+        )
+
+        # Per-video playback speed slider
+        st.slider(
+            "Playback speed (this video)",
+            min_value=0.5,
+            max_value=1.5,
+            value=DEFAULT_SPEED,
+            step=0.01,
+            key=f"speed_{idx}",
+            help="Set a unique playback speed for this clip (0.5–1.5×). Audio tempo is auto-corrected."
+        )
+
+        # Zoom-pan strength slider for this clip
+        st.slider(
+            "End zoom scale (Ken Burns) — 1.00 = off",
+            min_value=1.00,
+            max_value=2.00,
+            value=1.10,
+            step=0.005,
+            key=f"zoom_scale_{idx}",
+            help="Controls the final zoom factor for this clip only."
+        )
+        # Other effect
+        st.checkbox("Horizontally flip video", key=f"hflip_{idx}")
+        st.caption(PREVIEW_CAPTION)
+        preview_row(idx, file)
+
+
 # ----------------------------
 # Per-video settings
 # ----------------------------
 if uploaded_files and not use_universal:
     st.markdown("### Text Overlay Settings (per video)")
     for idx, file in enumerate(uploaded_files):
-        with st.expander(f"Text settings for: {file.name}", expanded=True):
-            st.checkbox("Add text overlay", key=f"add_text_{idx}")
-            if st.session_state.get(f"add_text_{idx}"):
-                st.text_input("Text to display", key=f"text_{idx}", value="Your Text Here")
-                st.selectbox(
-                    "Text position",
-                    ("Top Center", "Middle Center", "Bottom Center"),
-                    index=2,
-                    key=f"pos_{idx}"
-                )
-                st.number_input("Font size", min_value=10, max_value=200, value=24, key=f"size_{idx}")
-                st.text_input("Text color (e.g., white, #FF0000)", value="white", key=f"color_{idx}")
-                st.text_input("Background color (e.g., black@0.5, none)", value="black@0.5", key=f"bg_{idx}")
-                # Font style options
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.checkbox("Bold", key=f"bold_{idx}")
-                with col2:
-                    st.checkbox("Italic", key=f"italic_{idx}")
-            st.number_input(
-                "Rotation (degrees)",
-                min_value=-45.0, # Allow significant rotation
-                max_value=45.0,
-                value=0.0, # Default to 0 (no rotation)
-                step=0.5, # Allow fine-tuning
-                key=f"rotation_{idx}",
-                help="Rotates the video by the specified degrees. "
-                     "Positive values rotate clockwise, negative counter-clockwise. "
-                     "Even a small rotation (e.g., 0.5 to 2 degrees) can significantly "
-                     "alter the video's pixel structure, helping to lower SSIM scores and "
-                     "reduce detection as duplicate content. Rotated areas are filled with black."
-            )
+        video_settings_panel(idx, file)
+elif uploaded_files:
+    with st.expander("Quick preview", expanded=False):
+        st.caption(PREVIEW_CAPTION)
+        for idx, file in enumerate(uploaded_files):
+            preview_panel(idx, file)
+
+# Encoding speed (applies to the whole batch)
+st.selectbox(
+    "Encoding profile",
+    list(ENCODING_PROFILES),
+    index=list(ENCODING_PROFILES).index(DEFAULT_PROFILE),
+    format_func=lambda name: f"{name} — {ENCODING_PROFILES[name]['description']}",
+    key="encoding_profile",
+    help="draft encodes several times faster with bigger files; archive is slower with the smallest files."
+)
+st.multiselect(
+    "Extra outputs per clip",
+    list(RENDITION_PRESETS),
+    format_func=lambda name: f"{name} — {RENDITION_PRESETS[name]['description']}",
+    key="renditions",
+    help="Written by the same FFmpeg pass as the main 1080x1920 clip, so the source is only decoded and filtered once."
+)
+st.number_input(
+    "Target batch time in seconds (0 = off)",
+    min_value=0,
+    value=0,
+    step=30,
+    key="deadline",
+    help="If set, picks the slowest (best compressing) x264 preset predicted to finish the batch in time, "
+         "based on encode speeds measured on this machine. Overrides the profile's preset."
+)
+st.checkbox(
+    "Reuse earlier renders of identical clips",
+    key="use_render_cache",
+    help="Clips whose content and settings match an earlier render (or another upload in this batch) are "
+         "served from the render cache instead of being encoded again. Note: random effects are then fixed per clip and settings, "
+         "so re-rendering a clip repeats its earlier variation instead of making a new one."
+)
+st.checkbox(
+    "Keep fitted and zoomed frames for re-runs",
+    key="use_stage_cache",
+    help="Stores each clip after the resize and Ken Burns stages, so re-running it with only a different text, "
+         "flip, speed or audio starts from those frames instead of redoing them. Note: random effects (including the zoom/pan "
+         "path) are then fixed per clip, so re-runs no longer vary them."
+)
+st.selectbox(
+    "SSIM measurement",
+    list(SIMILARITY_MODES),
+    format_func=lambda name: f"{name} — {SIMILARITY_MODES[name]['description']}",
+    key="similarity",
+    help="SSIM is measured while the clip is encoded, from the same decode, so it adds no separate pass. "
+         "'fast' compares every 5th frame at half size, for long clips or busy servers."
+)
 
-            # Per-video playback speed slider
-            st.slider(
-                "Playback speed (this video)",
-                min_value=0.5,
-                max_value=1.5,
-                value=DEFAULT_SPEED,
-                step=0.01,
-                key=f"speed_{idx}",
-                help="Set a unique playback speed for this clip (0.5–1.5×). Audio tempo is auto-corrected."
-            )
+# ----------------------------
+# Downloads
+# ----------------------------
+# Finished clips are published under static/downloads/<batch>/ and served by Streamlit's static file
+# server (enableStaticServing in .streamlit/config.toml), which streams them from disk instead of
+# holding them in memory like st.download_button does.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+DOWNLOADS_DIR = os.path.join(STATIC_DIR, "downloads")
+ZIP_NAME = "processed_videos.zip"
+STALE_DOWNLOAD_SECONDS = 24 * 3600 # Download folders of older sessions are removed after a day
+BATCH_POLL_SECONDS = 1.0 # How often a running batch's progress is refreshed
+
+
+def static_serving_enabled():
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+def remove_stale_downloads():
+    if not os.path.isdir(DOWNLOADS_DIR):
+        return
+    for name in os.listdir(DOWNLOADS_DIR):
+        path = os.path.join(DOWNLOADS_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_DOWNLOAD_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
 
-            # Zoom-pan strength slider for this clip
-            st.slider(
-                "End zoom scale (Ken Burns) — 1.00 = off",
-                min_value=1.00,
-                max_value=2.00,
-                value=1.10,
-                step=0.005,
-                key=f"zoom_scale_{idx}",
-                help="Controls the final zoom factor for this clip only."
-            )
-            # Other effect
-            st.checkbox("Horizontally flip video", key=f"hflip_{idx}")
 
-process_btn = st.button("Process Videos")
+def publish_download(output_path, download_dir):
+    """
+    Makes a finished clip downloadable and adds it to the batch zip. The clip is hard-linked (copied only
+    if that fails), and the zip uses stored entries: mp4s are already compressed, so deflating them again
+    costs CPU for nothing. Returns the published path.
+    """
+    target = os.path.join(download_dir, os.path.basename(output_path))
+    if not os.path.exists(target):
+        try:
+            os.link(output_path, target)
+        except OSError:
+            shutil.copyfile(output_path, target)
+        with zipfile.ZipFile(os.path.join(download_dir, ZIP_NAME), "a", zipfile.ZIP_STORED) as zf:
+            zf.write(target, arcname=os.path.basename(target))
+    return target
+
+
+def download_widget(path, label, mime, key):
+    """A download link for a file under static/, or a regular download button if static serving is off."""
+    if static_serving_enabled():
+        url = "app/static/" + "/".join(quote(part) for part in os.path.relpath(path, STATIC_DIR).split(os.sep))
+        st.markdown(f'<a href="{url}" download="{os.path.basename(path)}">⬇️ {label}</a>', unsafe_allow_html=True)
+    else:
+        # Fallback: Streamlit reads the whole file into memory
+        with open(path, "rb") as f:
+            st.download_button(label=label, data=f, file_name=os.path.basename(path), mime=mime, key=key)
+
+
+job_manager = get_job_manager()
+batch = st.session_state.get("batch")
+batch_active = bool(batch) and job_manager.is_active(batch["job_ids"])
+
+process_btn = st.button("Process Videos", disabled=batch_active)
 
 if process_btn:
     # Basic validations
@@ -222,150 +566,142 @@ if process_btn:
         st.error("You can process a maximum of 10 videos at a time.")
         st.stop()
 
-    # Prepare output directory
+    # Drop leftovers of the previous batch
+    if batch:
+        job_manager.forget(batch["job_ids"])
+        shutil.rmtree(batch["download_dir"], ignore_errors=True)
+    remove_stale_downloads()
+    download_dir = os.path.join(DOWNLOADS_DIR, uuid.uuid4().hex)
+    os.makedirs(download_dir, exist_ok=True)
+
+    # Prepare output directory. Earlier outputs are kept; each clip is written to a .part file and
+    # only replaces its previous output once it finished, and its state is tracked in the run manifest
     output_dir = "treated"
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
     os.makedirs(output_dir, exist_ok=True)
+    manifest = run_manifest.RunManifest.for_output_folder(output_dir)
+
+    ffmpeg_path = get_ffmpeg()
 
-    # Detect optional background noise
+    # Detect optional background noise; it is decoded once to a cached PCM bed shared by all jobs
     noise_path = None
     default_noise = os.path.join("sounds", "background_noise.mp3")
     if os.path.isfile(default_noise):
-        noise_path = default_noise
-
-    # Get FFmpeg path
-    ffmpeg_path = get_ffmpeg_path()
-
-    # Temp directory to hold uploaded files during processing
-    with tempfile.TemporaryDirectory() as tmpdir:
-        progress = st.progress(0)
-        success_count, fail_count = 0, 0
-
-        for idx, file in enumerate(uploaded_files, start=1):
-            filename = file.name
-            tmp_input_path = os.path.join(tmpdir, filename)
-            with open(tmp_input_path, "wb") as f:
-                f.write(file.getbuffer())
-
-            output_path = os.path.join(output_dir, f"tt_{filename}")
-
-            # Retrieve overlay settings for this file
-            if use_universal:
-                add_text = st.session_state.get("u_add_text", False)
-                text_to_overlay = st.session_state.get("u_text") if add_text else None
-                text_position = st.session_state.get("u_pos") if add_text else None
-                font_size = st.session_state.get("u_size") if add_text else None
-                text_color = st.session_state.get("u_color") if add_text else None
-                text_bg_color = st.session_state.get("u_bg") if add_text else None
-                text_bold = st.session_state.get("u_bold", False) if add_text else False
-                text_italic = st.session_state.get("u_italic", False) if add_text else False
-                rotation_degrees = st.session_state.get("u_rotation", 0.0)
-                horizontal_flip_local = st.session_state.get("u_hflip", False)
-                playback_speed_val = st.session_state.get("u_speed", DEFAULT_SPEED)
-                zoom_end_scale_val = st.session_state.get("u_zoom_scale", 1.10)
-            else:
-                add_text = st.session_state.get(f"add_text_{idx-1}", False)
-                text_to_overlay = st.session_state.get(f"text_{idx-1}") if add_text else None
-                text_position = st.session_state.get(f"pos_{idx-1}") if add_text else None
-                font_size = st.session_state.get(f"size_{idx-1}") if add_text else None
-                text_color = st.session_state.get(f"color_{idx-1}") if add_text else None
-                text_bg_color = st.session_state.get(f"bg_{idx-1}") if add_text else None
-                text_bold = st.session_state.get(f"bold_{idx-1}", False) if add_text else False
-                text_italic = st.session_state.get(f"italic_{idx-1}", False) if add_text else False
-                rotation_degrees = st.session_state.get(f"rotation_{idx-1}", 0.0)
-                horizontal_flip_local = st.session_state.get(f"hflip_{idx-1}", False)
-                playback_speed_val = st.session_state.get(f"speed_{idx-1}", DEFAULT_SPEED)
-                zoom_end_scale_val = st.session_state.get(f"zoom_scale_{idx-1}", 1.10)
-
-            st.write(f"Processing {filename} ...")
-            # Execute FFmpeg for processing
-            processed_ok = _execute_ffmpeg_command(
-                ffmpeg_path,
-                tmp_input_path,
-                output_path,
-                filename,
-                noise_audio_path=noise_path,
-                horizontal_flip=horizontal_flip_local,
-                text_to_overlay=text_to_overlay,
-                text_position=text_position,
-                font_size=font_size,
-                text_color=text_color,
-                text_bg_color=text_bg_color,
-                text_bold=text_bold,
-                text_italic=text_italic,
-                rotation_degrees=rotation_degrees, # rotation
-                playback_speed=playback_speed_val,
-                random_zoom_pan=False,
-                zoom_end_scale=zoom_end_scale_val
-            )
-
-            # Compute SSIM similarity percentage if processing succeeded
-            ssim_percent = None
-            if processed_ok:
-                success_count += 1
-                ssim_percent = compute_ssim_percent(ffmpeg_path, tmp_input_path, output_path)
-                print(f"DEBUG SSIM for {filename}: {ssim_percent}") # Debug print for console
-            else:
-                fail_count += 1
-
-            # Display result row with similarity score
-            result_cols = st.columns([4, 1])
-            with result_cols[0]:
-                status_icon = "✅" if processed_ok else "❌"
-                st.write(f"{status_icon} {filename}")
-            with result_cols[1]:
-                if ssim_percent is not None:
-                    st.metric(
-                        label="SSIM",
-                        value=f"{ssim_percent:.2f}%",
-                        help=(
-                            "SSIM (Structural Similarity Index) measures visual similarity between the original "
-                            "and processed video on a scale of 0–100. We scale both videos to 1080×1920 and "
-                            "compute frame-by-frame SSIM, then average the values. Higher scores mean the output "
-                            "looks almost identical to the source; lower scores indicate larger visual changes. "
-                            "Seeing different scores for clips processed with the same FFmpeg settings is normal "
-                            "because each source clip starts with different resolution, quality, and content. "
-                            "The metric helps gauge how much the video has been altered—useful to ensure the "
-                            "repurposed video is sufficiently different to avoid TikTok duplicate-content flags."
-                        )
-                    )
-                else:
-                    st.write("N/A")
-
-            progress.progress(idx / len(uploaded_files))
-
-    st.success(f"Processing complete. Successfully processed {success_count} file(s). Failed: {fail_count}.")
-    st.info(f"Processed videos saved to the '{output_dir}' folder.")
-
-    # Offer download if successful
-    if success_count > 0:
-        # Create a temporary file on disk to build the zip archive
-        # This is better for potentially large zip files than keeping everything in memory initially
-        temp_zip_file = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        temp_zip_path = temp_zip_file.name
+        noise_path = cached_noise_bed(ffmpeg_path, default_noise)
+    _, threads_per_job = plan_thread_budget(file_count=len(uploaded_files))
+
+    # Uploads are copied to a temp directory that outlives this script run; it is removed once the batch finishes
+    tmpdir = tempfile.mkdtemp(prefix="10xreach_")
+    input_paths = []
+    for file in uploaded_files:
+        tmp_input_path = os.path.join(tmpdir, file.name)
+        with open(tmp_input_path, "wb") as f:
+            f.write(file.getbuffer())
+        input_paths.append(tmp_input_path)
+
+    encoding_profile = st.session_state.get("encoding_profile", DEFAULT_PROFILE)
+    preset = None
+    deadline = st.session_state.get("deadline", 0)
+    if deadline:
+        max_workers, _ = plan_thread_budget()
+        media_infos = get_default_index().probe_many(get_ffprobe_path(ffmpeg_path), input_paths)
+        total_frames = sum(
+            estimate_output_frames(media_infos.get(path), collect_video_settings(idx)["playback_speed"])
+            for idx, path in enumerate(input_paths)
+        )
+        preset = choose_preset_for_deadline(total_frames, deadline, jobs=min(max_workers, len(input_paths)))
+        if preset:
+            st.info(f"Target batch time: using x264 preset '{preset}'.")
+        else:
+            st.info("No encode speed measured on this machine yet; using the profile's preset for this batch.")
 
-        try:
-            with zipfile.ZipFile(temp_zip_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for root, _, files in os.walk(output_dir):
-                    for file_in_zip in files: # Renamed variable to avoid conflict
-                        full_path = os.path.join(root, file_in_zip)
-                        zf.write(full_path, arcname=file_in_zip)
-            
-            # Close the file so its contents can be read reliably
-            temp_zip_file.close()
-
-            # Read the contents of the created zip file into memory for Streamlit
-            with open(temp_zip_path, "rb") as f_read:
-                zip_bytes = f_read.read()
-            
-            st.download_button(
-                label="Download Processed Videos (.zip)",
-                data=zip_bytes, # Pass the bytes
-                file_name="processed_videos.zip",
-                mime="application/zip"
-            )
-        finally:
-            # Clean up the temporary zip file from disk
-            if os.path.exists(temp_zip_path):
-                os.unlink(temp_zip_path) 
\ No newline at end of file
+    job_ids = []
+    for idx, file in enumerate(uploaded_files):
+        filename = file.name
+        tmp_input_path = input_paths[idx]
+        output_path = os.path.join(output_dir, f"tt_{filename}")
+        job_ids.append(job_manager.submit(
+            filename,
+            process_upload_job,
+            ffmpeg_path,
+            tmp_input_path,
+            output_path,
+            filename,
+            dict(collect_video_settings(idx), encoding_profile=encoding_profile, preset=preset,
+                 renditions=list(st.session_state.get("renditions", [])),
+                 render_cache=get_render_cache() if st.session_state.get("use_render_cache") else None,
+                 stage_cache=get_stage_cache() if st.session_state.get("use_stage_cache") else None,
+                 similarity=st.session_state.get("similarity", "full")),
+            noise_path=noise_path,
+            threads=threads_per_job,
+            manifest=manifest,
+        ))
+
+    batch = {"job_ids": job_ids, "tmpdir": tmpdir, "output_dir": output_dir, "download_dir": download_dir, "published": {}}
+    st.session_state["batch"] = batch
+    batch_active = True
+
+def show_batch_jobs(batch):
+    """One row per job of the batch (progress or result, downloads, SSIM). Returns the job snapshots."""
+    jobs = [job for job in (job_manager.snapshot(j) for j in batch["job_ids"]) if job]
+    for job in jobs:
+        finished = job["status"] in FINISHED_STATES
+        result = job["result"] or {}
+        if job.get("outputs_ready") and job["id"] not in batch["published"]:
+            batch["published"][job["id"]] = [publish_download(path, batch["download_dir"])
+                                              for path in job["outputs_ready"] if os.path.isfile(path)]
+        # Display result row with progress and similarity score
+        result_cols = st.columns([4, 1, 1])
+        with result_cols[0]:
+            status_icon = {DONE: "✅", FAILED: "❌", CANCELLED: "⏹️"}.get(job["status"], "⏳")
+            st.write(f"{status_icon} {job['label']}")
+            if not finished:
+                elapsed = time.time() - job["started_at"] if job["started_at"] else 0
+                st.progress(job["progress"], text=f"{job['message']} ({elapsed:.0f}s)")
+            for i, path in enumerate(batch["published"].get(job["id"], [])):
+                is_image = path.lower().endswith(".jpg")
+                download_widget(path, f"Download {os.path.basename(path)}", "image/jpeg" if is_image else "video/mp4",
+                                key=f"dl_{job['id']}_{i}")
+        with result_cols[1]:
+            if result.get("ssim") is not None:
+                st.metric(label="SSIM", value=f"{result['ssim']:.2f}%", help=SSIM_HELP)
+            elif finished:
+                st.write("N/A")
+        with result_cols[2]:
+            if not finished:
+                st.button("Cancel", key=f"cancel_{job['id']}", on_click=job_manager.cancel, args=(job["id"],))
+    return jobs
+
+
+@st.fragment(run_every=BATCH_POLL_SECONDS)
+def batch_progress(batch):
+    """
+    Live view of a running batch. Only this fragment reruns to poll the background jobs, so the settings
+    and previews above are not rebuilt every second and stay responsive while the batch runs.
+    """
+    if not job_manager.is_active(batch["job_ids"]):
+        st.rerun() # Finished: one full rerun shows the summary and enables the Process button again
+    if st.button("Cancel all"):
+        for job_id in batch["job_ids"]:
+            job_manager.cancel(job_id)
+    show_batch_jobs(batch)
+
+
+if batch and batch_active:
+    batch_progress(batch)
+elif batch:
+    jobs = show_batch_jobs(batch)
+
+    # Batch finished: the uploaded copies are no longer needed
+    if batch.get("tmpdir"):
+        shutil.rmtree(batch["tmpdir"], ignore_errors=True)
+        batch["tmpdir"] = None
+
+    success_outputs = [job["result"]["output_path"] for job in jobs if job["status"] == DONE]
+    fail_count = len(jobs) - len(success_outputs)
+    st.success(f"Processing complete. Successfully processed {len(success_outputs)} file(s). Failed: {fail_count}.")
+    st.info(f"Processed videos saved to the '{batch['output_dir']}' folder.")
+
+    # Offer the whole batch as one zip; it was built up while the clips finished
+    zip_path = os.path.join(batch["download_dir"], ZIP_NAME)
+    if success_outputs and os.path.isfile(zip_path):
+        download_widget(zip_path, "Download Processed Videos (.zip)", "application/zip", key="dl_zip")
@@ -6,6 +6,27 @@ import argparse # Added for command-line arguments
 import re  # Added for SSIM parsing
 import math # For converting degrees to radians
 import random  # For randomised zoom/pan
+import time # For per-file timings
+import signal # For cancelling FFmpeg process groups
+import threading # For batch-wide cancel events
+import functools # For caching font lookups
+from collections import deque # For the watch mode queue
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED # For parallel batch mode
+
+from filter_graph import FilterGraph, FilterStage, GEOMETRY, PERMUTATION, COLOUR, TEXTURE, TIMING, METADATA, format_cost_report
+from encoding_profiles import ENCODING_PROFILES, DEFAULT_PROFILE, video_encoder_args, profile_preset, get_default_stats, choose_preset_for_deadline
+from ffmpeg_progress import PROGRESS_ARGS, ProgressParser, LineRingBuffer, format_progress, open_metrics_sink
+from renditions import RENDITION_PRESETS, parse_renditions, rendition_output_path, rendition_output_paths
+from noise_beds import GeneratedNoise, noise_input_args, resolve_noise_source
+from render_cache import derive_seed, open_render_cache
+from stage_cache import STAGE_ROLE, STAGE_FILENAME, STAGE_VIDEO_ARGS, STAGE_AUDIO_ARGS, split_upstream, stage_window_seconds, stage_key, open_stage_cache
+from text_overlays import rasterize_text, movie_source
+from ken_burns import KEN_BURNS_ENGINES, DEFAULT_KEN_BURNS_ENGINE, TRAJECTORY_FPS, add_ken_burns
+from ffmpeg_capabilities import MissingCapabilityError, get_capabilities, require
+from media_probe import get_ffprobe_path, get_default_index, check_media_supported
+from watch_folder import FolderWatcher, DEFAULT_SETTLE_SECONDS, DEFAULT_POLL_INTERVAL
+from batch_manifest import iter_manifest, parse_row, finished_rows, default_results_path, manifest_format, ResultWriter
+from run_manifest import RunManifest, part_path_for, finalize_part, discard_part, remove_stale_parts, PENDING, RUNNING, DONE, FAILED
 
 # Potential font paths - adjust as needed or ensure font.ttf is in the project root
 FONT_FILE_PATH_MACOS_SYSTEM = "/System/Library/Fonts/Helvetica.ttc"
@@ -17,8 +38,55 @@ FONT_FILE_BOLD = os.path.join(FONT_DIR, "Roboto-Bold.ttf")
 FONT_FILE_ITALIC = os.path.join(FONT_DIR, "Roboto-Italic.ttf")
 FONT_FILE_BOLD_ITALIC = os.path.join(FONT_DIR, "Roboto-BoldItalic.ttf")
 
+# Parallel batch mode: libx264 only scales to a handful of threads per job and
+# zoompan/lenscorrection are single-threaded, so several mid-sized jobs keep the
+# cores busier than one job with every thread.
+THREADS_PER_JOB_TARGET = 4
+
+# Output frame (width, height) and maximum duration in seconds
+OUTPUT_FRAME_SIZE = (1080, 1920)
+MAX_OUTPUT_SECONDS = 29
+
+# Segmented mode (one clip rendered as several time segments in parallel): segments shorter than this
+# are not worth the extra FFmpeg start-up and keyframe
+MIN_SEGMENT_SECONDS = 4.0
+
+# Pixel format the filter chain is pinned to after fitting (see FilterGraph.optimize), only for sources already
+# in it; other formats (4:2:2, 4:4:4, 10-bit) go through unpinned, as before, and x264 keeps them
+PINNED_PIX_FMT = "yuv420p"
+
+# Seconds between progress lines printed per job in batch mode
+PROGRESS_PRINT_INTERVAL = 5.0
+
+# Watch mode runs for weeks: it keeps counts and only this many recent per-file results (all go to --metrics)
+WATCH_RECENT_RESULTS = 100
+# ...and forgets finished files that have left the input folder from the run manifest this often (seconds)
+WATCH_PRUNE_INTERVAL = 60.0
+
+# Similarity (SSIM) modes: compare every Nth output frame, after shrinking both sides by scale.
+# Subsampled modes give a quick estimate of the full score.
+SIMILARITY_MODES = {
+    "full": {"description": "every frame at full resolution", "every": 1, "scale": 1.0},
+    "fast": {"description": "every 5th frame at half resolution (estimate)", "every": 5, "scale": 0.5},
+}
+
+# AAC encoders: FFmpeg's own (the default, in every build) and Fraunhofer's libfdk_aac (only in some builds, opt-in)
+AAC_ENCODERS = ("aac", "libfdk_aac")
+DEFAULT_AAC_ENCODER = "aac"
+
+# Muxers for output extensions, needed because jobs write to '<output>.part' first
+OUTPUT_FORMATS = {".mp4": "mp4", ".m4v": "mp4", ".mov": "mov", ".mkv": "matroska", ".m4a": "ipod",
+                  ".jpg": "image2", ".jpeg": "image2", ".png": "image2"}
+
+_ffmpeg_path_cache = None
+
 def get_ffmpeg_path():
-    """Detects FFmpeg path based on OS or prompts user if not found."""
+    """Detects FFmpeg path based on OS or prompts user if not found.
+    Candidates are looked up in the capability registry (see ffmpeg_capabilities.py), so FFmpeg is only
+    started the first time a binary is seen; the result is kept for the rest of the process."""
+    global _ffmpeg_path_cache
+    if _ffmpeg_path_cache:
+        return _ffmpeg_path_cache
     if platform.system() == "Windows":
         # Common locations for FFmpeg on Windows
         possible_paths = [
@@ -35,18 +103,17 @@ def get_ffmpeg_path():
         ]
 
     for path in possible_paths:
-        try:
-            subprocess.run([path, "-version"], capture_output=True, check=True)
+        if get_capabilities(path) is not None:
+            _ffmpeg_path_cache = path
             return path
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            continue
     
     # If FFmpeg not found in common paths, try the default command "ffmpeg"
     print("FFmpeg not found in common paths. Attempting to use 'ffmpeg' from system PATH.")
     return "ffmpeg"
 
+@functools.lru_cache(maxsize=None)
 def get_font_path(is_bold=False, is_italic=False):
-    """Attempts to find a suitable font file based on style."""
+    """Attempts to find a suitable font file based on style (looked up, and warned about, once per process)."""
     font_to_use = None
     style_description = "regular"
 
@@ -91,31 +158,134 @@ def get_font_path(is_bold=False, is_italic=False):
     print(f"Please ensure Roboto font files (e.g., {FONT_FILE_REGULAR}, {FONT_FILE_BOLD}, etc.) are in '{FONT_DIR}'.")
     return None # Let FFmpeg try to find a default
 
-def _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename_for_log, noise_audio_path=None, horizontal_flip=False,
-                            text_to_overlay=None, text_position=None, font_size=None, 
-                            text_color=None, text_bg_color=None,
-                            text_bold=False, text_italic=False,
-                            rotation_degrees=0.0,
-                            playback_speed=1.0,
-                            random_zoom_pan=False,
-                            apply_film_grain=False,
-                            zoom_end_scale=None):
-    """Helper function to construct and run the FFmpeg command for a single file."""
-    command = [
-        ffmpeg_executable,
-        "-i", input_path,
-    ]
+def get_media_info(ffmpeg_executable, input_path):
+    """Returns the ffprobe info for input_path from the local media index (probing it on a miss), or None if ffprobe is unavailable."""
+    return get_default_index().probe(get_ffprobe_path(ffmpeg_executable), input_path)
 
-    if noise_audio_path:
-        command.extend(["-stream_loop", "-1", "-i", noise_audio_path])
+def estimate_output_frames(media_info, playback_speed=1.0):
+    """Frames a job will produce (30 fps, at most 29 s). Assumes a full 29 s clip if the duration is unknown."""
+    duration = (media_info or {}).get("duration") or 29 * playback_speed
+    return int(min(duration / playback_speed, 29) * 30)
 
-    # Base video filters
-    vf_options_list = [
-        "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2"
-    ]
+def _is_normalised_frame(media_info, frame_size=OUTPUT_FRAME_SIZE):
+    """True if the input already has the output frame size with square pixels, so scale/pad would be a no-op."""
+    return (bool(media_info) and (media_info.get("width"), media_info.get("height")) == tuple(frame_size)
+            and abs((media_info.get("sar") or 1.0) - 1.0) < 1e-6)
 
-    # Mild CRF compression (random 21–25) instead of fixed bitrate
-    crf_val = random.randint(21, 25)
+def _output_format_args(output_path):
+    """['-f', muxer] for the output's extension, or [] if FFmpeg should guess."""
+    muxer = OUTPUT_FORMATS.get(os.path.splitext(output_path)[1].lower())
+    return ["-f", muxer] if muxer else []
+
+def _process_group_kwargs():
+    """Popen kwargs that start FFmpeg in its own process group, so a cancel can kill it and any children."""
+    if platform.system() == "Windows":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+def _kill_process_group(process):
+    """Kills a process started with _process_group_kwargs() together with its process group."""
+    try:
+        if platform.system() == "Windows":
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass # Already gone
+
+def _run_ffmpeg(command, cancel_event=None, timeout=None, poll_interval=0.2, on_progress=None, expected_seconds=None):
+    """
+    Runs an FFmpeg command and returns (returncode, stdout, stderr).
+    If cancel_event (a threading.Event) gets set while FFmpeg runs, its process group is killed and returncode is None.
+    Raises subprocess.TimeoutExpired after killing FFmpeg if timeout (seconds) is exceeded.
+    Output is read while FFmpeg runs and only the last STDERR_RING_LINES lines of each stream are kept.
+    If the command writes -progress blocks to stdout (PROGRESS_ARGS), each block is parsed and passed to
+    on_progress(progress_dict); with expected_seconds (output duration) the dicts include percent and ETA.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace",
+                               **_process_group_kwargs())
+    stdout_ring, stderr_ring = LineRingBuffer(), LineRingBuffer()
+    parser = ProgressParser(expected_seconds)
+
+    def read_stdout():
+        for line in process.stdout:
+            stdout_ring.append(line)
+            progress = parser.feed(line)
+            if progress is not None and on_progress is not None:
+                try:
+                    on_progress(progress)
+                except Exception as e: # A broken callback must not stop the pipe from being drained
+                    print(f"Warning: progress callback failed: {e}")
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_ring.append(line)
+
+    readers = [threading.Thread(target=read_stdout, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    def finish(returncode):
+        process.wait()
+        for reader in readers:
+            reader.join()
+        return returncode, stdout_ring.text(), stderr_ring.text()
+
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        while True:
+            wait = poll_interval if cancel_event or deadline else None
+            try:
+                process.wait(timeout=wait)
+                return finish(process.returncode)
+            except subprocess.TimeoutExpired:
+                if cancel_event is not None and cancel_event.is_set():
+                    _kill_process_group(process)
+                    return finish(None)
+                if deadline and time.monotonic() > deadline:
+                    _kill_process_group(process)
+                    finish(None)
+                    raise subprocess.TimeoutExpired(command, timeout)
+    except BaseException:
+        # E.g. KeyboardInterrupt in the calling thread: FFmpeg runs in its own process group, so stop it here
+        if process.poll() is None:
+            _kill_process_group(process)
+        raise
+
+def build_video_filter_graph(media_info=None, horizontal_flip=False,
+                             text_to_overlay=None, text_position=None, font_size=None,
+                             text_color=None, text_bg_color=None,
+                             text_bold=False, text_italic=False,
+                             rotation_degrees=0.0,
+                             playback_speed=1.0,
+                             random_zoom_pan=False,
+                             zoom_end_scale=None,
+                             rng=random,
+                             frame_size=OUTPUT_FRAME_SIZE,
+                             frame_offset=0,
+                             ken_burns=DEFAULT_KEN_BURNS_ENGINE,
+                             keep_source_fps=False,
+                             single_frame=False):
+    """Builds the (unoptimised) FilterGraph for one job. Random effect strengths are drawn from rng.
+    frame_size is the output (width, height); pixel sizes (text, margins) are scaled relative to 1080x1920,
+    so a smaller frame (e.g. a preview) looks like a downscaled full render.
+    frame_offset is the Ken Burns trajectory frame (1/30 s of source time) the input starts at, e.g. for a
+    still or a segment, so the zoom continues from where the full render would be at that point.
+    ken_burns names the zoom/pan engine (see ken_burns.py). The output is 30 fps unless keep_source_fps is set.
+    single_frame builds the graph for one frame (a still), which needs no frame rate conversion."""
+    graph = FilterGraph()
+    width, height = frame_size
+    px = height / OUTPUT_FRAME_SIZE[1] # Scale for sizes given in 1080x1920 pixels
+    source_fps = (media_info or {}).get("fps") or TRAJECTORY_FPS
+
+    # Output frame rate first, so frames a 60 fps source drops are never scaled (zoompan sets its own rate)
+    if not (keep_source_fps or single_frame) and ken_burns != "zoompan":
+        graph.add("fps", [("", str(TRAJECTORY_FPS))], TIMING, f"{TRAJECTORY_FPS} fps output")
+
+    # Base video filters (scale/pad is skipped when the input already has the output size with square pixels)
+    if not _is_normalised_frame(media_info, frame_size):
+        graph.add("scale", [("w", str(width)), ("h", str(height)), ("force_original_aspect_ratio", "decrease")], GEOMETRY, f"fit into {width}x{height}")
+        graph.add("pad", [("w", str(width)), ("h", str(height)), ("x", "(ow-iw)/2"), ("y", "(oh-ih)/2")], GEOMETRY, f"letterbox to {width}x{height}")
 
     # Ken Burns / Zoom-pan.
 
@@ -128,37 +298,25 @@ def _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename
         zoom_increment = (zoom_end - 1.0) / (29 * 30)  # per-frame increment (~30 fps, 29 s)
 
         # Random pan offsets up to ±30 % of the available area so we avoid static centre crop
-        pan_offset_x = random.choice([-1, 1]) * random.uniform(0.0, 0.3)
-        pan_offset_y = random.choice([-1, 1]) * random.uniform(0.0, 0.3)
-
-        x_expr = f"(iw/2-(iw/zoom/2))+{pan_offset_x:.4f}*(iw - iw/zoom)"
-        y_expr = f"(ih/2-(ih/zoom/2))+{pan_offset_y:.4f}*(ih - ih/zoom)"
-
-        vf_options_list.append(
-            f"zoompan=z='min(max(1,zoom)+{zoom_increment:.6f},{zoom_end:.2f})':x='{x_expr}':y='{y_expr}':s=1080x1920:d=1:fps=30"
-        )
+        pan_offset_x = rng.choice([-1, 1]) * rng.uniform(0.0, 0.3)
+        pan_offset_y = rng.choice([-1, 1]) * rng.uniform(0.0, 0.3)
 
     elif random_zoom_pan:
         # Random final zoom between 1.12 and 1.18 (≈12–18 %)
-        zoom_end = random.uniform(1.12, 2.00)
+        zoom_end = rng.uniform(1.12, 2.00)
         zoom_increment = (zoom_end - 1.0) / (29 * 30)  # per-frame increment assuming 30 fps
 
         # Random pan offsets: up to ±30 % of available pan range along each axis
-        pan_offset_x = random.choice([-1, 1]) * random.uniform(0.0, 0.3)
-        pan_offset_y = random.choice([-1, 1]) * random.uniform(0.0, 0.3)
-
-        x_expr = f"(iw/2-(iw/zoom/2))+{pan_offset_x:.4f}*(iw - iw/zoom)"
-        y_expr = f"(ih/2-(ih/zoom/2))+{pan_offset_y:.4f}*(ih - ih/zoom)"
-
-        vf_options_list.append(
-            f"zoompan=z='min(max(1,zoom)+{zoom_increment:.6f},{zoom_end:.2f})':x='{x_expr}':y='{y_expr}':s=1080x1920:d=1:fps=30"
-        )
+        pan_offset_x = rng.choice([-1, 1]) * rng.uniform(0.0, 0.3)
+        pan_offset_y = rng.choice([-1, 1]) * rng.uniform(0.0, 0.3)
     else:
-        # Default subtle Ken Burns from 1.0 × → 1.1 ×
+        # Default subtle Ken Burns from 1.0 × → 1.1 ×, centred
+        zoom_end = 1.1
         zoom_increment = (1.1 - 1.0) / (29 * 30)
-        vf_options_list.append(
-            f"zoompan=z='min(max(1,zoom)+{zoom_increment:.6f},1.1)':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':s=1080x1920:d=1:fps=30"
-        )
+        pan_offset_x = pan_offset_y = 0.0
+
+    add_ken_burns(graph, ken_burns, frame_size, zoom_increment, zoom_end, pan_offset_x, pan_offset_y,
+                  frame_offset=frame_offset, fps=source_fps if keep_source_fps else TRAJECTORY_FPS, single_frame=single_frame)
     
     # Add rotation if specified
     if rotation_degrees != 0.0:
@@ -166,146 +324,870 @@ def _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename
         # bilinear=0 (nearest neighbor) is faster but lower quality for large rotations.
         # Consider 'bicubic' for better quality if needed, though slower.
         # fillcolor=black ensures empty areas from rotation are black.
-        vf_options_list.append(f"rotate={rotation_radians:.6f}:bilinear=0:fillcolor=black")
+        graph.add("rotate", [("a", f"{rotation_radians:.6f}"), ("bilinear", "0"), ("fillcolor", "black")], GEOMETRY, "rotation")
     
-    vf_options_list.append("drawbox=x=2:y=2:w=2:h=2:color=white@0.9:t=fill")
+    graph.add("drawbox", [("x", "2"), ("y", "2"), ("w", "2"), ("h", "2"), ("color", "white@0.9"), ("t", "fill")], TEXTURE, "2x2 px dot")
     
     if horizontal_flip:
-        vf_options_list.append("hflip")
+        graph.add("hflip", kind=PERMUTATION, note="horizontal flip")
         
     # Pixel-aspect and basic colour tweak
-    vf_options_list.append("setsar=1")
-    vf_options_list.append("eq=brightness=0.005:contrast=1.005")
+    graph.add("setsar", [("", "1")], METADATA, "square pixels")
+    graph.add("eq", [("brightness", "0.005"), ("contrast", "1.005")], COLOUR, "brightness/contrast tweak")
 
     # Automatic subtle hue shift (±5°). The user doesn't need to set anything.
-    hue_shift_deg = random.uniform(-5.0, 5.0)
-    vf_options_list.append(f"hue=h={hue_shift_deg:.2f}*PI/180:s=1")
+    hue_shift_deg = rng.uniform(-5.0, 5.0)
+    graph.add("hue", [("h", f"{hue_shift_deg:.2f}*PI/180"), ("s", "1")], COLOUR, "hue shift")
 
     # Automatic light film-grain noise (random strength 4–8) to further lower SSIM
-    grain_strength = random.randint(4, 8)
-    vf_options_list.append(f"noise=alls={grain_strength}:allf=t")
+    grain_strength = rng.randint(4, 8)
+    graph.add("noise", [("alls", str(grain_strength)), ("allf", "t")], TEXTURE, "film grain")
 
     # Automatic subtle lens distortion (barrel/pincushion). Random k1=k2 in 0.008–0.02
-    k_val = round(random.uniform(0.008, 0.02), 4)
-    vf_options_list.append(f"lenscorrection=k1={k_val}:k2={k_val}")
+    k_val = round(rng.uniform(0.008, 0.02), 4)
+    graph.add("lenscorrection", [("k1", str(k_val)), ("k2", str(k_val))], GEOMETRY, "lens distortion")
 
     # Apply playback speed adjustment via setpts (avoid grey-frame using STARTPTS)
     if abs(playback_speed - 1.0) > 0.001:
-        vf_options_list.append(f"setpts=(PTS-STARTPTS)/{playback_speed}")
-
-    vf_options = ",".join(vf_options_list)
+        graph.add("setpts", [("", f"(PTS-STARTPTS)/{playback_speed}")], TIMING, "playback speed")
 
-    # Add drawtext filter if text_to_overlay is provided
+    # Text overlay: pre-rendered once to a transparent PNG and composited with overlay, or drawn per frame
+    # with drawtext if it cannot be pre-rendered (see text_overlays.py)
     if text_to_overlay and font_size and text_color:
         font_file = get_font_path(is_bold=text_bold, is_italic=text_italic)
-        
-        # Sanitize text for FFmpeg filter: escape single quotes and some special characters
-        # This is a basic sanitization, more complex text might need more robust escaping
-        sanitized_text = text_to_overlay.replace("'", "'\\''").replace(":", "\\:").replace("%", "\\%")
+        has_box = bool(text_bg_color) and text_bg_color.lower() != "none" and text_bg_color.lower() != "transparent"
+        font_px = max(1, round(font_size * px))
+        box_border = round(10 * px) # 10px padding for the box
+        margin = round(20 * px) # 20px from the top or bottom edge
+
+        raster = rasterize_text(text_to_overlay, font_file, font_px, text_color, text_bg_color if has_box else None, box_border)
+        if raster:
+            raster_path, _, _ = raster
+            # The box extends past the text by its padding, as drawtext's box does
+            padding = box_border if has_box else 0
+            if text_position == "Top Center":
+                y = str(margin - padding)
+            elif text_position == "Middle Center":
+                y = "(H-h)/2"
+            else: # Bottom Center (also the default if somehow unspecified)
+                y = f"H-h-{margin - padding}"
+            graph.add("overlay", [("x", "(W-w)/2"), ("y", y)], TEXTURE, "text overlay (pre-rendered)",
+                      sources=[movie_source(raster_path)])
+        else:
+            # Sanitize text for FFmpeg filter: escape single quotes and some special characters
+            # This is a basic sanitization, more complex text might need more robust escaping
+            sanitized_text = text_to_overlay.replace("'", "'\\''").replace(":", "\\:").replace("%", "\\%")
 
-        drawtext_filter = f"drawtext=text='{sanitized_text}':fontcolor={text_color}:fontsize={font_size}"
+            drawtext_options = [("text", f"'{sanitized_text}'"), ("fontcolor", str(text_color)), ("fontsize", str(font_px))]
         
-        if font_file:
-            # FFmpeg on Windows sometimes has issues with full paths in filter strings if they contain colons (e.g. C:)
-            # Escaping the font file path is important, especially for Windows.
-            escaped_font_file = font_file.replace("\\", "/").replace(":", "\\:") if platform.system() == "Windows" else font_file
-            drawtext_filter += f":fontfile='{escaped_font_file}'"
-
-        # Positioning
-        if text_position == "Top Center":
-            drawtext_filter += ":x=(w-text_w)/2:y=20" # 20px from top
-        elif text_position == "Middle Center":
-            drawtext_filter += ":x=(w-text_w)/2:y=(h-text_h)/2"
-        elif text_position == "Bottom Center":
-            drawtext_filter += ":x=(w-text_w)/2:y=h-th-20" # 20px from bottom
-        else: # Default to Bottom Center if somehow unspecified
-            drawtext_filter += ":x=(w-text_w)/2:y=h-th-20"
-
-        # Background box for text
-        if text_bg_color and text_bg_color.lower() != "none" and text_bg_color.lower() != "transparent":
-            drawtext_filter += f":box=1:boxcolor={text_bg_color}:boxborderw=10" # 10px padding for the box
+            if font_file:
+                # FFmpeg on Windows sometimes has issues with full paths in filter strings if they contain colons (e.g. C:)
+                # Escaping the font file path is important, especially for Windows.
+                escaped_font_file = font_file.replace("\\", "/").replace(":", "\\:") if platform.system() == "Windows" else font_file
+                drawtext_options.append(("fontfile", f"'{escaped_font_file}'"))
+
+            # Positioning
+            if text_position == "Top Center":
+                drawtext_options += [("x", "(w-text_w)/2"), ("y", str(margin))]
+            elif text_position == "Middle Center":
+                drawtext_options += [("x", "(w-text_w)/2"), ("y", "(h-text_h)/2")]
+            else: # Bottom Center (also the default if somehow unspecified)
+                drawtext_options += [("x", "(w-text_w)/2"), ("y", f"h-th-{margin}")]
+
+            # Background box for text
+            if has_box:
+                drawtext_options += [("box", "1"), ("boxcolor", str(text_bg_color)), ("boxborderw", str(box_border))]
         
-        vf_options += f",{drawtext_filter}"
-
-    command.extend([
-        "-map_metadata", "-1",
-        "-vf", vf_options, # Use the constructed vf_options string
-        "-t", "29", # Trim output to 29 seconds
-        "-c:v", "libx264",
-        "-crf", str(crf_val),
-    ])
+            graph.add("drawtext", drawtext_options, TEXTURE, "text overlay")
+
+    return graph
+
+def chain_pix_fmt(media_info):
+    """Format to pin the filter chain to for this source (FilterGraph.optimize's pix_fmt), or None."""
+    return PINNED_PIX_FMT if (media_info or {}).get("pix_fmt") == PINNED_PIX_FMT else None
+
+def output_seconds(media_info, playback_speed=1.0, max_seconds=MAX_OUTPUT_SECONDS):
+    """Length of a job's output in seconds (the source at playback_speed, at most max_seconds), or None if the
+    duration is unknown."""
+    duration = (media_info or {}).get("duration")
+    return min(duration / playback_speed, max_seconds) if duration else None
 
-    # Build audio filter
+def _audio_filter_graph(has_audio, noise_audio_path, playback_speed, seconds=None):
+    """Audio part of a job's -filter_complex, ending in [audio_out], or None if the output has no audio.
+    seconds is the output length, which the noise bed is trimmed to when there is no source audio."""
+    if not has_audio:
+        # No source audio: the quiet noise bed becomes the audio track, cut to the video length here.
+        # -shortest alone does not cut it reliably (FFmpeg 6 wrote ~twice the video length of audio).
+        if not noise_audio_path:
+            return None
+        return f"[1:a]{f'atrim=duration={seconds:.3f},' if seconds else ''}volume=0.02[audio_out]"
+    # Pitch shift and delay the main audio; append atempo for playback speed if needed (valid 0.5-2.0 for our 0.9-1.1 range)
+    main_chain = "[0:a]aresample=48000,asetrate=48000*1.03,aresample=48000,adelay=200|200"
+    if abs(playback_speed - 1.0) > 0.001:
+        main_chain += f",atempo={playback_speed}"
+    if not noise_audio_path:
+        return main_chain + "[audio_out]"
+    # [1:a] is the noise bed: set its volume very low and mix.
+    # duration=first ensures output lasts as long as the (trimmed) main video.
+    return (
+        main_chain + "[main_processed];"
+        "[1:a]volume=0.02[noise_quiet];"
+        "[main_processed][noise_quiet]amix=inputs=2:duration=first[audio_out]"
+    )
+
+def build_ffmpeg_command(ffmpeg_executable, input_path, output_path, noise_audio_path=None, horizontal_flip=False,
+                         text_to_overlay=None, text_position=None, font_size=None,
+                         text_color=None, text_bg_color=None,
+                         text_bold=False, text_italic=False,
+                         rotation_degrees=0.0,
+                         playback_speed=1.0,
+                         random_zoom_pan=False,
+                         apply_film_grain=False,
+                         zoom_end_scale=None,
+                         threads=None,
+                         media_info=None,
+                         rng=random,
+                         write_parts=False,
+                         encoding_profile=DEFAULT_PROFILE,
+                         preset=None,
+                         progress=False,
+                         renditions=None,
+                         frame_size=OUTPUT_FRAME_SIZE,
+                         max_seconds=MAX_OUTPUT_SECONDS,
+                         similarity=None,
+                         ken_burns=DEFAULT_KEN_BURNS_ENGINE,
+                         keep_source_fps=False,
+                         aac_encoder=DEFAULT_AAC_ENCODER,
+                         stage_input=None,
+                         stage_output=None,
+                         stage_seconds=None):
+    """Returns the FFmpeg argument list for one job (see _execute_ffmpeg_command).
+    renditions is a list of RENDITION_PRESETS names written next to output_path (see rendition_output_path).
+    All outputs share one decode and one filter chain, which is split only for the final scale/encode.
+    If write_parts is set, every output is written to its .part file, with the muxer still picked from the final name.
+    With progress=True, FFmpeg reports machine-readable progress on stdout (see _run_ffmpeg).
+    frame_size and max_seconds are only changed for previews (see previews.py).
+    similarity (a SIMILARITY_MODES name) adds an SSIM branch comparing the filtered frames with the source,
+    fed from the same decode; its summary line ends up in FFmpeg's stderr (see _parse_ssim_percent).
+    ken_burns and keep_source_fps pick the zoom/pan engine and output frame rate (see build_video_filter_graph).
+    aac_encoder names the audio encoder (AAC_ENCODERS).
+    stage_output also writes the frames after the upstream stages (see stage_cache.split_upstream), with the source
+    audio, to an intermediate (cut to stage_seconds of source if set); stage_input starts from such an intermediate
+    instead of input_path, which is then only decoded for the similarity reference.
+    Raises MissingCapabilityError if the FFmpeg build cannot run the job."""
+    # Without probe data, assume there is an audio stream (the old behaviour)
+    has_audio = media_info is None or media_info.get("has_audio", True)
+
+    command = [ffmpeg_executable, "-y"]
+    if progress:
+        command.extend(PROGRESS_ARGS)
+    if threads:
+        command.extend(["-filter_threads", str(threads), "-filter_complex_threads", str(threads)])
+        command.extend(["-threads", str(threads)]) # Decoder threads (input option)
+    command.extend(["-i", stage_input or input_path])
+
+    # Without source audio the noise bed is the whole track, so it must end with the video
+    noise_seconds = None if has_audio else output_seconds(media_info, playback_speed, max_seconds)
     if noise_audio_path:
-        # [0:a] is main video's audio, [1:a] is noise audio
-        # Process main audio: pitch shift and delay
-        # Process noise audio: set volume very low
-        # Mix them. duration=first ensures output lasts as long as the (trimmed) main video.
-        # Append atempo for playback speed if needed (valid 0.5-2.0 for our 0.9-1.1 range)
-        speed_audio_chain = f",atempo={playback_speed}" if abs(playback_speed - 1.0) > 0.001 else ""
-        filter_complex_str = (
-            "[0:a]aresample=48000,asetrate=48000*1.03,aresample=48000,adelay=200|200" + speed_audio_chain + "[main_processed];"
-            "[1:a]volume=0.02[noise_quiet];"
-            "[main_processed][noise_quiet]amix=inputs=2:duration=first[audio_out]"
-        )
+        command.extend(noise_input_args(noise_audio_path, noise_seconds)) # Input 1: looped file or generated noise
+    reference_label = "v_reference"
+    if stage_input and similarity:
+        # The intermediate is already zoomed, so the SSIM reference is decoded from the source (the last input)
+        reference_label = f"{2 if noise_audio_path else 1}:v"
+        command.extend(["-i", input_path])
+
+    # Mild CRF compression (random 21–25) instead of fixed bitrate
+    crf_val = rng.randint(21, 25)
+
+    graph = build_video_filter_graph(
+        media_info=media_info, horizontal_flip=horizontal_flip,
+        text_to_overlay=text_to_overlay, text_position=text_position, font_size=font_size,
+        text_color=text_color, text_bg_color=text_bg_color, text_bold=text_bold, text_italic=text_italic,
+        rotation_degrees=rotation_degrees, playback_speed=playback_speed,
+        random_zoom_pan=random_zoom_pan, zoom_end_scale=zoom_end_scale, rng=rng, frame_size=frame_size,
+        ken_burns=ken_burns, keep_source_fps=keep_source_fps,
+    ).optimize(chain_pix_fmt(media_info))
+    output_fps = ((media_info or {}).get("fps") or TRAJECTORY_FPS) if keep_source_fps else TRAJECTORY_FPS
+    chain = graph
+    stage_part = None
+    if stage_input or stage_output:
+        upstream, chain = split_upstream(graph)
+
+    # Outputs: the main clip first, then the extra renditions
+    renditions = renditions or []
+    video_renditions = [name for name in renditions if not RENDITION_PRESETS[name].get("poster")]
+    poster_renditions = [name for name in renditions if RENDITION_PRESETS[name].get("poster")]
+    video_outputs = ["main"] + video_renditions
+
+    # Video: one chain, split once per output (and once more for the similarity branch)
+    video_labels = {name: f"v_{name}" for name in video_outputs + poster_renditions}
+    branch_labels = list(video_labels.values()) + (["v_similarity"] if similarity else [])
+    chain_input = "v_source" if similarity and not stage_input else "0:v"
+    if stage_output:
+        # The upstream stages run once; their frames go both to the intermediate and on through the rest of the chain
+        stage_part = upstream.to_string(chain_input) + ",split=2[v_stage][v_late]"
+        chain_input = "v_late"
+    filter_parts = [chain.to_string(chain_input)]
+    if similarity:
+        # The source is decoded once and split: one copy goes through the chain, the other is the SSIM reference
+        normalise, subsample = _similarity_filters(similarity, frame_size)
+        if not stage_input:
+            filter_parts.append("[0:v]split=2[v_source][v_reference]")
+        filter_parts.append(f"[{reference_label}]{','.join([normalise] + subsample)}[similarity_reference]")
+        filter_parts.append(f"[v_similarity_split]{','.join(subsample or ['null'])}[similarity_processed]")
+        # shortest=1: the chain may output a frame more than the source has (e.g. 29.97 fps converted to 30), and
+        # FFmpeg 7 aborts at the end of the stream if ssim is still waiting for its reference then
+        filter_parts.append("[similarity_processed][similarity_reference]ssim=shortest=1,nullsink")
+    if len(branch_labels) > 1:
+        filter_parts[0] += f",split={len(branch_labels)}" + "".join(f"[{label}_split]" for label in branch_labels)
+        for name, label in video_labels.items():
+            preset_info = RENDITION_PRESETS.get(name, {})
+            if preset_info.get("poster"):
+                # One frame of the processed clip, or the middle frame of short clips
+                frame = min(int(preset_info["at_seconds"] * output_fps),
+                            int(estimate_output_frames(media_info, playback_speed) * output_fps / TRAJECTORY_FPS) // 2)
+                filter_parts.append(f"[{label}_split]select='eq(n,{frame})'[{label}]")
+            elif "width" in preset_info:
+                filter_parts.append(f"[{label}_split]scale={preset_info['width']}:{preset_info['height']}:flags=bicubic,setsar=1[{label}]")
+            else:
+                filter_parts.append(f"[{label}_split]null[{label}]")
+    else:
+        filter_parts[0] += f"[{video_labels['main']}]"
+
+    # Audio: one processed track, split once per video output
+    audio_graph = _audio_filter_graph(has_audio, noise_audio_path, playback_speed, noise_seconds)
+    audio_labels = {}
+    if audio_graph:
+        filter_parts.append(audio_graph)
+        if len(video_outputs) > 1:
+            audio_labels = {name: f"a_{name}" for name in video_outputs}
+            filter_parts.append("[audio_out]asplit=" + str(len(video_outputs)) + "".join(f"[{label}]" for label in audio_labels.values()))
+        else:
+            audio_labels = {"main": "audio_out"}
+
+    # Fail before starting FFmpeg if the build lacks a filter or encoder this job needs (e.g. drawtext
+    # without libfreetype, or libfdk_aac when it was asked for)
+    capabilities = get_capabilities(ffmpeg_executable)
+    required_filters = {stage.filter_name for stage in graph.stages}
+    required_filters.update(source.split("=")[0] for stage in graph.stages for source in stage.sources)
+    required_filters.update(re.findall(r"(?:^|[;,\]])([a-z][a-z0-9_]*)(?==|\[|,|;|$)", ";".join(filter_parts[1:])))
+    if len(video_labels) > 1 or stage_output:
+        required_filters.add("split")
+    if isinstance(noise_audio_path, GeneratedNoise):
+        required_filters.add("anoisesrc") # Runs as a lavfi input
+    required_encoders = ["libx264"] + ([aac_encoder] if audio_labels else []) + (["mjpeg"] if poster_renditions else [])
+    require(capabilities, filters=required_filters, encoders=required_encoders)
+
+    command.extend(["-filter_complex", ";".join(filter_parts + ([stage_part] if stage_part else []))]) # Use the constructed filter graph
+
+    for name in video_outputs:
+        path = output_path if name == "main" else rendition_output_path(output_path, name)
+        preset_info = RENDITION_PRESETS.get(name, {})
+        command.extend(["-map", f"[{video_labels[name]}]"])
+        if name in audio_labels:
+            command.extend(["-map", f"[{audio_labels[name]}]"])
         command.extend([
-            "-filter_complex", filter_complex_str,
-            "-map", "0:v",      # Map video from the first input
-            "-map", "[audio_out]", # Map audio from the filter_complex output
+            "-map_metadata", "-1",
+            "-t", str(max_seconds), # Trim output (29 seconds unless previewing)
         ])
-    else:
-        # Original audio processing if no noise file
-        audio_chain = "aresample=48000,asetrate=48000*1.03,aresample=48000,adelay=200|200"
-        if abs(playback_speed - 1.0) > 0.001:
-            audio_chain += f",atempo={playback_speed}"
+        # libx264 with the profile's preset/tune/lookahead/refs (and threads as output option)
+        command.extend(video_encoder_args(encoding_profile, preset_info.get("crf", crf_val), threads=threads, preset=preset))
+        if preset_info.get("maxrate"):
+            # Capped CRF keeps the lower-bitrate copies under their bitrate budget
+            command.extend(["-maxrate", preset_info["maxrate"], "-bufsize", preset_info["maxrate"]])
+        if name in audio_labels:
+            command.extend([
+                "-c:a", aac_encoder,
+                "-b:a", preset_info.get("audio_bitrate", "192k"),
+            ])
+            if not has_audio and noise_seconds is None:
+                command.append("-shortest") # Unknown duration: the noise bed is endless
+        command.extend(_output_format_args(path))
+        command.append(part_path_for(path) if write_parts else path)
+
+    if stage_output:
+        # Intermediate for later jobs: the upstream frames and the source audio, both losslessly
+        command.extend(["-map", "[v_stage]", "-map", "0:a:0?", "-map_metadata", "-1"])
+        if stage_seconds:
+            command.extend(["-t", f"{stage_seconds:.3f}"])
+        command.extend(STAGE_VIDEO_ARGS + (["-threads", str(threads)] if threads else []))
+        command.extend(STAGE_AUDIO_ARGS + ["-f", "nut", stage_output])
+
+    for name in poster_renditions:
+        path = rendition_output_path(output_path, name)
         command.extend([
-            "-filter:a", audio_chain,
+            "-map", f"[{video_labels[name]}]",
+            "-map_metadata", "-1",
+            "-frames:v", "1",
+            "-q:v", "2",
+            "-update", "1",
         ])
+        command.extend(_output_format_args(path))
+        command.append(part_path_for(path) if write_parts else path)
+    return command
 
-    command.extend([
-        "-c:a", "aac",
-        "-b:a", "192k",
-        "-y",
-        output_path
-    ])
+def plan_segments(media_info, playback_speed=1.0, segments=0, cores=None, max_seconds=MAX_OUTPUT_SECONDS):
+    """
+    Splits a job's source window into [(first_frame, frame_count)] ranges of input frames for segmented mode,
+    or returns [] if the clip is better rendered in one pass (unknown or short duration, or one core).
+    segments is the most segments wanted (0 = one per core, from cores or the machine's core count), and
+    no segment is shorter than MIN_SEGMENT_SECONDS of output.
+    The window is the source frames that land in the first max_seconds of output.
+    """
+    duration = (media_info or {}).get("duration")
+    if not duration:
+        return []
+    fps = media_info.get("fps") or 30.0
+    total_frames = int(min(duration, max_seconds * playback_speed) * fps)
+    count = segments or cores or os.cpu_count() or 1
+    count = min(count, int(total_frames / (MIN_SEGMENT_SECONDS * fps * playback_speed)))
+    if count < 2:
+        return []
+    bounds = [total_frames * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(count)]
+
+def build_segment_commands(ffmpeg_executable, input_path, output_path, work_dir, segment_plan, media_info=None,
+                           noise_audio_path=None, playback_speed=1.0, threads=None, seed=0,
+                           encoding_profile=DEFAULT_PROFILE, preset=None, max_seconds=MAX_OUTPUT_SECONDS,
+                           aac_encoder=DEFAULT_AAC_ENCODER, **video_settings):
+    """
+    Returns (segment_commands, audio_command, concat_command) for rendering one job in segments (see plan_segments).
+    Each segment command renders the video of one range of input frames into work_dir. Time-dependent filters
+    continue across segments: the Ken Burns zoom starts from the segment's start time and setpts restarts at
+    zero, as the concat demuxer lays segments end to end. Every segment draws the same random effect strengths
+    from seed. The audio is processed in one piece (audio_command, or None if the output has no audio)
+    and the concat command joins it with the segments into output_path's .part file without re-encoding.
+    video_settings are build_video_filter_graph's effect arguments (horizontal_flip, text_to_overlay...).
+    """
+    fps = (media_info or {}).get("fps") or 30.0
+    has_audio = media_info is None or media_info.get("has_audio", True)
+    # Unless the source rate is kept, the graph starts with fps=30 (see build_video_filter_graph), and segments then
+    # render their share of the one-pass 30 fps frames, so each shows the same source frame at the same zoom
+    on_grid = not video_settings.get("keep_source_fps") and video_settings.get("ken_burns", DEFAULT_KEN_BURNS_ENGINE) != "zoompan"
+    segment_commands = []
+    segment_paths = []
+    for index, (first_frame, frame_count) in enumerate(segment_plan):
+        if on_grid:
+            # Output frames first_out..last_out-1. The fps filter keeps its grid on multiples of 1/30 s from the cut,
+            # so the cut starts on the grid, two frames early to include the source frames the one pass picks for
+            # the first ones. Timestamps are then moved back by those two frames, which the fps filter drops.
+            first_out = math.ceil(first_frame * TRAJECTORY_FPS / fps - 1e-6)
+            last_out = math.ceil((first_frame + frame_count) * TRAJECTORY_FPS / fps - 1e-6)
+            start = max(0, first_out - 2) / TRAJECTORY_FPS
+            end = (last_out + 1) / TRAJECTORY_FPS
+        else:
+            # Cut half a frame before the first and after the last frame, so every input frame falls into exactly one segment
+            start = (first_frame - 0.5) / fps if first_frame else 0.0
+            end = (first_frame + frame_count - 0.5) / fps
+        rng = random.Random(seed)
+        crf_val = rng.randint(21, 25) # Drawn first, as in build_ffmpeg_command
+        graph = build_video_filter_graph(media_info=media_info, playback_speed=playback_speed, rng=rng,
+                                         frame_offset=first_out if on_grid else first_frame * TRAJECTORY_FPS / fps,
+                                         **video_settings).optimize(chain_pix_fmt(media_info))
+        if on_grid and start:
+            fps_index = graph.find("fps")
+            graph.stages[fps_index] = graph.stages[fps_index].with_options(start_time="0")
+            graph.stages.insert(fps_index, FilterStage("setpts", [("", f"PTS-{first_out / TRAJECTORY_FPS - start:.6f}/TB")], TIMING,
+                                                       "segment grid starts at zero"))
+        segment_path = os.path.join(work_dir, f"segment_{index:03d}.mp4")
+        segment_paths.append(segment_path)
+        command = [ffmpeg_executable, "-y"] + PROGRESS_ARGS
+        if threads:
+            command.extend(["-filter_threads", str(threads), "-threads", str(threads)])
+        if start:
+            command.extend(["-ss", f"{start:.6f}"])
+        command.extend(["-t", f"{end - start:.6f}", "-i", input_path])
+        command.extend(["-filter_complex", graph.to_string("0:v") + "[v_main]", "-map", "[v_main]", "-an", "-map_metadata", "-1"])
+        if on_grid:
+            command.extend(["-frames:v", str(last_out - first_out)])
+        command.extend(video_encoder_args(encoding_profile, crf_val, threads=threads, preset=preset))
+        command.extend(["-f", "mp4", segment_path])
+        segment_commands.append(command)
+
+    video_seconds = sum(frame_count for _, frame_count in segment_plan) / fps / playback_speed
+    audio_command = None
+    audio_path = os.path.join(work_dir, "audio.m4a")
+    audio_graph = _audio_filter_graph(has_audio, noise_audio_path, playback_speed, None if has_audio else video_seconds)
+    if audio_graph:
+        audio_command = [ffmpeg_executable, "-y", "-i", input_path]
+        if noise_audio_path:
+            audio_command.extend(noise_input_args(noise_audio_path, None if has_audio else video_seconds))
+        audio_command.extend(["-filter_complex", audio_graph, "-map", "[audio_out]", "-map_metadata", "-1",
+                              # Without source audio the endless noise bed is cut to the video length
+                              "-t", str(max_seconds if has_audio else video_seconds),
+                              "-c:a", aac_encoder, "-b:a", "192k"])
+        audio_command.extend(_output_format_args(audio_path))
+        audio_command.append(audio_path)
+
+    list_path = os.path.join(work_dir, "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            f.write("file '" + os.path.abspath(path).replace("'", "'\\''") + "'\n")
+    concat_command = [ffmpeg_executable, "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_command:
+        concat_command.extend(["-i", audio_path, "-map", "0:v", "-map", "1:a"])
+    concat_command.extend(["-c", "copy", "-map_metadata", "-1", "-t", str(max_seconds)])
+    concat_command.extend(_output_format_args(output_path))
+    concat_command.append(part_path_for(output_path))
+    return segment_commands, audio_command, concat_command
+
+class _EitherEvent:
+    """Set when either of two events is, so a failed segment can stop its siblings as well as the caller's cancel_event."""
+
+    def __init__(self, first, second):
+        self.first, self.second = first, second
+
+    def is_set(self):
+        return self.second.is_set() or (self.first is not None and self.first.is_set())
+
+def _run_segmented(segment_commands, audio_command, concat_command, cancel_event=None, on_progress=None,
+                   expected_seconds=None):
+    """
+    Runs the segment and audio commands of build_segment_commands in parallel, then the concat command.
+    Returns (returncode, stdout, stderr, command) as _run_ffmpeg does, for the command that failed (or the concat).
+    on_progress gets one progress dict for the whole job, summed over the segments; expected_seconds is the
+    output duration of all segments together.
+    """
+    stop = threading.Event()
+    either = _EitherEvent(cancel_event, stop)
+    done = [(0, 0.0)] * len(segment_commands) # (frames, output seconds) per segment
+    done_lock = threading.Lock()
+    start_time = time.monotonic()
+
+    def segment_progress(index):
+        def report(progress):
+            with done_lock:
+                done[index] = (progress.get("frame") or 0, progress.get("out_seconds") or 0.0)
+                frames = sum(f for f, _ in done)
+                out_seconds = sum(seconds for _, seconds in done)
+            if on_progress is None:
+                return
+            elapsed = time.monotonic() - start_time
+            speed = out_seconds / elapsed if elapsed > 0 else None
+            on_progress({
+                "frame": frames, "fps": frames / elapsed if elapsed > 0 else None, "speed": speed, "total_size": None,
+                "out_seconds": out_seconds,
+                "percent": min(1.0, out_seconds / expected_seconds) if expected_seconds else None,
+                "eta_seconds": max(0.0, expected_seconds - out_seconds) / speed if expected_seconds and speed else None,
+                "finished": False,
+            })
+        return report
+
+    def run(command, report=None):
+        result = _run_ffmpeg(command, cancel_event=either, on_progress=report)
+        if result[0] != 0:
+            stop.set() # Failed or cancelled: the other segments are of no use
+        return result + (command,)
+
+    with ThreadPoolExecutor(max_workers=len(segment_commands) + 1) as executor:
+        try:
+            futures = [executor.submit(run, command, segment_progress(index)) for index, command in enumerate(segment_commands)]
+            if audio_command:
+                futures.append(executor.submit(run, audio_command))
+            results = [future.result() for future in futures]
+        except BaseException:
+            stop.set() # E.g. KeyboardInterrupt: kill the running segments before leaving
+            raise
+    failed = [result for result in results if result[0] != 0]
+    if failed:
+        if cancel_event is not None and cancel_event.is_set():
+            return (None,) + failed[0][1:]
+        # The segment that failed, not a sibling stopped because of it
+        return next((result for result in failed if result[0] is not None), failed[0])
+    return _run_ffmpeg(concat_command, cancel_event=cancel_event) + (concat_command,)
+
+def stage_seed(input_digest, rotation_degrees=0.0, random_zoom_pan=False, zoom_end_scale=None,
+               ken_burns=DEFAULT_KEN_BURNS_ENGINE, keep_source_fps=False, **_later_stage_settings):
+    """Seed a job run with a stage cache draws its random effects from: fixed by the input content and the
+    settings of the upstream stages only. Other _execute_ffmpeg_command settings are accepted and ignored."""
+    upstream_settings = {"rotation_degrees": rotation_degrees, "random_zoom_pan": random_zoom_pan, "zoom_end_scale": zoom_end_scale,
+                         "ken_burns": ken_burns, "keep_source_fps": keep_source_fps}
+    return derive_seed(input_digest, upstream_settings)
+
+def _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename_for_log, noise_audio_path=None, horizontal_flip=False,
+                            text_to_overlay=None, text_position=None, font_size=None, 
+                            text_color=None, text_bg_color=None,
+                            text_bold=False, text_italic=False,
+                            rotation_degrees=0.0,
+                            playback_speed=1.0,
+                            random_zoom_pan=False,
+                            apply_film_grain=False,
+                            zoom_end_scale=None,
+                            threads=None,
+                            cancel_event=None,
+                            media_info=None,
+                            encoding_profile=DEFAULT_PROFILE,
+                            preset=None,
+                            on_progress=None,
+                            metrics_sink=None,
+                            renditions=None,
+                            render_cache=None,
+                            stage_cache=None,
+                            seed=None,
+                            similarity=None,
+                            on_similarity=None,
+                            segments=None,
+                            ken_burns=DEFAULT_KEN_BURNS_ENGINE,
+                            keep_source_fps=False,
+                            aac_encoder=DEFAULT_AAC_ENCODER):
+    """Helper function to construct and run the FFmpeg command for a single file.
+    renditions (RENDITION_PRESETS names) are written by the same FFmpeg process, next to output_path.
+    seed fixes the random effect strengths (CRF, hue, grain, lens, zoom/pan). With a render_cache
+    (see render_cache.py) it defaults to one derived from the input content and settings, and a job
+    whose input, settings, seed and FFmpeg version match an earlier render is served from the cache.
+    With a stage_cache (see stage_cache.py), the seed defaults to one derived from the input content and the
+    settings of the upstream stages (zoom, rotation, frame rate), and the job starts from a cached intermediate
+    of those stages if an earlier job made one, or leaves one for later jobs (one-pass renders only).
+    similarity (a SIMILARITY_MODES name) measures SSIM against the source during the encode, from the same
+    decode; on_similarity(percent) gets the score (not called for cache hits) and it is added to the metrics.
+    segments (0 = one per core) renders a long clip as that many time segments in parallel and joins them
+    (see plan_segments); clips too short to split, and jobs with renditions or similarity, run in one pass.
+    ken_burns names the zoom/pan engine (KEN_BURNS_ENGINES); keep_source_fps keeps the input frame rate instead of 30 fps.
+    aac_encoder names the audio encoder (AAC_ENCODERS); a build without it skips the job.
+    encoding_profile names an entry of ENCODING_PROFILES; preset overrides its x264 preset (deadline mode).
+    on_progress(progress_dict) is called about twice a second while FFmpeg runs (frame, fps, speed,
+    total_size, percent, eta_seconds); metrics_sink.record(dict) gets one entry per finished job.
+    If threads is set, decoding, filtering and encoding are each capped to that many threads.
+    If cancel_event gets set while FFmpeg runs, the job is killed and False is returned.
+    media_info (from get_media_info) is looked up if not given; it is used to skip no-op filters,
+    pick the audio graph and reject unsupported inputs before encoding."""
+    if media_info is None:
+        media_info = get_media_info(ffmpeg_executable, input_path)
+    unsupported_reason = check_media_supported(media_info)
+    if unsupported_reason:
+        print(f"Skipping '{filename_for_log}': {unsupported_reason}.")
+        return False
+
+    # Write to .part files (with an explicit muxer, as the extension no longer says which) and only
+    # rename them once FFmpeg succeeded, so a half-written file never looks finished
+    outputs_by_role = {"main": output_path, **rendition_output_paths(output_path, renditions)}
+    output_paths = list(outputs_by_role.values())
+
+    if stage_cache is not None and seed is None:
+        # Jobs that only change later stages (text, flip, speed...) then draw the same zoom/pan path and share an intermediate
+        seed = stage_seed(stage_cache.input_digest(input_path), rotation_degrees=rotation_degrees, random_zoom_pan=random_zoom_pan,
+                          zoom_end_scale=zoom_end_scale, ken_burns=ken_burns, keep_source_fps=keep_source_fps)
+
+    cache_key = None
+    if render_cache is not None:
+        # Everything that shapes the output except threads (which only changes how fast it is made)
+        job_settings = {
+            "noise": str(noise_audio_path) if noise_audio_path else None, "horizontal_flip": horizontal_flip,
+            "text_to_overlay": text_to_overlay, "text_position": text_position, "font_size": font_size,
+            "text_color": text_color, "text_bg_color": text_bg_color, "text_bold": text_bold, "text_italic": text_italic,
+            "rotation_degrees": rotation_degrees, "playback_speed": playback_speed, "random_zoom_pan": random_zoom_pan,
+            "zoom_end_scale": zoom_end_scale, "encoding_profile": encoding_profile, "preset": preset,
+            "renditions": sorted(renditions or []), "ken_burns": ken_burns, "keep_source_fps": keep_source_fps,
+            "aac_encoder": aac_encoder,
+        }
+        input_digest = render_cache.input_digest(input_path)
+        if seed is None:
+            seed = derive_seed(input_digest, job_settings)
+        capabilities = get_capabilities(ffmpeg_executable)
+        cache_key = render_cache.key(input_digest, job_settings, seed, capabilities["version"] if capabilities else None)
+    segment_plan = []
+    if segments is not None:
+        if renditions or similarity:
+            print(f"Rendering '{filename_for_log}' in one pass: segmented mode does not support renditions or similarity.")
+        else:
+            segment_plan = plan_segments(media_info, playback_speed, segments, cores=threads)
+            if segment_plan and seed is None:
+                seed = random.randrange(2 ** 32) # Every segment has to draw the same effect strengths
+    rng = random.Random(seed) if seed is not None else random
 
+    job_stage_key = None
+    stage_window = stage_window_seconds(media_info, playback_speed, MAX_OUTPUT_SECONDS)
+    if stage_cache is not None and not segment_plan:
+        # The key holds the upstream filter string itself, drawn from the seed as build_ffmpeg_command draws it
+        stage_rng = random.Random(seed)
+        stage_rng.randint(21, 25) # CRF, drawn first in build_ffmpeg_command
+        upstream, _ = split_upstream(build_video_filter_graph(
+            media_info=media_info, horizontal_flip=horizontal_flip,
+            text_to_overlay=text_to_overlay, text_position=text_position, font_size=font_size,
+            text_color=text_color, text_bg_color=text_bg_color, text_bold=text_bold, text_italic=text_italic,
+            rotation_degrees=rotation_degrees, playback_speed=playback_speed, random_zoom_pan=random_zoom_pan,
+            zoom_end_scale=zoom_end_scale, rng=stage_rng, ken_burns=ken_burns, keep_source_fps=keep_source_fps,
+        ).optimize(chain_pix_fmt(media_info)))
+        if upstream.stages:
+            capabilities = get_capabilities(ffmpeg_executable)
+            job_stage_key = stage_key(stage_cache, stage_cache.input_digest(input_path), upstream, stage_window,
+                                      capabilities["version"] if capabilities else None)
+
+    command_kwargs = dict(
+        write_parts=True, renditions=renditions,
+        noise_audio_path=noise_audio_path, horizontal_flip=horizontal_flip,
+        text_to_overlay=text_to_overlay, text_position=text_position, font_size=font_size,
+        text_color=text_color, text_bg_color=text_bg_color, text_bold=text_bold, text_italic=text_italic,
+        rotation_degrees=rotation_degrees, playback_speed=playback_speed,
+        random_zoom_pan=random_zoom_pan, zoom_end_scale=zoom_end_scale,
+        threads=threads, media_info=media_info,
+        encoding_profile=encoding_profile, preset=preset, progress=True, similarity=similarity,
+        ken_burns=ken_burns, keep_source_fps=keep_source_fps, aac_encoder=aac_encoder,
+    )
     try:
-        subprocess.run(command, check=True, capture_output=True, text=True)
-        print(f"Successfully processed '{filename_for_log}' -> '{os.path.basename(output_path)}'")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error processing '{filename_for_log}':")
-        print(f"FFmpeg command: {' '.join(e.cmd)}")
-        print(f"FFmpeg stdout: {e.stdout}")
-        print(f"FFmpeg stderr: {e.stderr}")
+        # Also built in segmented mode: it checks the FFmpeg build and is what a one-pass render would run
+        command = build_ffmpeg_command(ffmpeg_executable, input_path, output_path, rng=rng, **command_kwargs)
+    except MissingCapabilityError as e:
+        print(f"Skipping '{filename_for_log}': {e}.")
         return False
+    expected_frames = estimate_output_frames(media_info, playback_speed)
+    last_progress = {}
+    work_dir = part_path_for(output_path + ".segments") if segment_plan else None # Removed by remove_stale_parts too
+    stage_dir = part_path_for(output_path + ".stage") if job_stage_key else None
+    stage_state = {}
+
+    def track_progress(progress):
+        last_progress.update(progress)
+        if on_progress is not None:
+            on_progress(progress)
+
+    def discard_parts():
+        for path in output_paths:
+            discard_part(path)
+
+    def record_metrics(status, elapsed, ssim_percent=None):
+        if metrics_sink is None:
+            return
+        frames = last_progress.get("frame")
+        metrics_sink.record({
+            "filename": filename_for_log,
+            "input_path": input_path,
+            "output_path": output_path,
+            "status": status,
+            "frames": frames,
+            "fps": frames / elapsed if frames and elapsed > 0 else None,
+            "speed": last_progress.get("speed"),
+            "output_bytes": sum(os.path.getsize(path) for path in output_paths) if status == "done" else None,
+            "elapsed_seconds": elapsed,
+            "preset": profile_preset(encoding_profile, preset),
+            "threads": threads,
+            "seed": seed,
+            "segments": len(segment_plan) or None,
+            "stage_cache": stage_state.get("status"),
+            "ssim_percent": ssim_percent,
+            "finished_at": time.time(),
+        })
+
+    # Identical jobs running at once (e.g. the same clip uploaded twice) wait for each other, so the
+    # second one is served from the cache instead of encoding again
+    cache_lock = render_cache.lock_for(cache_key) if cache_key else None
+    if cache_lock is not None:
+        cache_lock.acquire()
+    # Likewise for jobs sharing an intermediate: the second one starts from the intermediate the first one leaves
+    stage_lock = stage_cache.lock_for(job_stage_key) if job_stage_key else None
+    if stage_lock is not None:
+        stage_lock.acquire()
+    try:
+        if cache_key and render_cache.restore(cache_key, outputs_by_role):
+            record_metrics("cached", 0.0)
+            print(f"Reused cached render of '{filename_for_log}' -> {', '.join(repr(os.path.basename(path)) for path in output_paths)}")
+            return True
+        if job_stage_key:
+            os.makedirs(stage_dir, exist_ok=True)
+            stage_path = os.path.join(stage_dir, STAGE_FILENAME)
+            stage_state["status"] = "hit" if stage_cache.restore(job_stage_key, {STAGE_ROLE: stage_path}) else "miss"
+            command = build_ffmpeg_command(
+                ffmpeg_executable, input_path, output_path, rng=random.Random(seed), **command_kwargs,
+                stage_input=stage_path if stage_state["status"] == "hit" else None,
+                stage_output=stage_path if stage_state["status"] == "miss" else None,
+                stage_seconds=stage_window,
+            )
+        start_time = time.monotonic()
+        if segment_plan:
+            os.makedirs(work_dir, exist_ok=True)
+            segment_commands, audio_command, concat_command = build_segment_commands(
+                ffmpeg_executable, input_path, output_path, work_dir, segment_plan, media_info=media_info,
+                noise_audio_path=noise_audio_path, playback_speed=playback_speed,
+                threads=max(1, (threads or os.cpu_count() or 1) // len(segment_plan)), seed=seed,
+                encoding_profile=encoding_profile, preset=preset, aac_encoder=aac_encoder,
+                horizontal_flip=horizontal_flip, text_to_overlay=text_to_overlay, text_position=text_position,
+                font_size=font_size, text_color=text_color, text_bg_color=text_bg_color, text_bold=text_bold,
+                text_italic=text_italic, rotation_degrees=rotation_degrees, random_zoom_pan=random_zoom_pan,
+                zoom_end_scale=zoom_end_scale, ken_burns=ken_burns, keep_source_fps=keep_source_fps,
+            )
+        try:
+            if segment_plan:
+                returncode, stdout, stderr, command = _run_segmented(
+                    segment_commands, audio_command, concat_command, cancel_event=cancel_event, on_progress=track_progress,
+                    expected_seconds=expected_frames / TRAJECTORY_FPS,
+                )
+            else:
+                returncode, stdout, stderr = _run_ffmpeg(command, cancel_event=cancel_event, on_progress=track_progress,
+                                                         expected_seconds=expected_frames / TRAJECTORY_FPS)
+        except FileNotFoundError:
+            # Only the process launch: a missing file anywhere else (cache, parts) is not a missing FFmpeg
+            print(f"Error: FFmpeg executable not found at '{ffmpeg_executable}'.")
+            print("Please ensure FFmpeg is installed and the path is correct.")
+            # This error is critical, so we might want to indicate a halt
+            raise # Re-raise to be caught by the main processing loop if needed
+        elapsed = time.monotonic() - start_time
+        if returncode is None:
+            print(f"Cancelled processing of '{filename_for_log}'.")
+            discard_parts()
+            record_metrics("cancelled", elapsed)
+            return False
+        if returncode != 0:
+            print(f"Error processing '{filename_for_log}':")
+            print(f"FFmpeg command: {' '.join(command)}")
+            print(f"FFmpeg stderr (last lines): {stderr}")
+            discard_parts()
+            record_metrics("failed", elapsed)
+            return False
+        # The main output goes last, so its presence means the whole job finished
+        try:
+            for path in reversed(output_paths):
+                finalize_part(path)
+        except OSError as e:
+            print(f"Error processing '{filename_for_log}': could not move the output into place ({e}).")
+            discard_parts()
+            record_metrics("failed", elapsed)
+            return False
+        # Feed the measured speed into deadline mode's estimates (one-pass renders only, as it plans those)
+        if not segment_plan:
+            get_default_stats().record(profile_preset(encoding_profile, preset), last_progress.get("frame") or expected_frames, elapsed)
+        ssim_percent = _parse_ssim_percent(stderr) if similarity else None
+        if similarity and on_similarity is not None:
+            on_similarity(ssim_percent)
+        record_metrics("done", elapsed, ssim_percent)
+        if cache_key:
+            render_cache.store(cache_key, outputs_by_role)
+        if stage_state.get("status") == "miss":
+            stage_cache.store(job_stage_key, {STAGE_ROLE: stage_path})
+        print(f"Successfully processed '{filename_for_log}' -> {', '.join(repr(os.path.basename(path)) for path in output_paths)}"
+              + (f" ({len(segment_plan)} segments)" if segment_plan else "")
+              + (" (from a cached intermediate)" if stage_state.get("status") == "hit" else ""))
+        return True
+    except BaseException:
+        # E.g. KeyboardInterrupt: never leave a partial file behind
+        discard_parts()
+        raise
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if stage_dir:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        if stage_lock is not None:
+            stage_lock.release()
+        if cache_lock is not None:
+            cache_lock.release()
+
+def plan_thread_budget(jobs=None, file_count=None, cpu_count=None):
+    """
+    Returns (jobs, threads_per_job) for a batch.
+    If jobs is None or < 1, it is picked automatically from the number of cores.
+    The threads per job are the cores shared out between the jobs, so N jobs never oversubscribe the CPU.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if not jobs or jobs < 1:
+        jobs = max(1, cpu_count // THREADS_PER_JOB_TARGET)
+    if file_count:
+        jobs = min(jobs, file_count)
+    jobs = max(1, jobs)
+    threads_per_job = max(1, cpu_count // jobs)
+    return jobs, threads_per_job
+
+def _process_single_video(ffmpeg_executable, input_folder, output_folder, filename, noise_audio_path=None, horizontal_flip=False, threads=None, media_info=None,
+                          manifest=None, cancel_event=None, encoding_profile=DEFAULT_PROFILE, preset=None, metrics_sink=None,
+                          renditions=None, render_cache=None, similarity=None, segments=None,
+                          ken_burns=DEFAULT_KEN_BURNS_ENGINE, keep_source_fps=False, stage_cache=None,
+                          aac_encoder=DEFAULT_AAC_ENCODER):
+    """Runs one file of a batch and returns its per-file result dict. FileNotFoundError (bad FFmpeg path) is re-raised.
+    Progress is printed every PROGRESS_PRINT_INTERVAL seconds."""
+    input_path = os.path.join(input_folder, filename)
+    output_filename = f"tt_{filename}"
+    output_path = os.path.join(output_folder, output_filename)
+    result = {"filename": filename, "output_path": output_path, "status": "failed", "error": None, "elapsed": 0.0,
+              "similarity": None}
+
+    if cancel_event is not None and cancel_event.is_set():
+        result.update(status="skipped", error="Interrupted")
+        return result
+
+    print(f"Processing '{filename}'...")
+    if noise_audio_path:
+        print(f"Mixing with background noise: {noise_audio_path}")
+    if manifest:
+        manifest.mark(filename, RUNNING, input_path=input_path, output_path=output_path)
+    start_time = time.monotonic()
+    last_print = [start_time]
+
+    def print_progress(progress):
+        now = time.monotonic()
+        if now - last_print[0] >= PROGRESS_PRINT_INTERVAL and not progress["finished"]:
+            last_print[0] = now
+            print(f"  [{filename}] {format_progress(progress)}")
+
+    try:
+        if _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename, noise_audio_path=noise_audio_path, horizontal_flip=horizontal_flip, threads=threads, media_info=media_info,
+                                   cancel_event=cancel_event, encoding_profile=encoding_profile, preset=preset,
+                                   on_progress=print_progress, metrics_sink=metrics_sink, renditions=renditions,
+                                   render_cache=render_cache, similarity=similarity,
+                                   on_similarity=lambda percent: result.update(similarity=percent), segments=segments,
+                                   ken_burns=ken_burns, keep_source_fps=keep_source_fps, stage_cache=stage_cache,
+                                   aac_encoder=aac_encoder):
+            result["status"] = "done"
+        elif cancel_event is not None and cancel_event.is_set():
+            result.update(status="skipped", error="Interrupted")
+        else:
+            result["error"] = "FFmpeg returned an error"
     except FileNotFoundError:
-        print(f"Error: FFmpeg executable not found at '{ffmpeg_executable}'.")
-        print("Please ensure FFmpeg is installed and the path is correct.")
-        # This error is critical, so we might want to indicate a halt
-        raise # Re-raise to be caught by the main processing loop if needed
+        if manifest:
+            manifest.mark(filename, PENDING, error="FFmpeg not found")
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while processing {filename}: {e}")
+        result["error"] = str(e)
+    result["elapsed"] = time.monotonic() - start_time
+
+    if manifest:
+        # Interrupted files go back to pending so --resume picks them up again
+        state = {"done": DONE, "failed": FAILED}.get(result["status"], PENDING)
+        manifest.mark(filename, state, error=result["error"])
+    return result
 
-def process_videos(input_folder, output_folder, ffmpeg_executable, specific_filename=None, noise_audio_path=None, horizontal_flip=False):
+def process_videos(input_folder, output_folder, ffmpeg_executable, specific_filename=None, noise_audio_path=None, horizontal_flip=False, jobs=None,
+                   resume=False, encoding_profile=DEFAULT_PROFILE, deadline=None, metrics_sink=None, renditions=None,
+                   render_cache=None, similarity=None, segments=None, ken_burns=DEFAULT_KEN_BURNS_ENGINE,
+                   keep_source_fps=False, stage_cache=None, aac_encoder=DEFAULT_AAC_ENCODER):
     """
     Processes videos in the input folder and saves them to the output folder.
     If specific_filename is provided, only that file (within input_folder) is processed.
-    If noise_audio_path is provided, it will be mixed into the output.
+    If noise_audio_path is provided (a file path or a noise_beds.GeneratedNoise), it will be mixed into the output.
     If horizontal_flip is True, the video will be flipped horizontally.
+    jobs sets how many FFmpeg processes run at once (None = auto, based on the number of cores).
+    Each file's state is tracked in a run manifest in the output folder; with resume=True, files that
+    finished in an earlier run (and whose input did not change) are skipped.
+    encoding_profile picks the x264 settings (see encoding_profiles.py). If deadline (seconds) is set, the slowest
+    x264 preset predicted to finish the batch in time is used instead of the profile's preset.
+    metrics_sink (see ffmpeg_progress.open_metrics_sink) receives one metrics entry per finished job.
+    renditions (RENDITION_PRESETS names) are extra outputs written by each job's FFmpeg process.
+    With a render_cache (see render_cache.py), clips rendered before with the same settings are reused, and
+    identical clips in the batch are encoded once.
+    With a stage_cache (see stage_cache.py), clips re-run with only later-stage changes (text, flip, speed...)
+    start from a cached intermediate of the fit and zoom/pan stages instead of the source.
+    similarity (a SIMILARITY_MODES name) scores each output against its source (SSIM) during the encode;
+    the percentage is in the result's 'similarity' key.
+    segments splits each long clip into time segments rendered in parallel (0 = one per core the job gets,
+    see plan_segments); it helps most when there are fewer clips than cores.
+    ken_burns picks the zoom/pan engine (KEN_BURNS_ENGINES); keep_source_fps keeps each input's frame rate.
+    aac_encoder names the audio encoder (AAC_ENCODERS, default FFmpeg's own aac).
+    Returns (processed_count, skipped_count, results) where results holds one dict per file
+    (status 'done', 'failed', 'skipped' or 'resumed').
     """
     files_to_process = []
     if specific_filename:
         if not specific_filename.lower().endswith(".mp4"):
             print(f"Error: Specified file '{specific_filename}' is not an .mp4 file. Skipping.")
-            return 0, 1 # (processed_count, skipped_count)
+            return 0, 1, [] # (processed_count, skipped_count, results)
         
         # Construct full path to check existence
         full_input_path = os.path.join(input_folder, specific_filename)
         if not os.path.isfile(full_input_path):
             print(f"Error: Specified file '{specific_filename}' not found in '{input_folder}'. Skipping.")
-            return 0, 1
+            return 0, 1, []
         files_to_process.append(specific_filename)
     else:
-        for f_name in os.listdir(input_folder):
+        for f_name in sorted(os.listdir(input_folder)):
             if f_name.lower().endswith(".mp4"):
                 files_to_process.append(f_name)
 
@@ -315,52 +1197,381 @@ def process_videos(input_folder, output_folder, ffmpeg_executable, specific_file
             print(f"No file to process (specific file: {specific_filename}).")
         else:
             print(f"No .mp4 files found in '{input_folder}'.")
-        return 0, 0
+        return 0, 0, []
 
-    processed_count = 0
-    skipped_count = 0
+    manifest = RunManifest.for_output_folder(output_folder)
+    results_by_name = {}
+    if resume:
+        interrupted = manifest.reset_interrupted()
+        if interrupted:
+            print(f"Resuming: {interrupted} file(s) were interrupted in the previous run and will be redone.")
+        for filename in files_to_process:
+            if manifest.is_done(filename, os.path.join(input_folder, filename), os.path.join(output_folder, f"tt_{filename}")):
+                results_by_name[filename] = {"filename": filename, "output_path": os.path.join(output_folder, f"tt_{filename}"),
+                                             "status": "resumed", "error": None, "elapsed": 0.0}
+        if results_by_name:
+            print(f"Resuming: skipping {len(results_by_name)} file(s) already finished in an earlier run.")
+    todo = [f for f in files_to_process if f not in results_by_name]
+    for filename in todo:
+        manifest.mark(filename, PENDING, input_path=os.path.join(input_folder, filename),
+                      output_path=os.path.join(output_folder, f"tt_{filename}"))
 
+    jobs, threads_per_job = plan_thread_budget(jobs, file_count=len(todo))
+    if jobs > 1:
+        print(f"Running {jobs} jobs in parallel, {threads_per_job} thread(s) each.")
+
+    # Probe every input up front (in parallel, cached in the media index) so no job pays for it
+    media_infos = get_default_index().probe_many(get_ffprobe_path(ffmpeg_executable),
+                                                 [os.path.join(input_folder, f) for f in todo])
+
+    preset = None
+    if deadline and todo:
+        total_frames = sum(estimate_output_frames(media_infos.get(os.path.join(input_folder, f))) for f in todo)
+        preset = choose_preset_for_deadline(total_frames, deadline, jobs=jobs)
+        if preset:
+            print(f"Deadline mode: using x264 preset '{preset}' to process ~{total_frames} frames in {deadline:.0f}s.")
+        else:
+            print("Deadline mode: no encode speed measured on this machine yet; using the profile's preset this time.")
+
+    ffmpeg_missing = False
+    cancel_event = threading.Event() # Set on Ctrl-C so running FFmpeg jobs are killed, not waited for
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_process_single_video, ffmpeg_executable, input_folder, output_folder, filename,
+                            noise_audio_path=noise_audio_path, horizontal_flip=horizontal_flip,
+                            threads=threads_per_job if jobs > 1 else None,
+                            media_info=media_infos.get(os.path.join(input_folder, filename)),
+                            manifest=manifest, cancel_event=cancel_event,
+                            encoding_profile=encoding_profile, preset=preset, metrics_sink=metrics_sink,
+                            renditions=renditions, render_cache=render_cache, similarity=similarity,
+                            segments=segments, ken_burns=ken_burns, keep_source_fps=keep_source_fps,
+                            stage_cache=stage_cache, aac_encoder=aac_encoder): filename
+            for filename in todo
+        }
+        try:
+            for future in as_completed(futures):
+                filename = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    results_by_name[filename] = future.result()
+                except FileNotFoundError: # Raised by _execute_ffmpeg_command if ffmpeg path is bad
+                    if not ffmpeg_missing:
+                        print("Halting processing due to FFmpeg not being found.")
+                    ffmpeg_missing = True
+                    results_by_name[filename] = {"filename": filename, "output_path": None, "status": "failed",
+                                                 "error": "FFmpeg not found", "elapsed": 0.0}
+                    # Further processing is not possible; drop everything that has not started yet
+                    for pending in futures:
+                        pending.cancel()
+        except KeyboardInterrupt:
+            print("Interrupted. Stopping running jobs; finished files are kept (use --resume to continue).")
+            cancel_event.set()
+            for pending in futures:
+                pending.cancel()
+            raise
+
+    results = []
     for filename in files_to_process:
-        input_path = os.path.join(input_folder, filename)
-        output_filename = f"tt_{filename}"
-        output_path = os.path.join(output_folder, output_filename)
+        # Files cancelled after an FFmpeg failure never produced a result
+        results.append(results_by_name.get(filename) or {"filename": filename, "output_path": None, "status": "skipped",
+                                                         "error": "Not started", "elapsed": 0.0})
 
-        print(f"Processing '{filename}'...")
-        if noise_audio_path:
-            print(f"Mixing with background noise: {noise_audio_path}")
+    processed_count = sum(1 for r in results if r["status"] == "done")
+    skipped_count = sum(1 for r in results if r["status"] not in ("done", "resumed"))
+    return processed_count, skipped_count, results
+
+class _LatencySink:
+    """Metrics sink adding the seconds since a watched file landed (latency_seconds) to its job's entry."""
+
+    def __init__(self, sink, age, settled_at):
+        self.sink, self.age, self.settled_at = sink, age, settled_at
+
+    def record(self, metrics):
+        self.sink.record(dict(metrics, latency_seconds=self.age + time.monotonic() - self.settled_at))
+
+def watch_videos(input_folder, output_folder, ffmpeg_executable, noise_audio_path=None, horizontal_flip=False, jobs=None,
+                 encoding_profile=DEFAULT_PROFILE, metrics_sink=None, renditions=None, render_cache=None, similarity=None,
+                 segments=None, ken_burns=DEFAULT_KEN_BURNS_ENGINE, keep_source_fps=False, stage_cache=None,
+                 aac_encoder=DEFAULT_AAC_ENCODER, settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL, stop_event=None):
+    """
+    Watches the input folder and processes each .mp4 file as soon as it has finished landing (see
+    watch_folder.FolderWatcher), on up to `jobs` files at a time; files beyond that wait in arrival order.
+    Each output is moved into place as soon as its own encode finishes. Files already in the folder are
+    processed first, except those the run manifest shows finished with the same input.
+    Runs until stop_event is set or Ctrl-C (KeyboardInterrupt, after running jobs are stopped), and returns
+    (files per status, the last WATCH_RECENT_RESULTS per-file result dicts). The result dicts are those of
+    process_videos, plus 'latency' (seconds from landing to output); metrics_sink entries get it as
+    latency_seconds. The other settings are those of process_videos.
+    """
+    manifest = RunManifest.for_output_folder(output_folder)
+    interrupted = manifest.reset_interrupted()
+    if interrupted:
+        print(f"{interrupted} file(s) were interrupted in the previous run and will be redone.")
+    manifest.prune_missing_inputs()
+    last_prune = time.monotonic()
+    # No batch size to share the cores by: jobs is the number of files in flight at most
+    jobs, threads_per_job = plan_thread_budget(jobs)
+    cancel_event = threading.Event()
+    stop_event = stop_event or threading.Event()
+    waiting = deque() # (filename, seconds since it was first seen, when it settled)
+    running = {} # future -> (filename, seconds since it was first seen, when it settled)
+    counts = {}
+    recent = deque(maxlen=WATCH_RECENT_RESULTS)
+
+    with FolderWatcher(input_folder, settle_seconds=settle_seconds, poll_interval=poll_interval) as watcher, \
+            ThreadPoolExecutor(max_workers=jobs) as executor:
+        if watcher.fallback_reason:
+            print(f"Not using inotify ({watcher.fallback_reason}).")
+        print(f"Watching '{input_folder}' for .mp4 files ({watcher.mode}, {settle_seconds:g}s settle time); "
+              f"{jobs} job(s) at a time, {threads_per_job} thread(s) each. Press Ctrl-C to stop.")
         try:
-            
+            while not stop_event.is_set():
+                if running and (len(running) >= jobs or waiting):
+                    # All workers busy: wake up for the first job to finish (file events queue up in the meantime)
+                    wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    settled = watcher.poll(timeout=0)
+                else:
+                    settled = watcher.poll()
+                now = time.monotonic()
+                if now - last_prune >= WATCH_PRUNE_INTERVAL:
+                    manifest.prune_missing_inputs()
+                    last_prune = now
+                for filename, age in settled:
+                    input_path = os.path.join(input_folder, filename)
+                    output_path = os.path.join(output_folder, f"tt_{filename}")
+                    if manifest.is_done(filename, input_path, output_path):
+                        print(f"'{filename}' was already processed; skipping it.")
+                    elif not any(name == filename for name, _, _ in waiting):
+                        manifest.mark(filename, PENDING, input_path=input_path, output_path=output_path)
+                        waiting.append((filename, age, now))
 
-            if _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename, noise_audio_path=noise_audio_path, horizontal_flip=horizontal_flip):
-                processed_count += 1
+                while len(running) < jobs:
+                    # A file re-uploaded while its previous version is still being processed waits for that job
+                    busy = {name for name, _, _ in running.values()}
+                    entry = next((e for e in waiting if e[0] not in busy), None)
+                    if entry is None:
+                        break
+                    waiting.remove(entry)
+                    filename, age, settled_at = entry
+                    future = executor.submit(_process_single_video, ffmpeg_executable, input_folder, output_folder, filename,
+                                             noise_audio_path=noise_audio_path, horizontal_flip=horizontal_flip,
+                                             threads=threads_per_job if jobs > 1 else None,
+                                             manifest=manifest, cancel_event=cancel_event,
+                                             encoding_profile=encoding_profile,
+                                             metrics_sink=_LatencySink(metrics_sink, age, settled_at) if metrics_sink else None,
+                                             renditions=renditions, render_cache=render_cache, similarity=similarity,
+                                             segments=segments, ken_burns=ken_burns, keep_source_fps=keep_source_fps,
+                                             stage_cache=stage_cache, aac_encoder=aac_encoder)
+                    running[future] = (filename, age, settled_at)
+
+                for future in [f for f in running if f.done()]:
+                    filename, age, settled_at = running.pop(future)
+                    try:
+                        result = future.result()
+                    except FileNotFoundError: # Bad FFmpeg path: nothing else can run either
+                        print("Stopping the watch: FFmpeg was not found.")
+                        stop_event.set()
+                        result = {"filename": filename, "output_path": None, "status": "failed",
+                                  "error": "FFmpeg not found", "elapsed": 0.0}
+                    result["latency"] = age + time.monotonic() - settled_at
+                    counts[result["status"]] = counts.get(result["status"], 0) + 1
+                    recent.append(result)
+                    if result["status"] == "done":
+                        print(f"Ready: {result['output_path']} ({result['latency']:.1f}s after '{filename}' landed)")
+                    else:
+                        print(f"'{filename}' {result['status']}: {result['error']}")
+        except KeyboardInterrupt:
+            print("Stopping the watch. Running jobs are stopped; files they had not finished are redone next time.")
+            cancel_event.set()
+            raise
+        finally:
+            stop_event.set()
+    return counts, list(recent)
+
+def _process_manifest_row(ffmpeg_executable, row_number, input_path, output_path, settings, noise_audio_path, threads,
+                          cancel_event, metrics_sink, render_cache, stage_cache):
+    """Renders one manifest row and returns its result record."""
+    filename = os.path.basename(input_path)
+    record = {"row": row_number, "input": input_path, "output_path": output_path, "status": "failed", "error": None,
+              "started_at": round(time.time(), 3), "elapsed": 0.0, "similarity": None}
+    if cancel_event.is_set():
+        record.update(status="skipped", error="Interrupted")
+        return record
+    start_time = time.monotonic()
+    print(f"Processing row {row_number}: '{input_path}'...")
+    try:
+        if not os.path.isfile(input_path):
+            record["error"] = "Input not found"
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            if _execute_ffmpeg_command(ffmpeg_executable, input_path, output_path, filename, noise_audio_path=noise_audio_path,
+                                       threads=threads, cancel_event=cancel_event, metrics_sink=metrics_sink,
+                                       render_cache=render_cache, stage_cache=stage_cache,
+                                       on_similarity=lambda percent: record.update(similarity=percent), **settings):
+                record["status"] = "done"
+            elif cancel_event.is_set():
+                record.update(status="skipped", error="Interrupted")
             else:
-                skipped_count += 1
-        except FileNotFoundError: # Raised by _execute_ffmpeg_command if ffmpeg path is bad
-            print("Halting processing due to FFmpeg not being found.")
-            # Return current counts, as further processing is not possible
-            return processed_count, skipped_count + (len(files_to_process) - processed_count - skipped_count)
-        except Exception as e:
-            print(f"An unexpected error occurred while processing {filename}: {e}")
-            skipped_count +=1
-            
-    return processed_count, skipped_count
-
-def compute_ssim_percent(ffmpeg_executable, original_path, processed_path):
-    """Returns average SSIM between two videos as a percentage (0–100). Returns None if unavailable."""
-    cmd = [
-        ffmpeg_executable,
+                record["error"] = "FFmpeg returned an error"
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred while processing row {row_number}: {e}")
+        record["error"] = str(e)
+    record["elapsed"] = round(time.monotonic() - start_time, 3)
+    return record
+
+def _written_since(path, since):
+    """True if path exists and was written or moved into place at or after the time.time() value since."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return max(stat.st_mtime, stat.st_ctime) >= since
+
+def process_manifest(manifest_path, results_path, output_folder, ffmpeg_executable, noise_audio_path=None, jobs=None,
+                     defaults=None, resume=False, metrics_sink=None, render_cache=None, stage_cache=None):
+    """
+    Processes the rows of a CSV or JSON-lines manifest (see batch_manifest.py), each with its own settings on top
+    of defaults, on up to `jobs` files at a time. The manifest is read as rows are needed, so only the rows in
+    flight are held in memory. Each row's result record (row, input, output_path, status, error, started_at,
+    elapsed, similarity) is appended to results_path as soon as it finishes; invalid rows are recorded as failed.
+    noise_audio_path is the background noise of rows without a noise_file column. With resume, rows the results
+    file already records as done (with their output still there) are skipped and the file is appended to.
+    Returns {status: count}.
+    """
+    base_folder = os.path.dirname(os.path.abspath(manifest_path))
+    skip_rows = finished_rows(results_path) if resume else set()
+    if skip_rows:
+        print(f"Resuming: skipping {len(skip_rows)} row(s) already done in an earlier run.")
+    jobs, threads_per_job = plan_thread_budget(jobs)
+    print(f"Processing manifest '{manifest_path}' with {jobs} job(s) at a time, {threads_per_job} thread(s) each; results go to '{results_path}'.")
+    noise_sources = {None: noise_audio_path} # noise_file column -> resolved noise source
+    counts = {"done": 0, "failed": 0, "skipped": 0, "resumed": 0}
+    cancel_event = threading.Event()
+    running = {} # future -> (output path, row), to catch two rows overwriting each other
+    batch_started = time.time()
+
+    with ResultWriter(results_path, append=resume) as writer, ThreadPoolExecutor(max_workers=jobs) as executor:
+        def collect(finished):
+            for future in finished:
+                running.pop(future)
+                record = future.result() # FileNotFoundError (bad FFmpeg path) stops the batch
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+                writer.write(record)
+                if record["status"] != "done":
+                    print(f"Row {record['row']} {record['status']}: {record['error']}")
+
+        def reject(row_number, error, input_path=None):
+            counts["failed"] += 1
+            writer.write({"row": row_number, "input": input_path, "output_path": None, "status": "failed", "error": error,
+                          "started_at": None, "elapsed": 0.0, "similarity": None})
+            print(f"Row {row_number} failed: {error}")
+
+        try:
+            for row_number, row in iter_manifest(manifest_path):
+                if row_number in skip_rows:
+                    counts["resumed"] += 1
+                    continue
+                if isinstance(row, Exception):
+                    reject(row_number, str(row))
+                    continue
+                try:
+                    input_path, output_path, settings = parse_row(row, base_folder, output_folder, defaults)
+                    if settings.get("similarity") and settings["similarity"] not in SIMILARITY_MODES:
+                        raise ValueError(f"similarity: '{settings['similarity']}' is not one of: {', '.join(SIMILARITY_MODES)}")
+                except ValueError as e:
+                    reject(row_number, str(e), row.get("input"))
+                    continue
+                # Another row writes the same output if one in flight does, or if it was put in place during this batch
+                # (checked on disk, so no per-row state is kept; ctime also covers hardlinked cached renders)
+                output_key = os.path.abspath(output_path)
+                writer_row = next((row for key, row in running.values() if key == output_key), None)
+                if writer_row is not None:
+                    reject(row_number, f"output '{output_path}' is already written by row {writer_row}", input_path)
+                    continue
+                if _written_since(output_key, batch_started):
+                    reject(row_number, f"output '{output_path}' was already written by an earlier row", input_path)
+                    continue
+
+                noise_file = settings.pop("noise_file", None)
+                if noise_file not in noise_sources:
+                    if noise_file.lower() == "none":
+                        noise_sources[noise_file] = None
+                    elif not os.path.isfile(os.path.join(base_folder, noise_file)):
+                        reject(row_number, f"noise file '{noise_file}' not found", input_path)
+                        continue
+                    else:
+                        noise_sources[noise_file] = resolve_noise_source(ffmpeg_executable, os.path.join(base_folder, noise_file))
+
+                # Read ahead no further than the free workers, so the manifest is never loaded as a whole
+                while len(running) >= jobs:
+                    done_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done_futures)
+                future = executor.submit(_process_manifest_row, ffmpeg_executable, row_number, input_path, output_path,
+                                         settings, noise_sources[noise_file], threads_per_job if jobs > 1 else None,
+                                         cancel_event, metrics_sink, render_cache, stage_cache)
+                running[future] = (output_key, row_number)
+            while running:
+                done_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+                collect(done_futures)
+        except BaseException:
+            # Ctrl-C or a bad FFmpeg path: stop the running jobs; their rows are redone with --resume
+            cancel_event.set()
+            raise
+    return counts
+
+def _similarity_filters(mode, frame_size=OUTPUT_FRAME_SIZE):
+    """(normalise, subsample) for an SSIM comparison: the filter that brings a source to the output frame,
+    and the filters both sides go through before ssim in this SIMILARITY_MODES mode."""
+    width, height = frame_size
+    settings = SIMILARITY_MODES[mode]
+    normalise = f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p"
+    subsample = []
+    if settings["every"] > 1:
+        # Every Nth frame by number (fps= here re-times the stream and stalls the encode it shares a decode with)
+        subsample.append(f"select='not(mod(n\\,{settings['every']}))'")
+    if settings["scale"] != 1.0:
+        # Even dimensions for 4:2:0
+        subsample.append(f"scale={round(width * settings['scale'] / 2) * 2}:{round(height * settings['scale'] / 2) * 2}:flags=bilinear")
+    return normalise, subsample
+
+def _parse_ssim_percent(stderr):
+    """SSIM of the ssim filter's summary line as a percentage, or None if there is none."""
+    # A line like: "[Parsed_ssim_0 @ ...] SSIM Y:0.123 U:0.456 V:0.789 All:0.321 (...)"
+    match = re.search(r"SSIM.*?All:\s*([0-9\.]+)", stderr or "")
+    if not match:
+        return None
+    try:
+        return float(match.group(1)) * 100.0
+    except ValueError:
+        return None
+
+def compute_ssim_percent(ffmpeg_executable, original_path, processed_path, cancel_event=None, mode="full", timeout=None, threads=None):
+    """Returns average SSIM between two videos as a percentage (0–100). Returns None if unavailable or cancelled.
+    This decodes both files again; jobs can measure it while encoding instead (similarity= in _execute_ffmpeg_command).
+    mode is a SIMILARITY_MODES name ('fast' compares a subsample); timeout (seconds) is off by default."""
+    normalise, subsample = _similarity_filters(mode)
+    cmd = [ffmpeg_executable]
+    if threads:
+        cmd.extend(["-filter_complex_threads", str(threads), "-threads", str(threads)])
+    cmd.extend([
         "-i", original_path,
         "-i", processed_path,
         "-filter_complex",
-        "[0:v]scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2[v0];" +
-        "[1:v]scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2[v1];" +
+        f"[0:v]{','.join([normalise] + subsample)}[v0];" +
+        f"[1:v]{','.join([normalise] + subsample)}[v1];" +
         "[v0][v1]ssim",
         "-f", "null", "-"
-    ]
+    ])
     try:
         # Run FFmpeg, don't check exit code as ssim with -f null - often exits non-zero.
         # Capture stderr as that's where ssim stats are.
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60) # Added timeout
+        returncode, _, stderr = _run_ffmpeg(cmd, cancel_event=cancel_event, timeout=timeout)
+        if returncode is None:
+            return None # Cancelled
     except subprocess.TimeoutExpired:
         print(f"SSIM calculation timed out for {os.path.basename(original_path)} vs {os.path.basename(processed_path)}")
         return None
@@ -368,37 +1579,101 @@ def compute_ssim_percent(ffmpeg_executable, original_path, processed_path):
         print(f"Error running FFmpeg for SSIM calculation: {e}")
         return None
 
-    # Try to find a line like: "[Parsed_ssim_0 @ ...] SSIM Y:0.123 U:0.456 V:0.789 All:0.321 (...)"
-    # We are interested in the "All:0.321" part.
-    # The regex looks for "SSIM", then any characters non-greedily (.*?), then "All:", then captures the number.
-    match = re.search(r"SSIM.*?All:\s*([0-9\.]+)", result.stderr)
-
-    if match:
-        try:
-            ssim_float = float(match.group(1))
-            return ssim_float * 100.0  # Convert to percentage
-        except ValueError:
-            print(f"Could not convert SSIM value '{match.group(1)}' to float.")
-            # Print the full stderr if conversion fails, as the regex matched something
-            print(f"Full FFmpeg stderr for {os.path.basename(original_path)} on conversion error:\n{result.stderr}")
-            return None
-    else:
+    ssim_percent = _parse_ssim_percent(stderr)
+    if ssim_percent is None:
         print(f"SSIM 'All:' pattern not found in FFmpeg stderr for {os.path.basename(original_path)}.")
         # Print the full stderr if no regex match
-        print(f"Full FFmpeg stderr for {os.path.basename(original_path)} on pattern not found:\n{result.stderr}")
-        return None
+        print(f"Full FFmpeg stderr for {os.path.basename(original_path)} on pattern not found:\n{stderr}")
+    return ssim_percent
+
+def compute_ssim_many(ffmpeg_executable, pairs, mode="full", jobs=None, cancel_event=None):
+    """SSIM percentages for (original_path, processed_path) pairs, measured in parallel. Returns a list in pair order."""
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    jobs, threads_per_job = plan_thread_budget(jobs, file_count=len(pairs))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(
+            lambda pair: compute_ssim_percent(ffmpeg_executable, pair[0], pair[1], cancel_event=cancel_event, mode=mode,
+                                              threads=threads_per_job if jobs > 1 else None),
+            pairs))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process videos for TikTok. Removes metadata, resizes, trims, and optionally adjusts visuals and audio.")
     parser.add_argument("-f", "--file", type=str, help="Filename of a specific video to process (must be in the input folder). Processes all .mp4 files if not specified.")
+    parser.add_argument("--noise_file", "--noise-file", dest="noise_file", type=str, help="Background noise file to mix in (default: sounds/background_noise.mp3 if present, else generated white noise).")
     parser.add_argument("--hflip", action="store_true", help="Horizontally flip the video.")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="Number of videos to process in parallel (default: auto, based on CPU cores).")
+    parser.add_argument("--resume", action="store_true", help="Keep the output folder and skip files that finished in a previous (crashed or interrupted) run.")
+    parser.add_argument("--profile", choices=sorted(ENCODING_PROFILES), default=DEFAULT_PROFILE, help="Encoding speed profile (default: %(default)s).")
+    parser.add_argument("--deadline", type=float, help="Target wall time for the whole batch in seconds; picks the slowest x264 preset predicted to finish in time.")
+    parser.add_argument("--renditions", type=str, help=f"Extra outputs per clip from the same pass, comma-separated: {', '.join(RENDITION_PRESETS)} (e.g. 720p,poster).")
+    parser.add_argument("--cache", action="store_true", help="Reuse earlier renders of the same input with the same settings. NOTE: random effects (CRF, hue, grain, lens, zoom/pan) are then seeded from the clip and its settings, so re-rendering a clip gives the same output, not a new variation.")
+    parser.add_argument("--cache-budget", type=float, default=20.0, help="Disk budget of the render cache in GB (default: %(default)s).")
+    parser.add_argument("--stage-cache", action="store_true", help="Keep each clip's fitted and zoomed frames, so re-runs that only change text, flip, speed or audio skip those stages. NOTE: random effects (including the zoom/pan path) are then seeded from the clip and its early-stage settings, so re-runs no longer vary them.")
+    parser.add_argument("--stage-cache-budget", type=float, default=10.0, help="Disk budget of the stage cache in GB (default: %(default)s).")
+    parser.add_argument("--segments", type=int, help="Render each long clip as this many time segments in parallel and join them (0 = one per core). Speeds up batches with fewer clips than cores.")
+    parser.add_argument("--ken-burns", choices=sorted(KEN_BURNS_ENGINES), default=DEFAULT_KEN_BURNS_ENGINE, help="Zoom/pan engine (default: %(default)s: the crop table for slow zooms, zoompan for fast ones; 'zoompan' alone is the previous filter).")
+    parser.add_argument("--aac-encoder", choices=AAC_ENCODERS, default=DEFAULT_AAC_ENCODER, help="Audio encoder (default: %(default)s, FFmpeg's own). libfdk_aac is only in some FFmpeg builds; jobs are skipped if it is missing.")
+    parser.add_argument("--keep-fps", action="store_true", help="Keep each input's frame rate instead of converting to 30 fps.")
+    parser.add_argument("--similarity", choices=sorted(SIMILARITY_MODES), help="Report each output's SSIM against its source, measured during the encode ('fast' samples every 5th frame at half size).")
+    parser.add_argument("--metrics", type=str, help="Append per-job metrics to this JSON-lines file, or write a Prometheus textfile if it ends in .prom.")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process each .mp4 file as soon as it has finished landing in the input folder (inotify, or polling where unavailable). Keeps the output folder.")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS, help="With --watch, seconds a file's size must stay unchanged before it is processed (default: %(default)s).")
+    parser.add_argument("--manifest", type=str, help="CSV or JSON-lines file with one row per input and its own settings (columns: input, output, text, rotation, speed, zoom, hflip, noise_file... see README). Read as a stream; the command line's options are the defaults for every row.")
+    parser.add_argument("--results", type=str, help="With --manifest, JSON-lines file that gets one result record per row as it finishes (default: next to the manifest, '<name>.results.jsonl').")
+    parser.add_argument("--capabilities", action="store_true", help="Print what the FFmpeg build supports (version, threading, key filters and encoders), then exit.")
+    parser.add_argument("--filter-report", action="store_true", help="Print the optimised video filter chain with its estimated per-stage cost, then exit.")
     args = parser.parse_args()
 
+    if args.capabilities:
+        ffmpeg_path = get_ffmpeg_path()
+        capabilities = get_capabilities(ffmpeg_path)
+        if capabilities is None:
+            print(f"Could not run FFmpeg at '{ffmpeg_path}'.")
+            exit(1)
+        print(f"FFmpeg: {ffmpeg_path} (version {capabilities['version']}, threading {'on' if capabilities['threads'] else 'off'})")
+        print(f"{len(capabilities['filters'])} filters, {len(capabilities['encoders'])} encoders")
+        for name in ("zoompan", "drawtext", "lenscorrection", "rotate", "noise", "anoisesrc", "ssim"):
+            info = capabilities["filters"].get(name)
+            print(f"  filter {name:<15} {'missing' if info is None else ('slice-threaded' if info['slice_threads'] else 'single-threaded')}")
+        for name in ("libx264", "libfdk_aac", "aac", "mjpeg"):
+            print(f"  encoder {name:<14} {'available' if name in capabilities['encoders'] else 'missing'}")
+        exit(0)
+
+    if args.filter_report:
+        graph = build_video_filter_graph(horizontal_flip=args.hflip, ken_burns=args.ken_burns, keep_source_fps=args.keep_fps)
+        print("Filter chain as built:")
+        print(format_cost_report(graph))
+        print(f"\nFilter chain after optimisation (for an 8-bit 4:2:0 source, pinned to {PINNED_PIX_FMT}):")
+        print(format_cost_report(graph.optimize(PINNED_PIX_FMT)))
+        print(f"\nVideo filter chain: {graph.optimize(PINNED_PIX_FMT).to_string()}")
+        exit(0)
+
     input_video_folder = "videos"
     output_video_folder = "treated"
 
+    if args.watch and args.file:
+        print("Error: --watch processes every file that lands in the input folder; it cannot be combined with --file.")
+        exit(1)
+    if args.manifest:
+        if args.file or args.watch:
+            print("Error: --manifest lists its own inputs; it cannot be combined with --file or --watch.")
+            exit(1)
+        if not os.path.isfile(args.manifest):
+            print(f"Error: Manifest '{args.manifest}' not found.")
+            exit(1)
+        try:
+            manifest_format(args.manifest)
+        except ValueError as e:
+            print(f"Error: {e}.")
+            exit(1)
+    if (args.resume or args.watch or args.manifest) and os.path.isdir(output_video_folder):
+        # Keep finished outputs; only half-written .part files from the interrupted run are dropped
+        removed_parts = remove_stale_parts(output_video_folder)
+        print(f"{'Resuming into' if args.resume else 'Keeping'} existing output folder: {output_video_folder}" + (f" (removed {removed_parts} partial file(s))" if removed_parts else ""))
     # Auto-clear output folder contents
-    if os.path.exists(output_video_folder):
+    elif os.path.exists(output_video_folder):
         print(f"Clearing contents of output folder: {output_video_folder}")
         for item_name in os.listdir(output_video_folder):
             item_path = os.path.join(output_video_folder, item_name)
@@ -421,7 +1696,9 @@ if __name__ == "__main__":
     print(f"Using FFmpeg from: {ffmpeg_path}")
 
     # Check if input folder exists, especially if processing all files
-    if not args.file and not os.path.isdir(input_video_folder):
+    if args.manifest:
+        pass # Inputs are listed in the manifest
+    elif not args.file and not os.path.isdir(input_video_folder):
         print(f"Error: Input folder '{input_video_folder}' not found.")
         print(f"Please create it and place your .mp4 videos inside, or specify a single file with --file.")
         exit(1)
@@ -430,47 +1707,82 @@ if __name__ == "__main__":
         print(f"Warning: Input folder '{input_video_folder}' not found, but a specific file was requested. Assuming it's accessible.")
         # The check for specific file existence is now inside process_videos
 
-    # Determine if default background noise file exists
-    default_noise_path = "sounds/background_noise.mp3"
-    actual_noise_path = None
-    if os.path.isfile(default_noise_path):
-        actual_noise_path = default_noise_path
-        print(f"Default background noise file found: {actual_noise_path}. It will be used.")
-    else:
-        # Generate white noise using FFmpeg if no file exists
-        temp_noise_path = os.path.join(output_video_folder, "temp_noise.mp3")
+    # Background noise: the given (or default) noise file, decoded once to a cached 48 kHz PCM bed,
+    # or noise generated inside each job's filter graph if there is no file
+    if args.noise_file and not os.path.isfile(args.noise_file):
+        print(f"Error: Noise file '{args.noise_file}' not found.")
+        exit(1)
+    actual_noise_path = resolve_noise_source(ffmpeg_path, args.noise_file)
+    print(f"Background noise: {actual_noise_path}")
+    if args.cache or args.stage_cache:
+        print(f"Note: with {' and '.join(o for o, on in (('--cache', args.cache), ('--stage-cache', args.stage_cache)) if on)}, "
+              "random effects are seeded from each clip and its settings: re-rendering a clip repeats its earlier variation. "
+              "Run without them for a fresh one.")
+
+    if args.manifest:
+        results_path = args.results or default_results_path(args.manifest)
+        row_defaults = {"horizontal_flip": args.hflip, "encoding_profile": args.profile, "renditions": parse_renditions(args.renditions),
+                        "similarity": args.similarity, "segments": args.segments, "ken_burns": args.ken_burns,
+                        "keep_source_fps": args.keep_fps, "aac_encoder": args.aac_encoder}
         try:
-            # Create 30 seconds of white noise (already at low volume)
-            noise_cmd = [
-                ffmpeg_path,
-                "-f", "lavfi",
-                "-i", "anoisesrc=amplitude=0.05:color=white:duration=30",
-                "-c:a", "libmp3lame",
-                "-b:a", "128k",
-                "-y",
-                temp_noise_path
-            ]
-            subprocess.run(noise_cmd, check=True, capture_output=True)
-            actual_noise_path = temp_noise_path
-            print(f"No background noise file found. Generated low-volume white noise.")
-        except Exception as e:
-            print(f"Failed to generate white noise: {e}")
-            print("Proceeding without background noise.")
-
-    processed_count, skipped_count = process_videos(input_video_folder, output_video_folder, ffmpeg_path, specific_filename=args.file, noise_audio_path=actual_noise_path, horizontal_flip=args.hflip)
-
-    print(f"\nProcessing complete.")
-    print(f"Successfully processed: {processed_count} files.")
-    print(f"Skipped/Failed: {skipped_count} files.")
-    if skipped_count > 0:
-        print("Check the console output above for error details on failed files.")
-    print(f"Cleaned videos are in: {output_video_folder}")
-    
-    # Clean up temporary noise file if it was created
-    temp_noise_path = os.path.join(output_video_folder, "temp_noise.mp3")
-    if os.path.exists(temp_noise_path):
+            counts = process_manifest(args.manifest, results_path, output_video_folder, ffmpeg_path, noise_audio_path=actual_noise_path,
+                                      jobs=args.jobs, defaults=row_defaults, resume=args.resume,
+                                      metrics_sink=open_metrics_sink(args.metrics),
+                                      render_cache=open_render_cache(budget_bytes=int(args.cache_budget * 1024 ** 3)) if args.cache else None,
+                                      stage_cache=open_stage_cache(budget_bytes=int(args.stage_cache_budget * 1024 ** 3)) if args.stage_cache else None)
+        except KeyboardInterrupt:
+            print("\nProcessing interrupted. Run again with --resume to continue where it stopped.")
+            exit(130)
+        except FileNotFoundError:
+            print("Halting processing due to FFmpeg not being found.")
+            exit(1)
+        print("\nManifest complete: " + (", ".join(f"{count} {status}" for status, count in counts.items() if count) or "no rows") + ".")
+        print(f"Per-row results are in: {results_path}")
+        exit(1 if counts.get("failed") else 0)
+
+    if args.watch:
         try:
-            os.remove(temp_noise_path)
-            print("Temporary noise file removed.")
-        except Exception as e:
-            print(f"Failed to remove temporary noise file: {e}") 
\ No newline at end of file
+            watch_videos(input_video_folder, output_video_folder, ffmpeg_path, noise_audio_path=actual_noise_path, horizontal_flip=args.hflip, jobs=args.jobs,
+                         encoding_profile=args.profile, metrics_sink=open_metrics_sink(args.metrics),
+                         renditions=parse_renditions(args.renditions),
+                         render_cache=open_render_cache(budget_bytes=int(args.cache_budget * 1024 ** 3)) if args.cache else None,
+                         stage_cache=open_stage_cache(budget_bytes=int(args.stage_cache_budget * 1024 ** 3)) if args.stage_cache else None,
+                         similarity=args.similarity, segments=args.segments, ken_burns=args.ken_burns,
+                         keep_source_fps=args.keep_fps, aac_encoder=args.aac_encoder, settle_seconds=args.settle)
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+            exit(130)
+        exit(1) # Only returns on its own if FFmpeg could not be run
+
+    interrupted = False
+    try:
+        processed_count, skipped_count, results = process_videos(input_video_folder, output_video_folder, ffmpeg_path, specific_filename=args.file, noise_audio_path=actual_noise_path, horizontal_flip=args.hflip, jobs=args.jobs,
+                                                                 resume=args.resume, encoding_profile=args.profile, deadline=args.deadline,
+                                                                 metrics_sink=open_metrics_sink(args.metrics),
+                                                                 renditions=parse_renditions(args.renditions),
+                                                                 render_cache=open_render_cache(budget_bytes=int(args.cache_budget * 1024 ** 3)) if args.cache else None,
+                                                                 stage_cache=open_stage_cache(budget_bytes=int(args.stage_cache_budget * 1024 ** 3)) if args.stage_cache else None,
+                                                                 similarity=args.similarity, segments=args.segments,
+                                                                 ken_burns=args.ken_burns, keep_source_fps=args.keep_fps,
+                                                                 aac_encoder=args.aac_encoder)
+
+        print(f"\nProcessing complete.")
+        print(f"Successfully processed: {processed_count} files.")
+        resumed_count = sum(1 for r in results if r["status"] == "resumed")
+        if resumed_count:
+            print(f"Already finished in an earlier run: {resumed_count} files.")
+        print(f"Skipped/Failed: {skipped_count} files.")
+        for result in results:
+            if result.get("similarity") is not None:
+                print(f"  - {result['filename']}: SSIM {result['similarity']:.2f}%")
+        for result in results:
+            if result["status"] not in ("done", "resumed"):
+                print(f"  - {result['filename']}: {result['status']} ({result['error']})")
+        if skipped_count > 0:
+            print("Check the console output above for error details on failed files (re-run with --resume to retry only those).")
+        print(f"Cleaned videos are in: {output_video_folder}")
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\nProcessing interrupted. Run again with --resume to continue where it stopped.")
+    if interrupted:
+        exit(130) 
\ No newline at end of file
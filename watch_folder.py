@@ -0,0 +1,191 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Watch mode: new inputs are picked up as they land instead of by a batch rescan. inotify (Linux) wakes the
+# watcher when a file in the folder is written or moved in; elsewhere, or if inotify is unavailable, the folder
+# is scanned every poll interval. Either way a file is only handed out once its size and modification time
+# have not changed for the settle time, so half-uploaded files are never processed.
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify event bits (linux/inotify.h)
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MOVED_FROM | _IN_DELETE # Also removals, to forget them
+_EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, name length
+
+def _signature(path):
+    """(size, mtime in ns) of a regular file, or None if it is gone or not a file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _open_inotify(folder):
+    """(fd, None) of an inotify instance watching folder, or (None, reason) if inotify is not available."""
+    if not hasattr(os, "O_NONBLOCK") or not ctypes.util.find_library("c"):
+        return None, "inotify is not available on this platform"
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None, "inotify is not available on this platform"
+    fd = init(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+    if fd < 0:
+        return None, os.strerror(ctypes.get_errno())
+    if add_watch(fd, os.fsencode(folder), _WATCH_MASK) < 0:
+        reason = os.strerror(ctypes.get_errno()) # e.g. the per-user watch limit is reached
+        os.close(fd)
+        return None, reason
+    return fd, None
+
+class FolderWatcher:
+    """
+    Reports files with one of the given extensions that land (are created, written or moved) in a folder,
+    once they have stopped changing for settle_seconds. Files present when the watcher starts count as landed.
+    A file is reported again only if its content changes (a new upload under the same name).
+    """
+
+    def __init__(self, folder, extensions=(".mp4",), settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 use_inotify=True):
+        self.folder = folder
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self._candidates = {} # name -> (signature, time of its last change, time first seen)
+        self._handled = {} # name -> signature it was reported with, while the file is in the folder
+        self._fd, self.fallback_reason = _open_inotify(folder) if use_inotify else (None, "polling requested")
+        self.scan()
+
+    @property
+    def mode(self):
+        return "inotify" if self._fd is not None else f"polling every {self.poll_interval:g}s"
+
+    def _wanted(self, name):
+        # Hidden names are temporary files of most uploaders (rsync, browsers...)
+        return not name.startswith(".") and name.lower().endswith(self.extensions)
+
+    def _note(self, name, now):
+        signature = _signature(os.path.join(self.folder, name))
+        if signature is None:
+            # Gone (deleted or moved away): a file landing under this name later is a new one
+            self._handled.pop(name, None)
+        if signature is None or self._handled.get(name) == signature:
+            self._candidates.pop(name, None)
+            return
+        previous = self._candidates.get(name)
+        if previous is None:
+            self._candidates[name] = (signature, now, now)
+        elif previous[0] != signature:
+            self._candidates[name] = (signature, now, previous[2])
+
+    def scan(self):
+        """Looks at every file in the folder (at start, when polling, and after an inotify queue overflow)."""
+        now = time.monotonic()
+        try:
+            names = [n for n in os.listdir(self.folder) if self._wanted(n)]
+        except OSError:
+            # Unreadable for now (e.g. a network share reconnecting): nothing can settle, but what was handled is kept
+            self._candidates.clear()
+            return
+        for name in set(self._candidates) - set(names):
+            del self._candidates[name]
+        for name in set(self._handled) - set(names):
+            del self._handled[name]
+        for name in names:
+            self._note(name, now)
+
+    def _read_events(self):
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    names.add(None) # Events were dropped: rescan everything
+                elif mask & _IN_IGNORED:
+                    # The folder itself was removed or unmounted; keep going by polling
+                    self.close()
+                    self.fallback_reason = "the watched folder went away"
+                    names.add(None)
+                    return names
+                elif name:
+                    names.add(os.fsdecode(name))
+        return names
+
+    def _next_due(self, now):
+        """Seconds until the earliest candidate could have settled, or None."""
+        if not self._candidates:
+            return None
+        return max(0.0, min(changed + self.settle_seconds for _, changed, _ in self._candidates.values()) - now)
+
+    def poll(self, timeout=None):
+        """
+        Waits up to timeout seconds (default: the poll interval) for files to settle and returns them as
+        [(name, seconds since it was first seen)], oldest first. Returns early as soon as a file has settled.
+        """
+        timeout = self.poll_interval if timeout is None else timeout
+        due = self._next_due(time.monotonic())
+        if due is not None:
+            timeout = min(timeout, due)
+        if self._fd is not None:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            now = time.monotonic()
+            if readable:
+                names = self._read_events()
+                if None in names:
+                    self.scan()
+                for name in names - {None}:
+                    if self._wanted(name):
+                        self._note(name, now)
+            # No events for a while does not prove a file is complete; its size is checked again below
+            for name in list(self._candidates):
+                self._note(name, now)
+        else:
+            time.sleep(timeout)
+            self.scan()
+
+        now = time.monotonic()
+        settled = []
+        for name, (signature, changed, first_seen) in list(self._candidates.items()):
+            if now - changed >= self.settle_seconds and signature[0] > 0:
+                settled.append((first_seen, name))
+                self._handled[name] = signature
+                del self._candidates[name]
+        return [(name, now - first_seen) for first_seen, name in sorted(settled)]
+
+    def pending(self):
+        """Names seen but not settled yet."""
+        return sorted(self._candidates)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()